@@ -0,0 +1,182 @@
+"""
+Cache LRU de blocs de 512 octets entre le driver de fichiers (FAT) et la carte SD.
+
+Les secteurs de FAT et de répertoire sont relus à chaque os.listdir() ou ajout dans un fichier ;
+les garder en RAM évite de repasser par le bus SPI. Seuls les accès à un bloc unique passent par
+le cache, les lectures/écritures multi-blocs (données des fichiers) vont directement à la carte.
+
+Modes:
+ - write-through (par défaut): chaque écriture part immédiatement sur la carte
+ - write-back: les blocs modifiés restent en RAM jusqu'à sync() (ioctl 3, os.sync()) ou éviction
+
+Exemple:
+    cache = BlockCache(sd, BlockCache.sizeForHeap())
+    os.mount(cache, "/sd")
+    cache.ioctl(IOCTL_CACHE_HITS, 0)
+"""
+import gc
+from micropython import const
+
+_BLOCK_SIZE = const(512)
+
+# ioctl standards du protocole block device
+_IOCTL_INIT = const(1)
+_IOCTL_DEINIT = const(2)
+_IOCTL_SYNC = const(3)
+_IOCTL_BLOCK_ERASE = const(6)
+
+# ioctl propres au cache
+IOCTL_CACHE_HITS = const(0x100)
+IOCTL_CACHE_MISSES = const(0x101)
+IOCTL_CACHE_RESET_STATS = const(0x102)
+IOCTL_CACHE_INVALIDATE = const(0x103)
+
+
+class BlockCache:
+    def __init__(self, dev, nblocks=8, writeback=False):
+        self.dev = dev
+        self.nblocks = nblocks
+        self.writeback = writeback
+
+        # Tous les buffers sont alloués une fois pour toutes
+        self.buf = bytearray(nblocks * _BLOCK_SIZE)
+        self.mv = memoryview(self.buf)
+        self.tags = [-1] * nblocks  # numéro du bloc présent dans chaque emplacement
+        self.stamps = [0] * nblocks  # date du dernier accès, pour l'éviction LRU
+        self.dirty = bytearray(nblocks)
+        self.clock = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Nombre de blocs qu'il est raisonnable d'allouer en laissant au moins reserve octets de libre
+    """
+    @staticmethod
+    def sizeForHeap(reserve=32768, maxBlocks=32):
+        gc.collect()
+        return max(1, min(maxBlocks, (gc.mem_free() - reserve) // _BLOCK_SIZE))
+
+    def _slot(self, i):
+        return self.mv[i * _BLOCK_SIZE:(i + 1) * _BLOCK_SIZE]
+
+    def _find(self, block_num):
+        tags = self.tags
+        for i in range(self.nblocks):
+            if tags[i] == block_num:
+                return i
+        return -1
+
+    def _touch(self, i):
+        self.clock += 1
+        self.stamps[i] = self.clock
+
+    def _evict(self):
+        # Emplacement libre, sinon le moins récemment utilisé
+        stamps = self.stamps
+        victim = 0
+        for i in range(self.nblocks):
+            if self.tags[i] < 0:
+                victim = i
+                break
+            if stamps[i] < stamps[victim]:
+                victim = i
+        if self.dirty[victim]:
+            self.dev.writeblocks(self.tags[victim], self._slot(victim))
+            self.dirty[victim] = 0
+        self.tags[victim] = -1
+        return victim
+
+    def readblocks(self, block_num, buf):
+        nblocks = len(buf) // _BLOCK_SIZE
+        if nblocks == 1:
+            i = self._find(block_num)
+            if i >= 0:
+                self.hits += 1
+            else:
+                self.misses += 1
+                i = self._evict()
+                self.dev.readblocks(block_num, self._slot(i))
+                self.tags[i] = block_num
+            self._touch(i)
+            buf[:] = self._slot(i)
+            return
+
+        self.dev.readblocks(block_num, buf)
+        # Les blocs en cache peuvent être plus récents que la carte (write-back)
+        mv = memoryview(buf)
+        for i in range(self.nblocks):
+            offset = self.tags[i] - block_num
+            if self.dirty[i] and 0 <= offset < nblocks:
+                mv[offset * _BLOCK_SIZE:(offset + 1) * _BLOCK_SIZE] = self._slot(i)
+
+    def writeblocks(self, block_num, buf):
+        nblocks = len(buf) // _BLOCK_SIZE
+        if nblocks == 1:
+            i = self._find(block_num)
+            if i < 0:
+                i = self._evict()
+                self.tags[i] = block_num
+            self._touch(i)
+            self._slot(i)[:] = buf
+            if self.writeback:
+                self.dirty[i] = 1
+            else:
+                self.dev.writeblocks(block_num, buf)
+            return
+
+        self.dev.writeblocks(block_num, buf)
+        # On garde les copies en cache cohérentes avec ce qui vient d'être écrit
+        mv = memoryview(buf)
+        for i in range(self.nblocks):
+            offset = self.tags[i] - block_num
+            if 0 <= offset < nblocks:
+                self._slot(i)[:] = mv[offset * _BLOCK_SIZE:(offset + 1) * _BLOCK_SIZE]
+                self.dirty[i] = 0
+
+    """
+    Écrit sur la carte tous les blocs modifiés
+    """
+    def sync(self):
+        for i in range(self.nblocks):
+            if self.dirty[i]:
+                self.dev.writeblocks(self.tags[i], self._slot(i))
+                self.dirty[i] = 0
+
+    """
+    Vide le cache sans rien écrire (carte retirée ou remplacée)
+    """
+    def invalidate(self):
+        for i in range(self.nblocks):
+            self.tags[i] = -1
+            self.dirty[i] = 0
+
+    """
+    Oublie les blocs de la plage donnée (effacée ou réécrite sans passer par le cache)
+    """
+    def discard(self, block_num, count):
+        for i in range(self.nblocks):
+            if 0 <= self.tags[i] - block_num < count:
+                self.tags[i] = -1
+                self.dirty[i] = 0
+
+    def ioctl(self, op, arg):
+        if op == _IOCTL_SYNC:
+            self.sync()
+            return 0
+        if op == _IOCTL_DEINIT:
+            self.sync()
+        elif op == _IOCTL_BLOCK_ERASE:
+            self.discard(arg, 1)
+        elif op == IOCTL_CACHE_HITS:
+            return self.hits
+        elif op == IOCTL_CACHE_MISSES:
+            return self.misses
+        elif op == IOCTL_CACHE_RESET_STATS:
+            self.hits = 0
+            self.misses = 0
+            return 0
+        elif op == IOCTL_CACHE_INVALIDATE:
+            self.invalidate()
+            return 0
+        return self.dev.ioctl(op, arg)
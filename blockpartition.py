@@ -0,0 +1,73 @@
+"""
+Découpe d'un block device en zones indépendantes, pour avoir sur la même carte SD une partie FAT
+(settings modifiables à la main) et une partie LittleFS (logs).
+
+Implémente l'interface étendue (offset dans le bloc) demandée par os.VfsLfs2. La carte SD n'a
+pas besoin d'effacement avant écriture, l'ioctl d'effacement ne fait donc rien.
+
+Exemple:
+    part = BlockPartition(sd, sd.sectors - 65536, 65536)
+    os.VfsLfs2.mkfs(part, readsize=512, progsize=512)
+    os.mount(os.VfsLfs2(part, readsize=512, progsize=512), "/sdlog")
+"""
+from micropython import const
+
+_BLOCK_SIZE = const(512)
+
+
+class BlockPartition:
+    def __init__(self, dev, start, count):
+        self.dev = dev
+        self.start = start
+        self.count = count
+        self.scratch = bytearray(_BLOCK_SIZE)  # Pour les accès partiels à un bloc
+
+    def _check(self, block_num, nbytes):
+        if block_num < 0 or block_num * _BLOCK_SIZE + nbytes > self.count * _BLOCK_SIZE:
+            raise OSError(5)  # EIO, en dehors de la zone
+
+    def readblocks(self, block_num, buf, offset=0):
+        self._check(block_num, offset + len(buf))
+        if not offset and not len(buf) % _BLOCK_SIZE:
+            self.dev.readblocks(self.start + block_num, buf)
+            return
+        # Accès partiel: on passe bloc par bloc par le buffer de travail
+        mv = memoryview(buf)
+        done = 0
+        block_num += offset // _BLOCK_SIZE
+        offset %= _BLOCK_SIZE
+        while done < len(buf):
+            n = min(_BLOCK_SIZE - offset, len(buf) - done)
+            self.dev.readblocks(self.start + block_num, self.scratch)
+            mv[done:done + n] = self.scratch[offset:offset + n]
+            done += n
+            block_num += 1
+            offset = 0
+
+    def writeblocks(self, block_num, buf, offset=0):
+        self._check(block_num, offset + len(buf))
+        if not offset and not len(buf) % _BLOCK_SIZE:
+            self.dev.writeblocks(self.start + block_num, buf)
+            return
+        mv = memoryview(buf)
+        done = 0
+        block_num += offset // _BLOCK_SIZE
+        offset %= _BLOCK_SIZE
+        while done < len(buf):
+            n = min(_BLOCK_SIZE - offset, len(buf) - done)
+            if n < _BLOCK_SIZE:
+                self.dev.readblocks(self.start + block_num, self.scratch)
+            self.scratch[offset:offset + n] = mv[done:done + n]
+            self.dev.writeblocks(self.start + block_num, self.scratch)
+            done += n
+            block_num += 1
+            offset = 0
+
+    def ioctl(self, op, arg):
+        if op == 4:  # nombre de blocs
+            return self.count
+        if op == 5:  # taille d'un bloc
+            return _BLOCK_SIZE
+        if op == 6:  # effacement d'un bloc: inutile sur une carte SD
+            return 0
+        return self.dev.ioctl(op, arg)
@@ -2,9 +2,19 @@
 import micropython
 import machine
 import gc
+import os
 
 micropython.alloc_emergency_exception_buf(100)
 
+# Mise à jour OTA (voir ota.py, mêmes chemins). Ce code ne fait jamais partie d'une mise à jour:
+# le retour arrière ne dépend pas des fichiers remplacés.
+OTA_NEW_DIR = "/ota_new"
+OTA_OLD_DIR = "/ota_old"
+OTA_PENDING_PATH = "/ota.pending"
+OTA_TRIAL_PATH = "/ota.trial"
+OTA_FILES_PATH = "/ota.files"
+OTA_TRIAL_BOOTS = 2  # Démarrages sans confirmation tolérés (une coupure de contact pendant l'essai)
+
 
 def reboot():
     machine.reset()
@@ -15,3 +25,88 @@ def mem_info():
     print("Free: "+str(gc.mem_free()))
     print("% free: "+str(gc.mem_free()/(gc.mem_free()+gc.mem_alloc())))
 
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def _otaOperations():
+    with open(OTA_FILES_PATH, "r") as file:
+        return [line for line in file.read().split("\n") if line]
+
+
+def _writeTrial(version, boots):
+    with open(OTA_TRIAL_PATH, "w") as file:
+        file.write(f"{version},{boots}")
+
+
+"""
+Remplace les fichiers par ceux de OTA_NEW_DIR, les anciens étant gardés dans OTA_OLD_DIR.
+Chaque étape est un renommage: après une coupure, la fonction relancée reprend où elle en était.
+"""
+def otaSwap():
+    with open(OTA_PENDING_PATH, "r") as file:
+        version = file.read()
+    try:
+        os.mkdir(OTA_OLD_DIR)
+    except OSError:
+        pass
+    for operation in _otaOperations():
+        name = operation.lstrip("+-")
+        old = OTA_OLD_DIR + "/" + name
+        new = OTA_NEW_DIR + "/" + name
+        if operation[0] == "-":
+            if _exists(name) and not _exists(old):
+                os.rename(name, old)
+            continue
+        if not _exists(new):  # Déjà en place
+            continue
+        if _exists(name):
+            if _exists(old):
+                os.remove(name)
+            else:
+                os.rename(name, old)
+        os.rename(new, name)
+    _writeTrial(version, 1)
+    os.remove(OTA_PENDING_PATH)
+    print(f"[Boot][Info] Update {version} installed, on trial")
+
+
+"""
+Remet les fichiers gardés dans OTA_OLD_DIR et supprime ceux ajoutés par la mise à jour
+"""
+def otaRollback():
+    for operation in _otaOperations():
+        name = operation.lstrip("+-")
+        old = OTA_OLD_DIR + "/" + name
+        if _exists(old):
+            if _exists(name):
+                os.remove(name)
+            os.rename(old, name)
+        elif operation[0] == "+" and _exists(name):
+            os.remove(name)
+    os.remove(OTA_TRIAL_PATH)
+    print("[Boot][Error] Update not confirmed by main.py, previous version restored")
+
+
+def otaBoot():
+    try:
+        if _exists(OTA_PENDING_PATH):
+            otaSwap()
+        elif _exists(OTA_TRIAL_PATH):
+            # Démarrages en essai sans confirmation: retour arrière au-delà de OTA_TRIAL_BOOTS
+            with open(OTA_TRIAL_PATH, "r") as file:
+                version, boots = file.read().split(",")
+            if int(boots) >= OTA_TRIAL_BOOTS:
+                otaRollback()
+            else:
+                _writeTrial(version, int(boots) + 1)
+    except (OSError, ValueError) as err:
+        print(f"[Boot][Error] OTA : {err}")
+
+
+otaBoot()
@@ -1,12 +1,225 @@
 import machine
+import ujson
+import utime
+import uasyncio as asyncio
+from micropython import const
 
+import logger
+import compress
+import netmonitor
 import sim800l
-from constants import PIN_GSM_RX, PIN_GSM_TX, PIN_GSM_RST
+import sms
+import telemetry
+import uplink
+from constants import PIN_GSM_RX, PIN_GSM_TX, PIN_GSM_RST, PIN_GSM_DTR, PIN_GSM_RING, PIN_GSM_RTS, PIN_GSM_CTS
+
+_UPLOAD_INTERVAL_S = const(30)  # Attente quand il n'y a rien à envoyer ou après un échec
+_COMPRESS_MIN_SIZE = const(256)  # En dessous, l'en-tête zlib et le CPU ne valent pas le gain
+_HTTP_UNSUPPORTED_MEDIA_TYPE = const(415)
+_UART_BAUDRATE = const(38400)  # Débit à l'ouverture, avant détection et négociation
+_UART_RXBUF = const(2048)  # Réponses HTTPREAD de 512 octets et URC en rafale sans débordement
+_MODEM_RATES = (460800, 115200)  # Débits visés, du plus rapide au plus sûr
+_MODEM_CACHE_PATH = "/modem.json"  # État du modem gardé entre deux redémarrages de l'ESP32
 
 
 class comManager:
     def __init__(self):
-        self.uart = machine.UART(1, 38400, rx=PIN_GSM_RX, tx=PIN_GSM_TX)
-        self.gsm = sim800l.Modem(self.uart, pin="1234", rst_pin=PIN_GSM_RST)
+        self.uart = machine.UART(1, _UART_BAUDRATE, rx=PIN_GSM_RX, tx=PIN_GSM_TX, rxbuf=_UART_RXBUF)
+        self.gsm = sim800l.Modem(self.uart, pin="1234", rst_pin=PIN_GSM_RST, dtr_pin=PIN_GSM_DTR,
+                                 ring_pin=PIN_GSM_RING, baudrate=_UART_BAUDRATE)
+        self.session = None  # Session HTTP gardée ouverte entre deux envois
+        self.compressAccepted = True  # Passe à False si le serveur refuse Content-Encoding (415)
+        self.httpLock = asyncio.Lock()  # Le modem n'a qu'un contexte HTTP: une requête à la fois
+        self.ready = asyncio.Event()  # Levé quand le modem est initialisé
+        self.monitor = netmonitor.NetworkMonitor(self.gsm, self.httpLock)
+        self.scheduler = uplink.UploadScheduler(self.monitor)
+        self.smsOutbox = sms.SmsOutbox(self.gsm, self.monitor)  # Alertes, envoyées dans l'ordre
+
+    def _loadModemCache(self):
+        try:
+            with open(_MODEM_CACHE_PATH, "r") as file:
+                return ujson.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _saveModemCache(self, cache):
+        try:
+            with open(_MODEM_CACHE_PATH, "w") as file:
+                ujson.dump(cache, file)
+        except OSError as err:
+            logger.warn(f"Modem cache not saved : {err}", "ComManager")
+
+    """
+    Initialise le modem (sans reset s'il répond déjà, voir Modem.initialize_async), monte le débit
+    de l'UART et active la veille si demandé. Réessaie jusqu'au succès, puis lance la surveillance
+    du réseau et l'envoi des SMS.
+    """
+    async def start(self, store):
+        while True:
+            cache = self._loadModemCache()
+            try:
+                cache = await self.gsm.initialize_async(cache)
+                await self.negotiateBaudrate()
+                cache["baudrate"] = self.gsm.baudrate
+                break
+            except Exception as err:
+                logger.error(f"Modem initialization failed : {err}", "ComManager")
+                self._saveModemCache({})
+                await asyncio.sleep(_UPLOAD_INTERVAL_S)
+        self._saveModemCache(cache)
+        logger.info(f"Modem ready in {self.gsm.init_timings['total']} ms {self.gsm.init_timings}", "ComManager")
+
+        if store.get("modemSleep"):
+            try:
+                await self.gsm.enable_sleep_async()
+            except Exception as err:
+                logger.warn(f"Modem sleep not enabled : {err}", "ComManager")
+        self.ready.set()
+        asyncio.create_task(self.monitor.run(store))
+        asyncio.create_task(self.smsOutbox.run())
+
+    """
+    Monte le débit de l'UART du modem au plus rapide de _MODEM_RATES qui passe sans erreur, et active
+    RTS/CTS si les broches sont câblées
+    """
+    async def negotiateBaudrate(self):
+        if PIN_GSM_RTS is not None and PIN_GSM_CTS is not None and self.gsm.flow_pins is None:
+            await self.gsm.enable_flow_control_async(PIN_GSM_RTS, PIN_GSM_CTS)
+        for rate in _MODEM_RATES:
+            if rate <= self.gsm.baudrate or await self.gsm.set_baudrate_async(rate):
+                break
+        logger.info(f"Modem UART at {self.gsm.baudrate} baud", "ComManager")
+
+    """
+    Mesure le débit d'envoi et de réception avec le modem à chaque débit de rates, puis revient au
+    débit de départ. Aucun envoi ne doit être en cours (httpLock est pris pendant la mesure).
+    Renvoi: {débit: (octets/s envoyés, octets/s reçus)}, None pour un débit non fiable
+    """
+    async def benchBaudrates(self, rates=(38400, 115200, 230400, 460800), size=2048):
+        async with self.httpLock:
+            start = self.gsm.baudrate
+            results = {}
+            for rate in rates:
+                if rate != self.gsm.baudrate and not await self.gsm.set_baudrate_async(rate):
+                    results[rate] = None
+                    continue
+                results[rate] = await self.gsm.measure_throughput_async(size)
+                tx, rx = results[rate]
+                logger.info(f"{rate} baud: {tx} B/s sent, {rx} B/s received", "ComManager")
+            if self.gsm.baudrate != start:
+                await self.gsm.set_baudrate_async(start)
+        if self.session is not None:
+            self.session.opened = False  # Contexte HTTP fermé par la mesure
+        return results
+
+    """
+    Envoie un lot d'enregistrements "timestamp,lat,lon,vitesse" au serveur, en JSON ou dans le
+    format binaire de telemetry.py (uploadFormat "binary").
+    Avec compressPath (fichier temporaire), le JSON est compressé au fil de l'eau dans ce fichier
+    puis envoyé avec "Content-Encoding: deflate". Si le serveur répond 415, la compression est
+    abandonnée jusqu'au redémarrage et le lot est renvoyé en clair.
+    Renvoi: True si le serveur a répondu 2xx
+    """
+    async def uploadRecords(self, url, records, apn, uploadFormat="json", compressPath=None):
+        session = await self._openSession(url, apn)
+
+        if uploadFormat == "binary":
+            session.content_type = telemetry.CONTENT_TYPE
+            session.content_encoding = None
+            response = await session.post(bytes(telemetry.encodeRecords(records)))
+            return 200 <= response.status_code < 300
+
+        session.content_type = "application/json"
+        if compressPath and self.compressAccepted and compress.available \
+                and sum(len(record) for record in records) >= _COMPRESS_MIN_SIZE:
+            compress.compressChunks(compress.jsonChunks(records), compressPath)
+            session.content_encoding = compress.ENCODING
+            response = await session.post_file(compressPath)
+            if response.status_code != _HTTP_UNSUPPORTED_MEDIA_TYPE:
+                return 200 <= response.status_code < 300
+            logger.warn("Server refuses compressed bodies, sending uncompressed", "ComManager")
+            self.compressAccepted = False
+
+        session.content_encoding = None
+        response = await session.post("[[" + "],[".join(records) + "]]")
+        return 200 <= response.status_code < 300
+
+    """
+    Télécharge url dans le fichier path. Un fichier partiel (téléchargement interrompu) est complété
+    à partir de sa taille actuelle.
+    Renvoi: taille du fichier
+    """
+    async def downloadFile(self, url, path, apn):
+        await self.ready.wait()
+        async with self.httpLock:
+            session = await self._openSession(url, apn)
+            return await session.download_file(path)
+
+    # Session HTTP vers url, porteuse ouverte. L'appelant tient self.httpLock.
+    async def _openSession(self, url, apn):
+        session = self.session
+        if session is None or session.url != url:
+            session = self.session = sim800l.HttpSession(self.gsm, url)
+        if not session.opened or not self.monitor.bearerUp:
+            await self.monitor.connect(apn)
+        return session
 
-        self.gsm.initialize()
+    """
+    Tâche d'envoi: vide les files d'envoi de sdManager par lots dont la taille et le moment sont
+    choisis par self.scheduler (voir uplink.py) selon la qualité mesurée du lien, au plus
+    uploadBatch enregistrements. Le curseur d'une file n'avance que si le serveur a acquitté le lot:
+    en cas d'échec, le même lot est renvoyé plus tard. Tant que le lien est connu comme coupé (voir
+    NetworkMonitor.isDown), les envois attendent son rétablissement au lieu d'échouer sur les
+    délais du modem.
+    """
+    async def uploadTask(self, sdManager):
+        store = sdManager.store
+        scheduler = self.scheduler
+        await self.ready.wait()
+        while True:
+            if self.monitor.isDown():
+                await self.monitor.waitChange(_UPLOAD_INTERVAL_S * 1000)
+                continue
+            sent = False
+            pending = False
+            url = store.get("uploadUrl")
+            if url:
+                maxBatch = store.get("uploadBatch")
+                for queue in sdManager.uploadQueues():
+                    if queue.isEmpty():
+                        continue
+                    batch = scheduler.batchSize(maxBatch)
+                    records, cursor = queue.peek(batch)
+                    if not records:
+                        continue
+                    pending = True
+                    if not scheduler.shouldSend(records, batch, store.get("uploadMaxAgeS")):
+                        continue  # Les files suivantes peuvent avoir des positions trop vieilles
+                    accepted = False
+                    t0 = None  # Reste None si la porteuse n'a pas pu être ouverte: rien n'a été envoyé
+                    try:
+                        async with self.httpLock:
+                            await self._openSession(url, store.get("apn"))
+                            t0 = utime.ticks_ms()
+                            accepted = await self.uploadRecords(url, records, store.get("apn"),
+                                                                store.get("uploadFormat"),
+                                                                sdManager.tmpPath("upload.z")
+                                                                if store.get("uploadCompress") else None)
+                        if not accepted:
+                            logger.warn("Upload refused by server", "ComManager")
+                    except Exception as err:
+                        logger.warn(f"Upload failed : {err}", "ComManager")
+                        self.monitor.check()
+                    if t0 is not None:
+                        scheduler.record(len(records), batch, utime.ticks_diff(utime.ticks_ms(), t0), accepted, maxBatch)
+                    if accepted:
+                        queue.ack(cursor)
+                        sent = True
+                    break
+            if not pending:
+                scheduler.forced = False
+            # Tant qu'il reste des enregistrements et que les envois passent, on enchaîne
+            if sent:
+                await asyncio.sleep(0)
+            else:
+                await scheduler.wait(_UPLOAD_INTERVAL_S)
@@ -0,0 +1,111 @@
+"""
+Compression des corps envoyés au serveur (Content-Encoding: deflate, format zlib).
+
+La compression se fait au fil de l'eau dans un fichier temporaire: les données passent par un
+buffer fixe et seul l'état du compresseur (fenêtre de 2^wbits octets) est en RAM. Le fichier est
+ensuite envoyé par morceaux (HttpSession.post_file), le modem devant connaître la taille avant
+de recevoir le corps.
+
+Utilise le module deflate de MicroPython (firmware compilé avec la compression), ou zlib sous
+CPython. Sans l'un ni l'autre, available vaut False et les corps partent non compressés.
+"""
+import os
+import utime
+from micropython import const
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+ENCODING = "deflate"
+
+_CHUNK_SIZE = const(512)
+_WBITS = const(10)  # Fenêtre de 1 ko: l'essentiel du gain sur des lignes de positions
+
+available = (deflate is not None and hasattr(deflate, "DeflateIO")) or hasattr(zlib, "compressobj")
+
+
+class _ZlibWriter:
+    # Même interface que deflate.DeflateIO en écriture, pour CPython
+    def __init__(self, file, wbits):
+        self.file = file
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+
+
+def _writer(file, wbits):
+    if deflate is not None and hasattr(deflate, "DeflateIO"):
+        return deflate.DeflateIO(file, deflate.ZLIB, wbits)
+    return _ZlibWriter(file, wbits)
+
+
+"""
+Compresse les morceaux (str ou bytes) donnés par chunks dans le fichier path.
+Renvoi: taille du fichier compressé
+"""
+def compressChunks(chunks, path, wbits=_WBITS):
+    with open(path, "wb") as file:
+        writer = _writer(file, wbits)
+        for chunk in chunks:
+            writer.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        writer.close()
+        return file.tell()
+
+
+def _fileChunks(path, buf):
+    mv = memoryview(buf)
+    with open(path, "rb") as file:
+        while True:
+            n = file.readinto(buf)
+            if not n:
+                break
+            yield mv[:n]
+
+
+"""
+Compresse le fichier src (log, capture NMEA...) dans path par blocs de _CHUNK_SIZE octets.
+Renvoi: taille du fichier compressé
+"""
+def compressFile(src, path, wbits=_WBITS):
+    return compressChunks(_fileChunks(src, bytearray(_CHUNK_SIZE)), path, wbits)
+
+
+"""
+Morceaux du corps JSON "[[...],[...]]" d'un lot d'enregistrements, sans construire le corps entier
+"""
+def jsonChunks(records):
+    yield "[["
+    for i in range(len(records)):
+        if i:
+            yield "],["
+        yield records[i]
+    yield "]]"
+
+
+"""
+Compression d'un fichier enregistré (par exemple une partition de LogStore ou une capture NMEA)
+avec chaque taille de fenêtre, dans tmp.
+Renvoi: {wbits: (taux de compression en %, ms par ko d'entrée)}
+"""
+def bench(src, tmp="/sd/bench.z", windows=(8, 9, 10, 12)):
+    size = os.stat(src)[6]
+    results = {}
+    for wbits in windows:
+        t0 = utime.ticks_ms()
+        compressed = compressFile(src, tmp, wbits)
+        elapsed = utime.ticks_diff(utime.ticks_ms(), t0)
+        results[wbits] = (100 * compressed // size, elapsed * 1024 / size)
+    os.remove(tmp)
+    return results
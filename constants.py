@@ -11,3 +11,5 @@ PIN_GSM_TX = const(32)
 PIN_GSM_RST = const(33)
 PIN_GSM_DTR = const(23)
 PIN_GSM_RING = const(22)
+PIN_GSM_RTS = None  # RTS/CTS du modem non câblés: pas de contrôle de flux matériel
+PIN_GSM_CTS = None
@@ -10,6 +10,8 @@ from constants import PIN_GPS_POWER
 from machine import Pin
 import utime
 
+_LOCAL_OFFSET_H = const(2)  # Fuseau de l'heure affichée (getTime), les timestamps restent en UTC
+
 
 class GPSManager:
 
@@ -18,10 +20,13 @@ class GPSManager:
 
     def __init__(self, uartId):
         self.uart = machine.UART(uartId, 9600) # On initialise une liaison série à 9600 bauds
-        self.uGPS = micropyGPS.MicropyGPS(2)  # On initialise le parser NMEA en indiquant un fuseau UTC+2
+        self.uGPS = micropyGPS.MicropyGPS(0)  # Parser NMEA en UTC: il décale l'heure sans changer la date
         self.powerPin = Pin(PIN_GPS_POWER, Pin.OUT)
         self.powerPin.value(0)
         self.lastDataRxTime = -1
+        self.lastFixTime = 0
+        self.lastFix = None  # Dernier point reçu (voir getFix), gardé pour y répondre sans attendre
+        self.fixListeners = []
 
     def update(self):
         sentence = self.uart.readline()
@@ -34,9 +39,12 @@ class GPSManager:
                     self.lastDataRxTime = utime.ticks_ms()
                 except UnicodeError:
                     logger.warn(const("Bad gps character received"), const("GPSManager"))
-            print(self.uGPS.latitude)
-            print(self.uGPS.satellites_visible())
-            print(self.lastDataRxTime)
+            if self.uGPS.valid and self.uGPS.fix_time != self.lastFixTime:   # Nouveau point
+                self.lastFixTime = self.uGPS.fix_time
+                fix = self.getFix()
+                self.lastFix = fix
+                for callback in self.fixListeners:
+                    callback(fix)
             # print(self.uart.read(1))
 
             await asyncio.sleep(0.5)
@@ -45,8 +53,27 @@ class GPSManager:
     def getCoord(self):
         return self.uGPS.latitude, self.uGPS.longitude
 
+    # Heure locale (UTC+_LOCAL_OFFSET_H) pour l'affichage
     def getTime(self):
-        return self.uGPS.timestamp
+        hours, minutes, seconds = self.uGPS.timestamp
+        return (hours + _LOCAL_OFFSET_H) % 24, minutes, seconds
+
+    # callback(fix) est appelé à chaque nouveau point, avec fix tel que renvoyé par getFix()
+    def addFixListener(self, callback):
+        self.fixListeners.append(callback)
+
+    """
+    Renvoi: (timestamp UTC en secondes, latitude et longitude en degrés décimaux signés, vitesse en km/h)
+    """
+    def getFix(self):
+        day, month, year = self.uGPS.date
+        hours, minutes, seconds = self.uGPS.timestamp
+        timestamp = utime.mktime((2000 + year, month, day, hours, minutes, int(seconds), 0, 0))
+        lat = self.uGPS.latitude
+        lon = self.uGPS.longitude
+        latitude = (lat[0] + lat[1] / 60) * (-1 if lat[2] == 'S' else 1)
+        longitude = (lon[0] + lon[1] / 60) * (-1 if lon[2] == 'W' else 1)
+        return timestamp, latitude, longitude, self.uGPS.speed[2]
 
     def setSleep(self, sleep=True):
         if sleep:
@@ -0,0 +1,207 @@
+"""
+Logs de positions découpés par jour (et optionnellement tous les N enregistrements), avec un index
+pour retrouver rapidement les enregistrements d'une plage horaire.
+
+Chaque enregistrement est une ligne "<timestamp>,<données>" (timestamp en secondes, epoch de la
+carte). Les fichiers d'une partition:
+ - <root>/AAAAMMJJ-NNN.log : les enregistrements, dans l'ordre chronologique
+ - <root>/AAAAMMJJ-NNN.idx : une entrée (timestamp, offset dans le .log) tous les indexEvery
+   enregistrements, en binaire (2 x uint32 little endian)
+
+Une requête sur une plage ne lit que les partitions des jours concernés: recherche
+dichotomique dans l'index puis lecture séquentielle depuis l'offset trouvé. Les timestamps doivent
+donc croître dans chaque fichier: un enregistrement d'un jour déjà écrit (logs en attente rejoués
+au retour de la carte) ou plus ancien que le précédent (heure GPS qui recule) ouvre un nouveau
+fichier NNN de son jour au lieu de s'ajouter à un fichier existant.
+
+Quand la place libre descend sous minFree octets, les partitions les plus anciennes sont
+supprimées.
+"""
+import os
+import struct
+import utime
+from micropython import const
+
+import logger
+
+_ENTRY_SIZE = const(8)
+_RETENTION_CHECK_EVERY = const(64)  # Vérification de la place libre tous les N enregistrements
+_TAIL_SIZE = const(256)  # Fin du fichier lue pour retrouver le dernier timestamp au démarrage
+
+
+def dayOf(timestamp):
+    t = utime.localtime(timestamp)
+    return "{:04d}{:02d}{:02d}".format(t[0], t[1], t[2])
+
+
+def timestampOf(record):
+    return int(record[:record.index(",")])
+
+
+class LogStore:
+    # maxRecords: nombre max d'enregistrements par fichier (0: un fichier par jour)
+    def __init__(self, root, indexEvery=32, maxRecords=0, minFree=1048576):
+        self.root = root
+        self.indexEvery = indexEvery
+        self.maxRecords = maxRecords
+        self.minFree = minFree
+
+        try:
+            os.mkdir(root)
+        except OSError:  # Existe déjà
+            pass
+
+        # Reprise de la dernière partition
+        self.current = None
+        self.records = 0
+        self.offset = 0
+        self.sinceIndex = indexEvery  # La première ligne écrite après le démarrage est indexée
+        self.sinceRetention = 0
+        self.lastTimestamp = None  # Timestamp du dernier enregistrement du fichier en cours
+        names = self.partitions()
+        if names:
+            self.current = names[-1]
+            try:
+                self.offset = os.stat(self._path(self.current, ".log"))[6]
+                self.records = os.stat(self._path(self.current, ".idx"))[6] // _ENTRY_SIZE * indexEvery
+            except OSError:
+                pass
+            self.lastTimestamp = self._readLastTimestamp(self.current)
+
+    def _path(self, name, ext):
+        return self.root + "/" + name + ext
+
+    """
+    Noms des partitions, du plus ancien au plus récent
+    """
+    def partitions(self):
+        names = [name[:-4] for name in os.listdir(self.root) if name.endswith(".log")]
+        names.sort()
+        return names
+
+    def _readLastTimestamp(self, name):
+        # Dernière ligne complète du fichier, lue à la fin
+        start = max(0, self.offset - _TAIL_SIZE)
+        try:
+            with open(self._path(name, ".log"), "r") as file:
+                file.seek(start)
+                lines = file.read().split("\n")[:-1]  # Sans la ligne tronquée (ou vide) de la fin
+        except OSError:
+            return None
+        if start:  # Première ligne lue incomplète
+            lines = lines[1:]
+        for line in reversed(lines):
+            try:
+                return timestampOf(line)
+            except ValueError:
+                continue
+        return None
+
+    def _rotate(self, day):
+        # Toujours un nouveau fichier, après le dernier du jour s'il y en a déjà
+        sequence = 0
+        for name in self.partitions():
+            if name[:8] == day:
+                sequence = int(name[9:]) + 1
+        self.current = "{}-{:03d}".format(day, sequence)
+        self.records = 0
+        self.offset = 0
+        self.sinceIndex = self.indexEvery
+        self.lastTimestamp = None
+        self.enforceRetention()
+
+    """
+    Ajoute un enregistrement "<timestamp>,<données>" (sans retour à la ligne)
+    """
+    def append(self, record):
+        timestamp = timestampOf(record)
+        day = dayOf(timestamp)
+        if self.current is None or self.current[:8] != day \
+                or (self.lastTimestamp is not None and timestamp < self.lastTimestamp) \
+                or (self.maxRecords and self.records >= self.maxRecords):
+            self._rotate(day)
+
+        if self.sinceIndex >= self.indexEvery:
+            with open(self._path(self.current, ".idx"), "ab") as file:
+                file.write(struct.pack("<II", timestamp, self.offset))
+            self.sinceIndex = 0
+
+        with open(self._path(self.current, ".log"), "a") as file:
+            file.write(record)
+            file.write("\n")
+        self.offset += len(record) + 1
+        self.records += 1
+        self.lastTimestamp = timestamp
+        self.sinceIndex += 1
+
+        self.sinceRetention += 1
+        if self.sinceRetention >= _RETENTION_CHECK_EVERY:
+            self.enforceRetention()
+
+    # Offset du dernier point d'index dont le timestamp est <= start
+    def _seek(self, name, start):
+        try:
+            file = open(self._path(name, ".idx"), "rb")
+        except OSError:
+            return 0
+        entry = bytearray(_ENTRY_SIZE)
+        with file:
+            lo = 0
+            hi = os.stat(self._path(name, ".idx"))[6] // _ENTRY_SIZE - 1
+            offset = 0
+            while lo <= hi:
+                mid = (lo + hi) // 2
+                file.seek(mid * _ENTRY_SIZE)
+                file.readinto(entry)
+                timestamp, position = struct.unpack("<II", entry)
+                if timestamp <= start:
+                    offset = position
+                    lo = mid + 1
+                else:
+                    hi = mid - 1
+        return offset
+
+    """
+    Renvoie (générateur) les enregistrements dont le timestamp est compris entre start et end
+    """
+    def query(self, start, end):
+        first = dayOf(start)
+        last = dayOf(end)
+        for name in self.partitions():
+            if not first <= name[:8] <= last:
+                continue
+            with open(self._path(name, ".log"), "r") as file:
+                file.seek(self._seek(name, start))
+                for line in file:
+                    try:
+                        timestamp = timestampOf(line)
+                    except ValueError:  # Ligne tronquée (coupure)
+                        continue
+                    if timestamp > end:
+                        break
+                    if timestamp >= start:
+                        yield line.rstrip("\n")
+
+    def freeSpace(self):
+        stat = os.statvfs(self.root)
+        return stat[0] * stat[3]
+
+    """
+    Supprime les partitions les plus anciennes tant que la place libre est sous minFree.
+    La partition en cours n'est jamais supprimée.
+    """
+    def enforceRetention(self):
+        self.sinceRetention = 0
+        if self.freeSpace() >= self.minFree:
+            return
+        for name in self.partitions():
+            if name == self.current:
+                break
+            for ext in (".log", ".idx"):
+                try:
+                    os.remove(self._path(name, ext))
+                except OSError:
+                    pass
+            logger.info(f"Log partition {name} deleted (low free space)", "LogStore")
+            if self.freeSpace() >= self.minFree:
+                break
@@ -1,21 +1,22 @@
 # main.py
 import machine
-
-import commanager
-import constants
-import sdmanager
-import gpsmanager
-import uasyncio as asyncio
+import os
 
 from machine import Pin
 
-gpsManager = gpsmanager.GPSManager(2)
-
-comManager = commanager.comManager()
-
-sdManager = sdmanager.SDManager(constants.PIN_SCK, constants.PIN_MOSI, constants.PIN_MISO, constants.PIN_SDCardCS, 4)
-sdManager.loadSettings()
+# Une version en essai (voir ota.py) qui plante, à l'import comme plus tard, ou qui bloque la
+# boucle, doit redémarrer la carte pour que boot.py compte l'essai et remette l'ancienne version:
+# tout ce qui peut échouer est dans le try en fin de fichier, et le watchdog surveille la boucle.
+# Ces vérifications n'importent aucun module susceptible d'être remplacé par une mise à jour.
+TRIAL_PATH = "/ota.trial"  # Même chemin que dans ota.py et boot.py
+WDT_TIMEOUT_MS = 60000
+WDT_FEED_S = 5
 
+gpsManager = None
+comManager = None
+sdManager = None
+smsCommands = None
+watchdog = None
 isContact = None
 contactPin = None
 
@@ -31,6 +32,14 @@ def irq_contact():
     global isContact, contactPin
     isContact = contactPin.value()
 
+def inTrial():
+    try:
+        os.stat(TRIAL_PATH)
+        return True
+    except OSError:
+        return False
+
+
 def main():
     while True:
         if not contactPin.value():
@@ -38,6 +47,28 @@ def main():
         else:
             runningMode()
 
+
+def onFix(fix):
+    timestamp, latitude, longitude, speed = fix
+    record = f"{latitude:.6f},{longitude:.6f},{speed:.1f}"
+    sdManager.writeLog(record, timestamp)
+    sdManager.queueUpload(f"{timestamp},{record}")
+    comManager.scheduler.noteTimestamp(timestamp)
+
+
+# Contrôle de santé d'une mise à jour en essai (voir ota.healthCheck), appelé depuis la boucle,
+# qui tourne donc encore. Le modem n'en fait pas partie: sa mise en route peut prendre plus
+# longtemps (modem lent, carte SIM absente) sans que la nouvelle version y soit pour rien.
+def isHealthy():
+    return sdManager.state != sdmanager.STATE_ERROR
+
+
+async def feedWatchdog():
+    while True:
+        watchdog.feed()
+        await asyncio.sleep(WDT_FEED_S)
+
+
 def sleepMode():
     pass
 
@@ -45,5 +76,46 @@ def runningMode():
     pass
 
 
-gpsManager.powerOn()
-asyncio.run(gpsManager.run())
+async def runTasks():
+    asyncio.create_task(sdManager.run())
+    asyncio.create_task(sdManager.store.run())
+    asyncio.create_task(comManager.start(sdManager.store))
+    asyncio.create_task(comManager.uploadTask(sdManager))
+    asyncio.create_task(smsCommands.run())
+    asyncio.create_task(ota.run(comManager, sdManager))
+    asyncio.create_task(ota.healthCheck(isHealthy))
+    if watchdog is not None:
+        asyncio.create_task(feedWatchdog())
+    await gpsManager.run()
+
+
+try:
+    if inTrial():  # Ne s'arrête plus: nourri par feedWatchdog() même après confirmation
+        watchdog = machine.WDT(timeout=WDT_TIMEOUT_MS)
+
+    import commanager
+    import constants
+    import logger
+    import ota
+    import sdmanager
+    import smscommands
+    import gpsmanager
+    import uasyncio as asyncio
+
+    gpsManager = gpsmanager.GPSManager(2)
+
+    comManager = commanager.comManager()
+
+    sdManager = sdmanager.SDManager(constants.PIN_SCK, constants.PIN_MOSI, constants.PIN_MISO, constants.PIN_SDCardCS, 4)
+    sdManager.loadSettings()
+
+    smsCommands = smscommands.SmsCommands(comManager, sdManager.store, lambda: gpsManager.lastFix)
+
+    gpsManager.addFixListener(onFix)
+    gpsManager.powerOn()
+    asyncio.run(runTasks())
+except Exception as err:
+    print(f"[Main][Error] Main loop stopped : {err}")  # Sans logger: il peut être la cause
+    if inTrial():  # boot.py remettra la version précédente
+        machine.reset()
+    raise
@@ -0,0 +1,416 @@
+"""
+Simulated SIM800L, used in place of the modem UART to exercise and measure the
+sim800l driver without a modem (on the board or on a host with a MicroPython
+port).
+
+SimUart answers each AT command line written to it from a table of handlers
+keyed by command prefix, and can inject unsolicited lines at any time:
+
+    import modemsim, sim800l
+    uart = modemsim.SimUart()
+    modem = sim800l.Modem(uart, rst_pin=33)
+    modem.execute_at_command('modeminfo')
+    uart.inject(b'\\r\\n+CMTI: "SM",3\\r\\n')
+
+Handlers receive the command line (bytes, without CR LF) and return the bytes
+the modem would answer, echo included. Replace or add entries in
+SimUart.handlers to script other behaviours.
+
+SocketBridge adds the AT+CIP* commands and carries the socket links over real
+host sockets, to test the socket transport against a local server (see
+tools/standin_server.py):
+
+    modemsim.SocketBridge(uart)
+    await modem.socket_init('internet')
+    await modem.socket_open(0, '127.0.0.1', 7000, on_receive=print)
+"""
+import gc
+import io
+import socket
+
+import utime
+
+_POLLIN = 0x0001
+_POLLOUT = 0x0004
+_MP_STREAM_POLL = 3
+
+
+def _ok(line, body=b''):
+    return line + b'\r\r\n' + body + b'\r\nOK\r\n'
+
+
+def _default_handlers():
+    return {
+        b'ATI': lambda line: _ok(line, b'SIM800 R14.18\r\n'),
+        b'AT+CGMR': lambda line: _ok(line, b'Revision:1418B04SIM800L24\r\n'),
+        b'AT+CSQ': lambda line: _ok(line, b'+CSQ: 18,0\r\n'),
+        b'AT+CPIN?': lambda line: _ok(line, b'+CPIN: READY\r\n'),
+        b'AT+CCALR?': lambda line: _ok(line, b'+CCALR: 1\r\n'),
+        b'AT+COPS?': lambda line: _ok(line, b'+COPS: 0,0,"Orange F"\r\n'),
+        b'AT+SAPBR=2,1': lambda line: _ok(line, b'+SAPBR: 1,1,"10.64.12.7"\r\n'),
+        b'AT+CLAC': lambda line: _ok(line, b''.join(b'AT+C%03d\r\n' % i for i in range(200))),
+        b'AT': _ok,
+    }
+
+
+class SimUart(io.IOBase):
+
+    def __init__(self, handlers=None, latency_ms=0, http_body=b'{}', baudrate=38400, max_baudrate=460800):
+        self.rx = bytearray()
+        self.tx = bytearray()
+        if handlers is None:
+            handlers = _default_handlers()
+            handlers[b'AT+HTTPDATA'] = self._httpdata
+            handlers[b'AT+HTTPACTION'] = self._httpaction
+            handlers[b'AT+HTTPREAD'] = self._httpread
+            handlers[b'AT+IPR'] = self._ipr
+            handlers[b'AT+CREG'] = self._creg
+            handlers[b'AT+CMGS'] = self._cmgs
+            handlers[b'AT+CMGR'] = self._cmgr
+            handlers[b'AT+CMGL'] = self._cmgl
+            handlers[b'AT+CMGD'] = self._cmgd
+        self.handlers = handlers
+        self.http_body = http_body  # Body answered to every HTTP request
+        self.asleep = None  # Function returning True while the modem sleeps (commands are lost)
+        # Modem side UART rate: commands sent at another rate are not understood,
+        # and answers above max_baudrate are garbled
+        self.modem_baudrate = baudrate
+        self.baudrate = baudrate
+        self.max_baudrate = max_baudrate
+        self.latency_ms = latency_ms
+        self.commands = 0
+        self.registration = 1  # AT+CREG stat, changed with set_registration()
+        self.creg_mode = 0
+        self.sms = []  # Bodies of the SMS sent with AT+CMGS (PDU in hex, or text)
+        self.inbox = {}  # index -> (sender, text) of the received SMS, see receive_sms()
+        self.pollers = []
+        self._raw_left = 0
+        self._raw_sink = None
+        self._raw = bytearray()
+
+    def _answer(self, line):
+        if self.asleep is not None and self.asleep():
+            return b''
+        if self.baudrate != self.modem_baudrate:
+            return b'\x00\xfe'
+        self.commands += 1
+        if self.latency_ms:
+            utime.sleep_ms(self.latency_ms)
+        best = b''
+        for prefix in self.handlers:
+            if line.startswith(prefix) and len(prefix) > len(best):
+                best = prefix
+        if not best:
+            return b'\r\nERROR\r\n'
+        answer = self.handlers[best](line)
+        if self.modem_baudrate > self.max_baudrate:
+            answer = answer.replace(b'SIM', b'S\xcdM')
+        return answer
+
+    def _httpdata(self, line):
+        # AT+HTTPDATA=<length>,<ms>: the next <length> bytes are the body
+        length = int(line[line.index(b'=') + 1:].split(b',')[0])
+        self.expect_raw(length, lambda data: b'\r\nOK\r\n')
+        return line + b'\r\r\nDOWNLOAD\r\n'
+
+    def _httpaction(self, line):
+        method = line[-1:]
+        return _ok(line) + b'\r\n+HTTPACTION: %s,200,%d\r\n' % (method, len(self.http_body))
+
+    def _httpread(self, line):
+        # AT+HTTPREAD or AT+HTTPREAD=<start>,<size>
+        body = self.http_body
+        if b'=' in line:
+            start, size = line[line.index(b'=') + 1:].split(b',')
+            body = body[int(start):int(start) + int(size)]
+        return line + b'\r\r\n+HTTPREAD: %d\r\n' % len(body) + body + b'\r\nOK\r\n'
+
+    def _ipr(self, line):
+        # The OK is sent at the old rate, then the modem switches
+        answer = _ok(line)
+        self.modem_baudrate = int(line[7:])
+        return answer
+
+    def _creg(self, line):
+        # AT+CREG? or AT+CREG=<n>
+        if line.endswith(b'?'):
+            return _ok(line, b'+CREG: %d,%d\r\n' % (self.creg_mode, self.registration))
+        self.creg_mode = int(line[8:])
+        return _ok(line)
+
+    def _cmgs(self, line):
+        # AT+CMGS=<length> or AT+CMGS="<number>": the body follows the
+        # prompt and ends with Ctrl-Z
+        def sent(body):
+            self.sms.append(body)
+            return b'\r\n+CMGS: %d\r\n\r\nOK\r\n' % len(self.sms)
+        self.expect_raw(None, sent)
+        return line + b'\r\r\n> '
+
+    def _cmgr(self, line):
+        message = self.inbox.get(int(line[8:]))
+        if message is None:
+            return _ok(line)
+        return _ok(line, b'+CMGR: "REC UNREAD","%s","","24/10/19,12:00:00+08"\r\n%s\r\n' % message)
+
+    def _cmgl(self, line):
+        return _ok(line, b''.join(b'+CMGL: %d,"REC UNREAD","%s","","24/10/19,12:00:00+08"\r\n%s\r\n'
+                                  % (index, sender, text) for index, (sender, text) in self.inbox.items()))
+
+    def _cmgd(self, line):
+        self.inbox.pop(int(line[8:].split(b',')[0]), None)
+        return _ok(line)
+
+    def receive_sms(self, sender, text, notify=True):
+        # Stores an incoming SMS (bytes) in the first free slot, announced by +CMTI
+        index = 1
+        while index in self.inbox:
+            index += 1
+        self.inbox[index] = (sender, text)
+        if notify:
+            self.inject(b'\r\n+CMTI: "SM",%d\r\n' % index)
+        return index
+
+    def set_registration(self, stat):
+        # Network registration change, reported by a +CREG URC after AT+CREG=1
+        self.registration = stat
+        if self.creg_mode:
+            self.inject(b'\r\n+CREG: %d\r\n' % stat)
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate is not None:
+            self.baudrate = baudrate
+
+    def inject(self, data):
+        self.rx.extend(data)
+
+    def expect_raw(self, count, sink):
+        # Called by a handler: the next count bytes written are data, passed
+        # as a whole to sink(data), which returns the modem answer. With
+        # count None, the data ends with Ctrl-Z (SMS body).
+        self._raw_left = count
+        self._raw_sink = sink
+        self._raw = bytearray()
+
+    def _poll(self):
+        for poller in self.pollers:
+            poller()
+
+    # UART interface used by the driver
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.tx.extend(data)
+        while self.tx:
+            if self._raw_left is None:
+                i = self.tx.find(b'\x1a')
+                if i < 0:
+                    self._raw.extend(self.tx)
+                    self.tx = bytearray()
+                    break
+                self._raw.extend(self.tx[:i])
+                self.tx = self.tx[i + 1:]
+                self._raw_left = 0
+                self.rx.extend(self._raw_sink(bytes(self._raw)))
+                continue
+            if self._raw_left:
+                chunk = self.tx[:self._raw_left]
+                self.tx = self.tx[len(chunk):]
+                self._raw.extend(chunk)
+                self._raw_left -= len(chunk)
+                if not self._raw_left:
+                    self.rx.extend(self._raw_sink(bytes(self._raw)))
+                continue
+            i = self.tx.find(b'\r\n')
+            if i < 0:
+                break
+            line = bytes(self.tx[:i])
+            self.tx = self.tx[i + 2:]
+            if line:  # CR LF sent after a body is ignored, as by the modem
+                self.rx.extend(self._answer(line))
+        return len(data)
+
+    def any(self):
+        self._poll()
+        return len(self.rx)
+
+    def read(self, n=-1):
+        self._poll()
+        if not self.rx:
+            return None
+        if n is None or n < 0 or n > len(self.rx):
+            n = len(self.rx)
+        data = bytes(self.rx[:n])
+        self.rx = self.rx[n:]
+        return data
+
+    def readinto(self, buf, n=-1):
+        self._poll()
+        if not self.rx:
+            return None
+        if n is None or n < 0 or n > len(buf):
+            n = len(buf)
+        n = min(n, len(self.rx))
+        buf[:n] = self.rx[:n]
+        self.rx = self.rx[n:]
+        return n
+
+    def readline(self):
+        self._poll()
+        if not self.rx:
+            return None
+        i = self.rx.find(b'\n')
+        n = len(self.rx) if i < 0 else i + 1
+        data = bytes(self.rx[:n])
+        self.rx = self.rx[n:]
+        return data
+
+    # Stream polling, needed by uasyncio.StreamReader on MicroPython
+    def ioctl(self, op, arg):
+        if op == _MP_STREAM_POLL:
+            self._poll()
+            flags = _POLLOUT
+            if self.rx:
+                flags |= _POLLIN
+            return arg & flags
+        return 0
+
+
+class SocketBridge:
+    # Answers the AT+CIP* commands of SimUart and maps each link (AT+CIPMUX=1)
+    # to a host socket. Data received by the sockets is injected as
+    # "+RECEIVE,<n>,<length>:" URCs, a closed peer as "<n>, CLOSED".
+
+    def __init__(self, uart, ip=b'10.64.12.7'):
+        self.uart = uart
+        self.sockets = {}
+        uart.handlers.update({
+            b'AT+CIPSHUT': lambda line: self._shut(line),
+            b'AT+CIPMUX': _ok,
+            b'AT+CSTT': _ok,
+            b'AT+CIICR': _ok,
+            b'AT+CIFSR': lambda line: line + b'\r\r\n' + ip + b'\r\n',
+            b'AT+CIPTKA': _ok,
+            b'AT+CIPSTART': self._start,
+            b'AT+CIPSEND': self._send,
+            b'AT+CIPCLOSE': self._close,
+        })
+        uart.pollers.append(self.poll)
+
+    @staticmethod
+    def _args(line):
+        return line[line.index(b'=') + 1:].split(b',')
+
+    def _shut(self, line):
+        for link in list(self.sockets):
+            self.sockets.pop(link).close()
+        return line + b'\r\r\nSHUT OK\r\n'
+
+    def _start(self, line):
+        link, proto, host, port = self._args(line)
+        link = int(link)
+        proto = proto.strip(b'"')
+        if link in self.sockets:
+            return _ok(line) + b'\r\n%d, ALREADY CONNECT\r\n' % link
+        kind = socket.SOCK_STREAM if proto == b'TCP' else socket.SOCK_DGRAM
+        try:
+            addr = socket.getaddrinfo(host.strip(b'"').decode(), int(port), 0, kind)[0][-1]
+            sock = socket.socket(socket.AF_INET, kind)
+            sock.connect(addr)
+        except OSError:
+            return _ok(line) + b'\r\n%d, CONNECT FAIL\r\n' % link
+        sock.setblocking(False)
+        self.sockets[link] = sock
+        return _ok(line) + b'\r\n%d, CONNECT OK\r\n' % link
+
+    def _send(self, line):
+        link, length = self._args(line)
+        link = int(link)
+        if link not in self.sockets:
+            return line + b'\r\r\nERROR\r\n'
+
+        def sink(data):
+            try:
+                self.sockets[link].send(data)
+            except OSError:
+                return b'\r\n%d, SEND FAIL\r\n' % link
+            return b'\r\n%d, SEND OK\r\n' % link
+
+        self.uart.expect_raw(int(length), sink)
+        return line + b'\r\r\n> '
+
+    def _close(self, line):
+        link = int(self._args(line)[0])
+        sock = self.sockets.pop(link, None)
+        if sock is None:
+            return line + b'\r\r\nERROR\r\n'
+        sock.close()
+        return line + b'\r\r\n%d, CLOSE OK\r\n' % link
+
+    def poll(self):
+        for link in list(self.sockets):
+            try:
+                data = self.sockets[link].recv(1460)
+            except OSError:  # Nothing received
+                continue
+            if data:
+                self.uart.inject(b'\r\n+RECEIVE,%d,%d:\r\n' % (link, len(data)) + data)
+            else:
+                self.sockets.pop(link).close()
+                self.uart.inject(b'\r\n%d, CLOSED\r\n' % link)
+
+
+_BENCH_COMMANDS = (('modeminfo', None), ('signal', None), ('getbear', None), ('setapn', 'internet'))
+
+
+def bench_at_commands(modem, commands=_BENCH_COMMANDS, rounds=100):
+    # Runs the commands through modem.execute_at_command and returns
+    # (bytes allocated per command, microseconds per command). Allocation is
+    # measured with gc.mem_alloc() with the collector disabled, so it
+    # includes the simulator's own share (about one bytes object per line).
+    for command, data in commands:
+        modem.execute_at_command(command, data)
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        t0 = utime.ticks_us()
+        for _ in range(rounds):
+            for command, data in commands:
+                modem.execute_at_command(command, data)
+        elapsed = utime.ticks_diff(utime.ticks_us(), t0)
+        allocated = gc.mem_alloc() - before
+    finally:
+        gc.enable()
+
+    n = rounds * len(commands)
+    return allocated // n, elapsed // n
+
+
+async def bench_http_uploads(modem, url='http://example.com/', body='[[0]]', uploads=20):
+    # Compares Modem.http_request_async with an HttpSession on the simulator.
+    # Returns {name: (AT commands per upload, microseconds per upload)}; use
+    # SimUart(latency_ms=...) to account for the modem's answer time.
+    import sim800l
+
+    uart = modem.uart
+    session = sim800l.HttpSession(modem, url)
+
+    async def one_shot():
+        await modem.http_request_async(url, 'POST', body)
+
+    async def with_session():
+        await session.post(body)
+
+    results = {}
+    for name, upload in (('http_request', one_shot), ('session', with_session)):
+        await upload()  # session opening is not counted
+        commands = uart.commands
+        t0 = utime.ticks_us()
+        for _ in range(uploads):
+            await upload()
+        elapsed = utime.ticks_diff(utime.ticks_us(), t0)
+        results[name] = ((uart.commands - commands) // uploads, elapsed // uploads)
+    return results
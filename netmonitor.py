@@ -0,0 +1,194 @@
+"""
+Surveillance du réseau GSM: enregistrement, qualité du signal et porteuse GPRS (bearer).
+
+La tâche run() relève AT+CSQ et AT+CREG? à intervalle adaptatif: toutes les _FAST_MS ms
+quand l'état vient de changer ou qu'un relevé a échoué, puis deux fois moins souvent à chaque
+relevé identique, jusqu'à _SLOW_MS, pour ne pas réveiller le modem pour rien. Entre deux relevés,
+les URC +CREG (activées par AT+CREG=1, à refaire après chaque reset du modem) signalent les
+changements d'enregistrement et déclenchent un relevé immédiat.
+
+La porteuse est ouverte par la tâche dès que le modem est enregistré, et par connect() avant un
+envoi. Après un échec, la tentative suivante attend un délai qui double à chaque échec
+(_BACKOFF_MIN_MS à _BACKOFF_MAX_MS), dont une moitié est tirée au hasard pour que les trackers
+d'une même cellule ne se reconnectent pas tous ensemble après une coupure. Le délai repart de zéro
+quand le modem se réenregistre.
+
+Les dernières valeurs sont gardées en RAM: les lecteurs (isDown(), rssi, signalDbm()...)
+n'envoient aucune commande au modem.
+"""
+import random
+import utime
+import uasyncio as asyncio
+from micropython import const
+
+import logger
+
+_FAST_MS = const(5000)
+_SLOW_MS = const(120000)
+_BACKOFF_MIN_MS = const(10000)
+_BACKOFF_MAX_MS = const(600000)
+_RSSI_UNKNOWN = const(99)
+
+
+class NetworkMonitor:
+    # lock: verrou des opérations HTTP (comManager.httpLock), pris pendant l'ouverture de la porteuse
+    def __init__(self, gsm, lock):
+        self.gsm = gsm
+        self.lock = lock
+        self.rssi = None  # 0 à 31 (-113 à -51 dBm), 99 si inconnu, None avant le premier relevé
+        self.ber = None
+        self.registration = None  # stat de AT+CREG, None avant le premier relevé
+        self.sampledAt = None  # ticks_ms du dernier relevé réussi
+        self.bearerUp = False
+        self.failures = 0  # Échecs d'ouverture de la porteuse depuis le dernier succès
+        self.retryAt = None  # ticks_ms avant lequel la porteuse n'est pas rouverte
+        self.changed = asyncio.Event()  # Levé à chaque changement d'enregistrement ou de porteuse
+        self._intervalMs = _FAST_MS
+        self._poke = asyncio.Event()
+        gsm.register_urc(b"+CREG", self._onCreg)
+
+    def isRegistered(self):
+        return self.registration is not None and self.gsm.is_registered(self.registration)
+
+    """
+    Renvoi: True si le lien est connu comme coupé (modem non enregistré, ou porteuse en attente
+    d'une nouvelle tentative): inutile de tenter un envoi. False s'il est ouvert ou pas encore relevé.
+    """
+    def isDown(self):
+        if self.registration is not None and not self.isRegistered():
+            return True
+        return not self.bearerUp and self._backoffLeft() > 0
+
+    """
+    Renvoi: puissance du signal en dBm, None si inconnue
+    """
+    def signalDbm(self):
+        if self.rssi is None or self.rssi == _RSSI_UNKNOWN:
+            return None
+        return -113 + 2 * self.rssi
+
+    # Demande un relevé immédiat (par exemple après un envoi raté)
+    def check(self):
+        self._poke.set()
+
+    """
+    Attend un changement d'état du lien, au plus timeoutMs ms
+    """
+    async def waitChange(self, timeoutMs):
+        self.changed.clear()
+        try:
+            await asyncio.wait_for_ms(self.changed.wait(), timeoutMs)
+        except asyncio.TimeoutError:
+            pass
+
+    def _backoffLeft(self):
+        if self.retryAt is None:
+            return 0
+        return max(0, utime.ticks_diff(self.retryAt, utime.ticks_ms()))
+
+    def _setRegistration(self, stat):
+        if stat == self.registration:
+            return False
+        registered = self.gsm.is_registered(stat)
+        if registered:
+            logger.info(f"Registered on the network (stat {stat})", "NetworkMonitor")
+            self.failures = 0
+            self.retryAt = None
+        elif self.registration is None or self.isRegistered():
+            logger.warn(f"Not registered on the network (stat {stat})", "NetworkMonitor")
+        self.registration = stat
+        if not registered:
+            self._setBearer(False)
+        self.changed.set()
+        return True
+
+    def _setBearer(self, up):
+        if up == self.bearerUp:
+            return False
+        self.bearerUp = up
+        if up:
+            self.failures = 0
+            self.retryAt = None
+        self.changed.set()
+        return True
+
+    def _onCreg(self, line):
+        # URC "+CREG: <stat>" (AT+CREG=1)
+        try:
+            stat = int(line.split(b":")[1].split(b",")[0])
+        except (IndexError, ValueError):
+            return
+        if self._setRegistration(stat):
+            self._intervalMs = _FAST_MS
+            self._poke.set()
+
+    """
+    Relève signal, enregistrement et état de la porteuse.
+    Renvoi: True si l'enregistrement ou la porteuse a changé
+    """
+    async def sample(self):
+        gsm = self.gsm
+        self.rssi, self.ber = await gsm.get_signal_quality_async()
+        mode, stat = await gsm.get_registration_async()
+        if mode != 1:  # Remis à 0 par un reset du modem
+            await gsm.execute_at_command_async("setcreg", 1)
+        changed = self._setRegistration(stat)
+        if self.bearerUp and not await gsm.get_ip_addr_async():
+            logger.warn("Bearer lost", "NetworkMonitor")
+            changed = self._setBearer(False) or changed
+        self.sampledAt = utime.ticks_ms()
+        return changed
+
+    """
+    Ouvre la porteuse si elle ne l'est pas. L'appelant tient self.lock.
+    Lève une exception sans rien envoyer au modem tant que le délai après un échec n'est pas écoulé.
+    """
+    async def connect(self, apn):
+        left = self._backoffLeft()
+        if left:
+            raise Exception(f"Bearer retry in {left // 1000} s")
+        try:
+            await self.gsm.connect_async(apn)
+        except Exception:
+            self.failures += 1
+            delay = min(_BACKOFF_MAX_MS, _BACKOFF_MIN_MS << min(self.failures - 1, 6))
+            delay = delay // 2 + random.getrandbits(20) % (delay // 2 + 1)
+            self.retryAt = utime.ticks_add(utime.ticks_ms(), delay)
+            self._setBearer(False)
+            logger.warn(f"Bearer failed {self.failures} times, next attempt in {delay // 1000} s", "NetworkMonitor")
+            raise
+        self._setBearer(True)
+
+    def _nextDelay(self):
+        delay = self._intervalMs
+        if self.isRegistered() and not self.bearerUp:
+            delay = min(delay, max(self._backoffLeft(), _FAST_MS))
+        return delay
+
+    """
+    Tâche de surveillance, à lancer une fois le modem initialisé
+    """
+    async def run(self, store):
+        while True:
+            self._poke.clear()
+            try:
+                if await self.sample():
+                    self._intervalMs = _FAST_MS
+                else:
+                    self._intervalMs = min(2 * self._intervalMs, _SLOW_MS)
+            except Exception as err:
+                logger.warn(f"Network sample failed : {err}", "NetworkMonitor")
+                self._intervalMs = _FAST_MS
+
+            apn = store.get("apn")
+            if apn and self.isRegistered() and not self.bearerUp and not self._backoffLeft():
+                async with self.lock:
+                    try:
+                        await self.connect(apn)
+                    except Exception as err:
+                        logger.warn(f"Bearer not opened : {err}", "NetworkMonitor")
+
+            try:
+                await asyncio.wait_for_ms(self._poke.wait(), self._nextDelay())
+            except asyncio.TimeoutError:
+                pass
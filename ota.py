@@ -0,0 +1,273 @@
+"""
+Mise à jour du programme par GSM (OTA).
+
+Le serveur publie sous <otaUrl>/:
+ - version : le numéro de la dernière version (texte)
+ - bundle.bin : le paquet, construit par tools/make_ota_bundle.py:
+     ligne 1: signature HMAC-SHA256 (hexadécimal) de la ligne 2, avec la clé partagée /ota.key
+     ligne 2: manifeste JSON {"version": ..., "files": [[nom, taille, sha256 hexadécimal], ...]}
+     puis le contenu des fichiers, mis bout à bout dans l'ordre du manifeste
+
+Déroulement:
+ 1. run() compare la version publiée à la version installée et télécharge le paquet sur la carte
+    SD, par plages d'octets: un téléchargement interrompu reprend là où il s'était arrêté.
+ 2. verify() contrôle la signature du manifeste puis le SHA-256 de chaque fichier.
+ 3. stage() extrait les fichiers en flash dans /ota_new et écrit /ota.pending.
+ 4. Au démarrage suivant, boot.py remplace les fichiers (les anciens vont dans /ota_old) et passe
+    en essai (/ota.trial). Si main.py n'appelle pas confirm() avant le redémarrage suivant (plantage,
+    reset, contrôle de santé raté), boot.py remet les anciens fichiers.
+
+Les chemins en flash sont partagés avec boot.py, qui n'importe pas ce module pour que le retour
+arrière ne dépende pas du code mis à jour. boot.py ne fait jamais partie d'une mise à jour.
+"""
+import machine
+import os
+import ubinascii
+import uhashlib
+import ujson
+import uasyncio as asyncio
+from micropython import const
+
+import logger
+from sdmanager import STATE_MOUNTED
+
+# Mêmes chemins que dans boot.py
+NEW_DIR = "/ota_new"
+OLD_DIR = "/ota_old"
+PENDING_PATH = "/ota.pending"
+TRIAL_PATH = "/ota.trial"
+FILES_PATH = "/ota.files"
+VERSION_PATH = "/ota.version"
+KEY_PATH = "/ota.key"
+
+HEALTH_DELAY_S = const(120)  # Durée de fonctionnement sans erreur avant de valider une version en essai
+
+_CHUNK_SIZE = const(512)
+_CHECK_INTERVAL_S = const(21600)  # Recherche d'une nouvelle version toutes les 6 h
+_RETRY_INTERVAL_S = const(600)  # Après un échec de téléchargement
+_FLASH_MARGIN = const(32768)  # Place laissée libre en flash après l'extraction
+_PROTECTED = ("boot.py",)
+
+
+class OtaError(Exception):
+    pass
+
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def _removeDir(path):
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return
+    for name in names:
+        os.remove(path + "/" + name)
+    os.rmdir(path)
+
+
+def _writeAtomic(path, text):
+    with open(path + ".tmp", "w") as file:
+        file.write(text)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    os.rename(path + ".tmp", path)
+
+
+def installedVersion():
+    try:
+        with open(VERSION_PATH, "r") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def _hmac(key, data):
+    # HMAC-SHA256 (RFC 2104): pas de module hmac sur MicroPython
+    if len(key) > 64:
+        key = uhashlib.sha256(key).digest()
+    key = key + bytes(64 - len(key))
+    inner = uhashlib.sha256(bytes(b ^ 0x36 for b in key))
+    inner.update(data)
+    outer = uhashlib.sha256(bytes(b ^ 0x5C for b in key))
+    outer.update(inner.digest())
+    return outer.digest()
+
+
+def _readHeader(file):
+    signature = file.readline().strip()
+    manifestLine = file.readline()
+    if not manifestLine.endswith(b"\n"):
+        raise OtaError("Truncated manifest")
+    return signature, manifestLine[:-1]
+
+
+"""
+Vérifie la signature et le contenu du paquet path avec la clé key (bytes).
+Renvoi: le manifeste. Lève OtaError si le paquet n'est pas valide.
+"""
+def verify(path, key):
+    buf = bytearray(_CHUNK_SIZE)
+    with open(path, "rb") as file:
+        signature, manifestLine = _readHeader(file)
+        if ubinascii.hexlify(_hmac(key, manifestLine)) != signature:
+            raise OtaError("Bad manifest signature")
+        manifest = ujson.loads(manifestLine)
+
+        for name, size, digest in manifest["files"]:
+            if "/" in name or name in _PROTECTED:
+                raise OtaError(f"Forbidden file name {name}")
+            sha = uhashlib.sha256()
+            left = size
+            while left:
+                n = file.readinto(buf) if left >= _CHUNK_SIZE else file.readinto(memoryview(buf)[:left])
+                if not n:
+                    raise OtaError(f"Bundle truncated in {name}")
+                sha.update(memoryview(buf)[:n])
+                left -= n
+            if ubinascii.hexlify(sha.digest()).decode() != digest:
+                raise OtaError(f"Bad SHA-256 for {name}")
+        if file.read(1):
+            raise OtaError("Trailing data after the last file")
+    return manifest
+
+
+"""
+Extrait les fichiers du paquet (déjà vérifié) dans NEW_DIR et programme le remplacement au
+prochain démarrage
+"""
+def stage(path, manifest):
+    total = sum(size for _, size, _ in manifest["files"])
+    stat = os.statvfs("/")
+    if stat[0] * stat[3] < total + _FLASH_MARGIN:
+        raise OtaError(f"Not enough flash space for {total} bytes")
+
+    # Anciens fichiers de la mise à jour précédente (validée) et extraction ratée
+    _removeDir(OLD_DIR)
+    _removeDir(NEW_DIR)
+    os.mkdir(NEW_DIR)
+
+    # Liste des opérations pour boot.py: "nom" remplacé, "+nom" ajouté, "-nom" supprimé
+    # (un .py masquerait le .mpy du même nom à l'import)
+    operations = []
+    buf = bytearray(_CHUNK_SIZE)
+    with open(path, "rb") as bundle:
+        _readHeader(bundle)
+        for name, size, _ in manifest["files"]:
+            operations.append(name if _exists(name) else "+" + name)
+            if name.endswith(".mpy") and _exists(name[:-4] + ".py"):
+                operations.append("-" + name[:-4] + ".py")
+            with open(NEW_DIR + "/" + name, "wb") as file:
+                left = size
+                while left:
+                    n = bundle.readinto(buf) if left >= _CHUNK_SIZE else bundle.readinto(memoryview(buf)[:left])
+                    file.write(memoryview(buf)[:n])
+                    left -= n
+
+    _writeAtomic(FILES_PATH, "\n".join(operations))
+    _writeAtomic(PENDING_PATH, manifest["version"])
+    logger.info(f"Update {manifest['version']} staged, installed at next boot", "OTA")
+
+
+def inTrial():
+    return _exists(TRIAL_PATH)
+
+
+"""
+Valide la version en essai: elle ne sera plus remplacée par l'ancienne au démarrage
+"""
+def confirm():
+    if not inTrial():
+        return
+    with open(TRIAL_PATH, "r") as file:
+        version = file.read().split(",")[0]
+    _writeAtomic(VERSION_PATH, version)
+    os.remove(TRIAL_PATH)
+    logger.info(f"Update {version} confirmed", "OTA")
+
+
+"""
+Contrôle de santé d'une version en essai: si check() renvoie True après HEALTH_DELAY_S secondes
+de fonctionnement, la version est validée, sinon la carte redémarre sur l'ancienne. check() ne doit
+pas dépendre du modem, dont la mise en route peut dépasser HEALTH_DELAY_S.
+"""
+async def healthCheck(check):
+    if not inTrial():
+        return
+    await asyncio.sleep(HEALTH_DELAY_S)
+    if check():
+        confirm()
+    else:
+        logger.error("Health check failed, restoring the previous version", "OTA")
+        machine.reset()
+
+
+async def _fetchVersion(comManager, url, apn, path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    await comManager.downloadFile(url + "/version", path, apn)
+    with open(path, "r") as file:
+        return file.read().strip()
+
+
+"""
+Tâche de mise à jour: cherche régulièrement une nouvelle version et la prépare pour le prochain
+démarrage. Le paquet est téléchargé sur la carte SD.
+"""
+async def run(comManager, sdManager):
+    store = sdManager.store
+    while True:
+        url = store.get("otaUrl")
+        if not url or inTrial() or _exists(PENDING_PATH) or sdManager.state != STATE_MOUNTED:
+            await asyncio.sleep(_CHECK_INTERVAL_S)
+            continue
+        try:
+            with open(KEY_PATH, "rb") as file:
+                key = file.read()
+        except OSError:
+            logger.warn("No OTA key, updates disabled", "OTA")
+            return
+
+        bundlePath = sdManager.tmpPath("bundle.bin")
+        try:
+            version = await _fetchVersion(comManager, url, store.get("apn"), sdManager.tmpPath("version.txt"))
+            if version == installedVersion():
+                await asyncio.sleep(_CHECK_INTERVAL_S)
+                continue
+            # Un paquet partiel d'une autre version ne doit pas être complété
+            try:
+                with open(bundlePath + ".version", "r") as file:
+                    partial = file.read()
+            except OSError:
+                partial = None
+            if partial != version:
+                for path in (bundlePath, bundlePath + ".version"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                with open(bundlePath + ".version", "w") as file:
+                    file.write(version)
+
+            logger.info(f"Downloading update {version}", "OTA")
+            await comManager.downloadFile(url + "/bundle.bin", bundlePath, store.get("apn"))
+            try:
+                manifest = verify(bundlePath, key)
+                stage(bundlePath, manifest)
+            finally:
+                os.remove(bundlePath)
+                os.remove(bundlePath + ".version")
+        except Exception as err:
+            logger.warn(f"Update failed : {err}", "OTA")
+            await asyncio.sleep(_RETRY_INTERVAL_S)
+            continue
+        await asyncio.sleep(_CHECK_INTERVAL_S)
@@ -0,0 +1,145 @@
+"""
+Mesures de performance de la carte SD, à lancer depuis le REPL.
+
+Les benchmarks de fichiers (appendLatency, compareAppendFs, powerCut*) passent par les systèmes
+de fichiers montés par SDManager et peuvent être lancés sur la carte en service.
+
+ATTENTION: les benchmarks d'écriture brute écrasent la zone de blocs donnée. Elle doit être en
+dehors de tout système de fichiers (par exemple la fin d'une carte formatée plus petite).
+
+Exemple:
+    import sdbench
+    sdbench.compareWriteHints(sdManager.sd, start)
+"""
+import os
+import utime
+
+import logger
+
+
+"""
+Écrit bursts paquets de burstBlocks blocs consécutifs à partir de start et mesure la latence
+de chaque paquet.
+
+Renvoi: (latence min, moyenne, max en µs, débit en ko/s)
+"""
+def writeLatency(sd, start, burstBlocks=8, bursts=64, hint=True, preErase=False):
+    buf = bytearray(512 * burstBlocks)
+    for i in range(len(buf)):
+        buf[i] = i & 0xFF
+
+    hintBefore = sd.write_count_hint
+    sd.write_count_hint = hint
+    try:
+        if preErase:
+            sd.erase(start, burstBlocks * bursts)
+
+        lmin = None
+        lmax = 0
+        total = 0
+        block = start
+        for _ in range(bursts):
+            t0 = utime.ticks_us()
+            sd.writeblocks(block, buf)
+            dt = utime.ticks_diff(utime.ticks_us(), t0)
+            total += dt
+            lmax = max(lmax, dt)
+            lmin = dt if lmin is None else min(lmin, dt)
+            block += burstBlocks
+    finally:
+        sd.write_count_hint = hintBefore
+
+    kbps = (len(buf) * bursts / 1024) / (total / 1000000) if total else 0
+    return lmin, total // bursts, lmax, kbps
+
+
+"""
+Compare la latence d'écriture soutenue sans indication, avec ACMD23 et avec ACMD23 + pré-effacement
+"""
+def compareWriteHints(sd, start, burstBlocks=8, bursts=64):
+    results = {}
+    for name, hint, preErase in (("plain", False, False), ("acmd23", True, False), ("acmd23+erase", True, True)):
+        results[name] = writeLatency(sd, start, burstBlocks, bursts, hint, preErase)
+        lmin, lavg, lmax, kbps = results[name]
+        logger.info(f"{name}: min {lmin}us avg {lavg}us max {lmax}us, {kbps:.1f} kB/s", "SDBench")
+    return results
+
+
+"""
+Ajoute records lignes de size octets au fichier path, en l'ouvrant et le fermant à chaque ligne
+comme le fait SDManager.writeLog().
+
+Renvoi: (latence min, moyenne, max en µs, débit en ko/s)
+"""
+def appendLatency(path, records=200, size=48):
+    line = "x" * (size - 1) + "\n"
+    lmin = None
+    lmax = 0
+    total = 0
+    for _ in range(records):
+        t0 = utime.ticks_us()
+        with open(path, "a") as file:
+            file.write(line)
+        dt = utime.ticks_diff(utime.ticks_us(), t0)
+        total += dt
+        lmax = max(lmax, dt)
+        lmin = dt if lmin is None else min(lmin, dt)
+    os.remove(path)
+
+    kbps = (size * records / 1024) / (total / 1000000) if total else 0
+    return lmin, total // records, lmax, kbps
+
+
+"""
+Compare les ajouts dans un fichier sur la partie FAT (/sd) et sur la zone LittleFS (/sdlog)
+de la même carte. La zone LittleFS doit avoir été créée avec SDManager.formatCard().
+"""
+def compareAppendFs(records=200, size=48):
+    results = {}
+    for name, path in (("fat", "/sd/bench.txt"), ("lfs", "/sdlog/bench.txt")):
+        try:
+            results[name] = appendLatency(path, records, size)
+        except OSError as err:
+            logger.warn(f"{name}: {err}", "SDBench")
+            continue
+        lmin, lavg, lmax, kbps = results[name]
+        logger.info(f"{name}: min {lmin}us avg {lavg}us max {lmax}us, {kbps:.1f} kB/s", "SDBench")
+    return results
+
+
+"""
+Test de coupure d'alimentation: écrit en continu des lignes numérotées "<n>,<n*7>" dans path.
+Couper l'alimentation pendant l'écriture, redémarrer puis lancer powerCutCheck(path).
+"""
+def powerCutWriter(path, records=100000):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    n = 0
+    while n < records:
+        with open(path, "a") as file:
+            file.write(f"{n},{n * 7}\n")
+        n += 1
+
+
+"""
+Vérifie le fichier écrit par powerCutWriter(): toutes les lignes doivent être complètes et se suivre.
+
+Renvoi: (lignes valides, lignes corrompues)
+"""
+def powerCutCheck(path):
+    valid = 0
+    corrupted = 0
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                n, check = line.rstrip("\n").split(",")
+                if int(n) == valid and int(check) == valid * 7 and line.endswith("\n"):
+                    valid += 1
+                    continue
+            except ValueError:
+                pass
+            corrupted += 1
+    logger.info(f"{path}: {valid} valid records, {corrupted} corrupted", "SDBench")
+    return valid, corrupted
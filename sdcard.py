@@ -21,10 +21,13 @@ Example usage on ESP8266:
 """
 
 from micropython import const
+import micropython
+import array
 import time
 
 
 _CMD_TIMEOUT = const(100)
+_ERASE_TIMEOUT_MS = const(2000)  # Longest busy time accepted for one erase (keep ranges small)
 
 _R1_IDLE_STATE = const(1 << 0)
 # R1_ERASE_RESET = const(1 << 1)
@@ -37,20 +40,90 @@ _TOKEN_CMD25 = const(0xFC)
 _TOKEN_STOP_TRAN = const(0xFD)
 _TOKEN_DATA = const(0xFE)
 
+# SPI clock rates tried by calibrate(), in increasing order
+_CALIBRATION_RATES = (1320000, 4000000, 8000000, 10000000, 13333333, 20000000, 26666666, 40000000)
+_CALIBRATION_PASSES = const(4)
+
+
+_CRC_RETRIES = const(3)
+
+# data response tokens (low 5 bits)
+_DATA_ACCEPTED = const(0x05)
+_DATA_CRC_ERROR = const(0x0B)
+
+
+def _make_crc16_table():
+    table = array.array("H", bytearray(512))
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table[i] = crc
+    return table
+
+
+def _make_crc7_table():
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x100:
+                crc ^= 0x89 << 1  # x^7 + x^3 + 1, kept left-aligned
+        table[i] = crc & 0xFF
+    return table
+
+
+_CRC16_TABLE = _make_crc16_table()
+_CRC7_TABLE = _make_crc7_table()
+
+
+@micropython.native
+def crc16(buf, crc=0):
+    # CRC16-CCITT (XMODEM), as used by the SD card on data blocks
+    table = _CRC16_TABLE
+    for b in buf:
+        crc = ((crc << 8) & 0xFF00) ^ table[(crc >> 8) ^ b]
+    return crc
+
+
+def crc7(buf, n=5):
+    # CRC7 of the first n bytes of a command, returned as the last command
+    # byte (CRC in the top 7 bits, end bit set)
+    crc = 0
+    for i in range(n):
+        crc = _CRC7_TABLE[crc ^ buf[i]]
+    return crc | 1
+
 
 class SDCard:
-    def __init__(self, spi, cs, baudrate=1320000):
+    def __init__(self, spi, cs, baudrate=1320000, crc=False):
         self.spi = spi
         self.cs = cs
 
+        # CRC mode (CMD59): commands carry a CRC7, data blocks are checked with
+        # CRC16 in both directions and retried on mismatch
+        self.crc = crc
+        self.crc_enabled = False
+        self.crc_checked = 0
+        self.crc_errors = 0
+        self.crc_retries = 0
+
         self.cmdbuf = bytearray(6)
         self.dummybuf = bytearray(512)
         self.tokenbuf = bytearray(1)
+        self.crcbuf = bytearray(2)
         for i in range(512):
             self.dummybuf[i] = 0xFF
         self.dummybuf_memoryview = memoryview(self.dummybuf)
         self.baudrate= baudrate
 
+        # send ACMD23 (SET_WR_BLK_ERASE_COUNT) before each multi-block write
+        self.write_count_hint = True
+
         # initialise the card
        # self.init_card(baudrate)   #Version modifier afin que la carte SD ne s'initialise pas à la création de l'objet
 
@@ -74,6 +147,7 @@ class SDCard:
 
         # init SPI bus; use low data rate for initialisation
         self.init_spi(100000)
+        self.crc_enabled = False
 
         # clock card at least 100 cycles with cs high
         for i in range(16):
@@ -117,6 +191,9 @@ class SDCard:
         if self.cmd(16, 512, 0) != 0:
             raise OSError("can't set 512 block size")
 
+        if self.crc:
+            self.set_crc(True)
+
         # set to high data rate now that it's initialised
         self.init_spi(baudrate)
 
@@ -158,7 +235,7 @@ class SDCard:
         buf[2] = arg >> 16
         buf[3] = arg >> 8
         buf[4] = arg
-        buf[5] = crc
+        buf[5] = crc7(buf) if self.crc_enabled else crc
         self.spi.write(buf)
 
         if skip1:
@@ -186,7 +263,26 @@ class SDCard:
         self.spi.write(b"\xff")
         return -1
 
+    def set_crc(self, enabled):
+        # CMD59: turn the card CRC checking on or off
+        self.crc_enabled = True  # CMD59 itself always goes out with a valid CRC7
+        if self.cmd(59, 1 if enabled else 0, 0) != 0:
+            self.crc_enabled = False
+            raise OSError("can't set CRC mode")
+        self.crc_enabled = enabled
+        self.crc = enabled
+
+    def crc_stats(self):
+        # (blocks checked, CRC mismatches, retries)
+        return self.crc_checked, self.crc_errors, self.crc_retries
+
+    def reset_crc_stats(self):
+        self.crc_checked = 0
+        self.crc_errors = 0
+        self.crc_retries = 0
+
     def readinto(self, buf):
+        # returns False if CRC mode is on and the block failed its CRC16 check
         self.cs(0)
 
         # read until start byte (0xff)
@@ -205,27 +301,48 @@ class SDCard:
             mv = mv[: len(buf)]
         self.spi.write_readinto(mv, buf)
 
-        # read checksum
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        # read checksum (kept in crcbuf so callers can verify the block)
+        self.spi.readinto(self.crcbuf, 0xFF)
 
         self.cs(1)
         self.spi.write(b"\xff")
 
+        if self.crc_enabled:
+            self.crc_checked += 1
+            if self.read_crc() != crc16(buf):
+                self.crc_errors += 1
+                return False
+        return True
+
+    def read_crc(self):
+        # CRC16 sent by the card with the last block received by readinto()
+        return self.crcbuf[0] << 8 | self.crcbuf[1]
+
     def write(self, token, buf):
+        # returns the data response token (_DATA_ACCEPTED on success)
         self.cs(0)
 
         # send: start of block, data, checksum
         self.spi.read(1, token)
         self.spi.write(buf)
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        if self.crc_enabled:
+            crc = crc16(buf)
+            self.crcbuf[0] = crc >> 8
+            self.crcbuf[1] = crc
+            self.spi.write(self.crcbuf)
+            self.crc_checked += 1
+        else:
+            self.spi.write(b"\xff")
+            self.spi.write(b"\xff")
 
         # check the response
-        if (self.spi.read(1, 0xFF)[0] & 0x1F) != 0x05:
+        response = self.spi.read(1, 0xFF)[0] & 0x1F
+        if response != _DATA_ACCEPTED:
             self.cs(1)
             self.spi.write(b"\xff")
-            return
+            if response == _DATA_CRC_ERROR:
+                self.crc_errors += 1
+            return response
 
         # wait for write to finish
         while self.spi.read(1, 0xFF)[0] == 0:
@@ -233,6 +350,7 @@ class SDCard:
 
         self.cs(1)
         self.spi.write(b"\xff")
+        return response
 
     def write_token(self, token):
         self.cs(0)
@@ -248,55 +366,151 @@ class SDCard:
     def readblocks(self, block_num, buf):
         nblocks = len(buf) // 512
         assert nblocks and not len(buf) % 512, "Buffer length is invalid"
-        if nblocks == 1:
-            # CMD17: set read address for single block
-            if self.cmd(17, block_num * self.cdv, 0, release=False) != 0:
-                # release the card
-                self.cs(1)
-                raise OSError(5)  # EIO
-            # receive the data and release card
-            self.readinto(buf)
-        else:
-            # CMD18: set read address for multiple blocks
-            if self.cmd(18, block_num * self.cdv, 0, release=False) != 0:
-                # release the card
-                self.cs(1)
-                raise OSError(5)  # EIO
-            offset = 0
-            mv = memoryview(buf)
-            while nblocks:
+        for attempt in range(_CRC_RETRIES + 1):
+            if attempt:
+                self.crc_retries += 1
+            if nblocks == 1:
+                # CMD17: set read address for single block
+                if self.cmd(17, block_num * self.cdv, 0, release=False) != 0:
+                    # release the card
+                    self.cs(1)
+                    raise OSError(5)  # EIO
                 # receive the data and release card
-                self.readinto(mv[offset : offset + 512])
-                offset += 512
-                nblocks -= 1
-            if self.cmd(12, 0, 0xFF, skip1=True):
-                raise OSError(5)  # EIO
+                if self.readinto(buf):
+                    return
+            else:
+                # CMD18: set read address for multiple blocks
+                if self.cmd(18, block_num * self.cdv, 0, release=False) != 0:
+                    # release the card
+                    self.cs(1)
+                    raise OSError(5)  # EIO
+                offset = 0
+                mv = memoryview(buf)
+                ok = True
+                for i in range(nblocks):
+                    # receive the data and release card
+                    ok = self.readinto(mv[offset : offset + 512]) and ok
+                    offset += 512
+                if self.cmd(12, 0, 0xFF, skip1=True):
+                    raise OSError(5)  # EIO
+                if ok:
+                    return
+        raise OSError(5)  # EIO, CRC still wrong after retries
 
     def writeblocks(self, block_num, buf):
         nblocks, err = divmod(len(buf), 512)
         assert nblocks and not err, "Buffer length is invalid"
-        if nblocks == 1:
-            # CMD24: set write address for single block
-            if self.cmd(24, block_num * self.cdv, 0) != 0:
-                raise OSError(5)  # EIO
-
-            # send the data
-            self.write(_TOKEN_DATA, buf)
-        else:
-            # CMD25: set write address for first block
-            if self.cmd(25, block_num * self.cdv, 0) != 0:
+        for attempt in range(_CRC_RETRIES + 1):
+            if attempt:
+                self.crc_retries += 1
+            if nblocks == 1:
+                # CMD24: set write address for single block
+                if self.cmd(24, block_num * self.cdv, 0) != 0:
+                    raise OSError(5)  # EIO
+
+                # send the data
+                response = self.write(_TOKEN_DATA, buf)
+            else:
+                # ACMD23: tell the card how many blocks are coming so it can
+                # pre-erase them instead of doing read-modify-erase per burst
+                if self.write_count_hint:
+                    self.cmd(55, 0, 0)
+                    if self.cmd(23, nblocks, 0) != 0:
+                        self.write_count_hint = False  # not supported, don't try again
+                # CMD25: set write address for first block
+                if self.cmd(25, block_num * self.cdv, 0) != 0:
+                    raise OSError(5)  # EIO
+                # send the data
+                offset = 0
+                mv = memoryview(buf)
+                for i in range(nblocks):
+                    response = self.write(_TOKEN_CMD25, mv[offset : offset + 512])
+                    if response != _DATA_ACCEPTED:
+                        break
+                    offset += 512
+                self.write_token(_TOKEN_STOP_TRAN)
+            if response == _DATA_ACCEPTED:
+                return
+            if response != _DATA_CRC_ERROR:
                 raise OSError(5)  # EIO
-            # send the data
-            offset = 0
-            mv = memoryview(buf)
-            while nblocks:
-                self.write(_TOKEN_CMD25, mv[offset : offset + 512])
-                offset += 512
-                nblocks -= 1
-            self.write_token(_TOKEN_STOP_TRAN)
+        raise OSError(5)  # EIO, CRC still wrong after retries
+
+    def erase(self, block_num, count):
+        # CMD32/CMD33: first and last block of the range, CMD38: erase it.
+        # The card holds the line low (R1b) until the erase is done, at most
+        # _ERASE_TIMEOUT_MS: erase big ranges in several calls.
+        if self.cmd(32, block_num * self.cdv, 0) != 0:
+            raise OSError(5)  # EIO
+        if self.cmd(33, (block_num + count - 1) * self.cdv, 0) != 0:
+            raise OSError(5)  # EIO
+        if self.cmd(38, 0, 0, release=False) != 0:
+            self.cs(1)
+            raise OSError(5)  # EIO
+        deadline = time.ticks_add(time.ticks_ms(), _ERASE_TIMEOUT_MS)
+        while self.spi.read(1, 0xFF)[0] == 0:
+            if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                self.cs(1)
+                self.spi.write(b"\xff")
+                raise OSError("timeout waiting for erase")
+        self.cs(1)
+        self.spi.write(b"\xff")
 
     def ioctl(self, op, arg):
         if op == 4:  # get number of blocks
             return self.sectors
         if op == 5:  # get block size in bytes
-            return 512
\ No newline at end of file
+            return 512
+
+    def _check_block(self, block_num, pattern, readback):
+        errors = self.crc_errors
+        try:
+            for i in range(_CALIBRATION_PASSES):
+                # vary the pattern on each pass so a stale block can't pass
+                for j in range(0, 512, 64):
+                    pattern[j] = (i + j) & 0xFF
+                self.writeblocks(block_num, pattern)
+                self.readblocks(block_num, readback)
+                if readback != pattern or self.read_crc() != crc16(readback):
+                    return False
+        except OSError:
+            return False
+        # with CRC mode on, a mismatch that was fixed by a retry still fails the rate
+        return self.crc_errors == errors
+
+    def calibrate(self, block_num=None, rates=_CALIBRATION_RATES):
+        # Step the SPI clock up through rates and keep the highest one at
+        # which a scratch block can be written and read back intact, with
+        # a matching CRC16.  The original content of the block is restored.
+        # Must be called on an initialised card, before it is mounted.
+        if block_num is None:
+            block_num = self.sectors - 1
+        safe = self.baudrate
+        saved = bytearray(512)
+        self.init_spi(safe)
+        self.readblocks(block_num, saved)
+
+        pattern = bytearray(512)
+        for i in range(512):
+            pattern[i] = (i * 7 + 0x5A) & 0xFF
+        readback = bytearray(512)
+
+        best = safe
+        try:
+            for rate in rates:
+                if rate <= best:
+                    continue
+                self.init_spi(rate)
+                if not self._check_block(block_num, pattern, readback):
+                    break
+                best = rate
+        finally:
+            self.init_spi(safe)
+            self.writeblocks(block_num, saved)
+
+        self.baudrate = best
+        self.init_spi(best)
+        return best
+
+    def set_baudrate(self, baudrate):
+        self.baudrate = baudrate
+        self.init_spi(baudrate)
@@ -3,99 +3,275 @@ Code erreur retourné par les getters:
 -2 : settings not load
 """
 from machine import SPI, Pin
+from micropython import const
 import sdcard
-import ujson
+import blockcache
+import blockpartition
+import logstore
+import uploadqueue
+import settingsstore
 import os
+import utime
+import uasyncio as asyncio
 
 import logger
 
+# Etats de la carte SD
+STATE_UNMOUNTED = const(0)
+STATE_MOUNTED = const(1)
+STATE_ERROR = const(2)
+
+_DEBOUNCE_MS = const(250)  # Le contact de présence rebondit à l'insertion
+_ERROR_RETRY_MS = const(5000)  # Délai avant une nouvelle tentative d'init après une erreur
+_ERASE_STEP = const(256)  # Blocs effacés par commande (voir SDCard.erase, durée bornée)
+
+_LOG_DIR = "/logs"
+_LFS_MOUNT = "/sdlog"
+_FLASH_QUEUE_PATH = "/logqueue.txt"
+_UPLOAD_DIR = "/upload"
+_FLASH_UPLOAD_SEGMENTS = const(8)  # Place max prise en flash par la file d'envoi: 8 segments de 8 ko
+_RAM_QUEUE_MAX = const(32)  # Nombre de logs gardés en RAM avant de les déverser en flash
+_FLASH_QUEUE_MAX = const(65536)  # Taille max en octets de la file en flash
+
 
 class SDManager:
     # Prend en paramétre les numéros des pins sck, mosi,miso, chip select et sdPresent
     #
-    def __init__(self, sck, mosi, miso, SDCardCS, SDPresent):
-        self.settings = {
-            "imat": None,
-            "maxSpeed": None
-        }
+    # cacheBlocks: nombre de blocs du cache (None: ajusté à la mémoire libre)
+    # cacheWriteBack: les blocs modifiés ne sont écrits qu'au sync (syncSdCard) ou à l'éviction
+    def __init__(self, sck, mosi, miso, SDCardCS, SDPresent, cacheBlocks=None, cacheWriteBack=False):
+        self.store = settingsstore.SettingsStore(lambda: self.checkSDConnection() is True)
         self.isSettingsLoad = False
         self.isSdNeedInit = False
         self.isSdInit = False
+        self.state = STATE_UNMOUNTED
+        self.logDir = "/sd"  # "/sdlog" quand la zone LittleFS est montée
+        self.logStore = None
+
+        # Files d'envoi au serveur: sur la carte quand elle est montée, sinon en flash interne
+        self.sdUploadQueue = None
+        self.flashUploadQueue = uploadqueue.UploadQueue(_UPLOAD_DIR, maxSegments=_FLASH_UPLOAD_SEGMENTS)
+
+        # Logs en attente pendant que la carte est absente
+        self.pendingLogs = []
+        self.flashQueueSize = 0
+        self.droppedLogs = 0
 
         self.spi = SPI(1, sck=Pin(sck), mosi=Pin(mosi), miso=Pin(miso))
         self.sd = sdcard.SDCard(self.spi, Pin(SDCardCS))
+        if cacheBlocks is None:
+            cacheBlocks = blockcache.BlockCache.sizeForHeap()
+        self.cache = blockcache.BlockCache(self.sd, cacheBlocks, cacheWriteBack)
 
+        # L'interruption ne fait que lever ce flag, le traitement est fait par la tâche run()
+        self.slotChangeFlag = asyncio.ThreadSafeFlag()
         self.sdPresentPin = Pin(SDPresent, Pin.IN, Pin.PULL_UP) # Todo : vérifier la pullup
         self.sdPresentPin.irq(self.irqSdSlotChange)
 
+        try:
+            self.flashQueueSize = os.stat(_FLASH_QUEUE_PATH)[6]
+        except OSError:
+            pass
+
         try:
             self.initSdCard()
         except OSError as err:
+            self.state = STATE_ERROR
             logger.error(f"OSError while loading SD Card : {err}","SettingsManager")
 
     """
-    Charge les settings enregistré dans settings.conf dans la carte sd
-    Si le fichier n'existe pas, il est crée
-    
+    Charge les settings enregistrés dans settings.conf sur la carte sd, ou en flash interne si la
+    carte est absente. Si le fichier n'existe pas encore sur la carte, il est crée avec les
+    settings actuellement en mémoire.
+    """
+    def loadSettings(self):
+        if self.store.load():
+            logger.info("Settings have been loaded", "SettingsManager")
+        self.isSettingsLoad = True
+        self.store.save()
+
+        if self.checkSDConnection() is True:
+            self.applySdBaudrate()
+            self.mountLogFs()
+            self.openLogStore()
+
+    """
+    Enregistre immédiatement les settings en mémoire (sur la carte sd, sinon en flash)
+    Les modifications faites par les setters sont de toute façon enregistrées par la tâche
+    store.run() sans avoir à appeler cette fonction.
+
     Renvoi:
+     -2 si l'écriture a échoué
+    """
+    def saveSettings(self):
+        if not self.store.save(force=True):
+            return -2
+
+    def initSdCard(self):
+        self.sd.init_card_from_constructor()
+        self.cache.invalidate()
+        os.mount(self.cache, "/sd")
+        self.isSdInit = True
+        self.state = STATE_MOUNTED
+
+    """
+    Applique la vitesse SPI enregistrée dans les settings.
+    Si aucune vitesse n'a encore été calibrée pour la carte, la calibration est lancée
+    et le résultat est enregistré.
+    """
+    def applySdBaudrate(self):
+        self.setSdCrc(self.store.get("sdCrc"))
+
+        baudrate = self.store.get("sdBaudrate")
+        if baudrate:
+            self.sd.set_baudrate(baudrate)
+            logger.info(f"SD SPI baudrate set to {baudrate}", "SettingsManager")
+        else:
+            self.calibrateSdSpeed()
+
+    """
+    Cherche la vitesse SPI la plus élevée sans erreur de transfert (écriture puis relecture d'un
+    bloc de test avec vérification du CRC16) et l'enregistre dans les settings.
+    La carte est démontée pendant la calibration.
+
+    Renvoi:
+     la vitesse retenue
      -1 si la vérification d'accès à la carte SD à échoué.
-     -2 si l'accès au fichier à échoué (OSError)
     """
+    def calibrateSdSpeed(self):
+        if self.checkSDConnection() is not True:
+            return -1
 
-    def loadSettings(self):
-        if not self.checkSDConnection():
-            self.isSettingsLoad = False
+        self.cache.sync()
+        os.umount("/sd")
+        try:
+            baudrate = self.sd.calibrate()
+        finally:
+            os.mount(self.cache, "/sd")
+        logger.info(f"SD SPI baudrate calibrated to {baudrate}", "SettingsManager")
+
+        self.store.set("sdBaudrate", baudrate)
+        self.saveSettings()
+        return baudrate
+
+    """
+    Active ou désactive le mode CRC de la carte SD (CMD59). Les compteurs de blocs vérifiés,
+    d'erreurs et de relectures sont disponibles via getSdCrcStats().
+    """
+    def setSdCrc(self, enabled):
+        if self.checkSDConnection() is not True:
             return -1
+        self.sd.set_crc(enabled)
+        self.store.set("sdCrc", enabled)
+
+    def getSdCrcStats(self):
+        return self.sd.crc_stats()
 
+    """
+    Efface (CMD32/33/38) une zone de la carte réservée aux logs, par paquets de step blocs
+    en rendant la main entre chaque paquet, pour être lancé quand le système est inactif.
+    Les écritures suivantes dans la zone n'ont plus à attendre l'effacement interne de la carte.
+    La zone ne doit pas recouvrir le système de fichiers FAT.
+    """
+    async def preEraseLogRegion(self, start, count, step=_ERASE_STEP):
+        end = start + count
+        while start < end and self.checkSDConnection() is True:
+            n = min(step, end - start)
+            self.sd.erase(start, n)
+            self.cache.discard(start, n)
+            start += n
+            await asyncio.sleep_ms(0)
+
+    def deInitSdCard(self):
+        self.isSdInit = False
+        self.state = STATE_UNMOUNTED
+        self.cache.invalidate()
+        self.logStore = None
+        self.sdUploadQueue = None
+        self.unmountLogFs()
         try:
-            if not "settings.conf" in os.listdir(
-                    "sd"):  # Si le fichier de config n'existe pas alors on enregistre les settings actuellement en mémoire
-                self.saveSettings()
+            os.umount("/sd")
+        except OSError:  # Déjà démonté (init ratée)
+            pass
 
-                self.isSettingsLoad = True  # Inutile de charger les settings puisqu'ils sont déjà en mémoire
-                return
+    def _logPartition(self, lfsBlocks):
+        return blockpartition.BlockPartition(self.sd, self.sd.sectors - lfsBlocks, lfsBlocks)
+
+    """
+    Monte la zone LittleFS de fin de carte sur /sdlog si elle a été créée par formatCard().
+    Les logs y sont alors écrits, la partie FAT ne garde que les fichiers modifiables à la main.
+    """
+    def mountLogFs(self):
+        lfsBlocks = self.store.get("lfsBlocks")
+        if not lfsBlocks or self.logDir == _LFS_MOUNT:
+            return
+        try:
+            os.mount(os.VfsLfs2(self._logPartition(lfsBlocks), readsize=512, progsize=512), _LFS_MOUNT)
+        except OSError as err:
+            logger.error(f"Can't mount log filesystem : {err}", "SettingsManager")
+            return
+        self.logDir = _LFS_MOUNT
 
-            with open("/sd/settings.conf", "r") as file:
-                self.settings = ujson.load(file)
-                file.close()
-                self.isSettingsLoad = True
-                logger.info("Settings have been loaded", "SettingsManager")
+    def openLogStore(self):
+        try:
+            self.logStore = logstore.LogStore(self.logDir + _LOG_DIR,
+                                              maxRecords=self.store.get("logRecordsPerFile"),
+                                              minFree=self.store.get("logMinFreeKb") * 1024)
+            self.sdUploadQueue = uploadqueue.UploadQueue(self.logDir + _UPLOAD_DIR)
         except OSError as err:
-            self.isSettingsLoad = False
-            logger.error("Error while accessing sd card", "SettingsManager")
-            logger.error("OS error: {0}".format(err))
-            return -2
+            self.logStore = None
+            self.sdUploadQueue = None
+            logger.error(f"Can't open log store : {err}", "SettingsManager")
+
+    def unmountLogFs(self):
+        if self.logDir == _LFS_MOUNT:
+            self.logDir = "/sd"
+            try:
+                os.umount(_LFS_MOUNT)
+            except OSError:
+                pass
 
     """
-    Eregistre les settings en mémoire dans settings.conf dans la carte sd
-    Si le fichier n'existe pas, il est crée
+    Reformate la carte: FAT sur le début, et si lfsBlocks > 0 une zone LittleFS de lfsBlocks blocs
+    en fin de carte pour les logs (résiste mieux aux coupures et aux petits ajouts fréquents).
+    TOUT LE CONTENU DE LA CARTE EST PERDU. Les settings en mémoire sont réécrits ensuite.
 
     Renvoi:
      -1 si la vérification d'accès à la carte SD à échoué.
-     -2 si l'accès au fichier à échoué (OSError)
     """
-    def saveSettings(self):
-        if not self.checkSDConnection():
+    def formatCard(self, lfsBlocks=0):
+        if self.checkSDConnection() is not True:
             return -1
 
-        try:
-            with open("/sd/settings.conf", "w") as file:
-                ujson.dump(self.settings, file)
-                logger.info("Settings saved", module="SettingsManager")
-                file.close()
-        except OSError as err:
-            logger.error("Error while accessing sd card", "SettingsManager")
-            logger.error("OS error: {0}".format(err))
-            return -2
+        self.unmountLogFs()
+        self.cache.sync()
+        os.umount("/sd")
+        self.cache.invalidate()
 
-    def initSdCard(self):
-        self.sd.init_card_from_constructor()
-        os.mount(self.sd, "/sd")
-        self.isSdInit = True
+        fatBlocks = self.sd.sectors - lfsBlocks
+        os.VfsFat.mkfs(blockpartition.BlockPartition(self.cache, 0, fatBlocks))
+        if lfsBlocks:
+            # Zone pré-effacée: les premières écritures de logs n'attendent pas l'effacement interne
+            for start in range(fatBlocks, self.sd.sectors, _ERASE_STEP):
+                self.sd.erase(start, min(_ERASE_STEP, self.sd.sectors - start))
+            os.VfsLfs2.mkfs(self._logPartition(lfsBlocks), readsize=512, progsize=512)
+        os.mount(self.cache, "/sd")
 
-    def deInitSdCard(self):
-        os.umount("/sd")
-        self.isSdInit = False
+        self.store.set("lfsBlocks", lfsBlocks)
+        self.saveSettings()
+        self.mountLogFs()
+        self.openLogStore()
+
+    """
+    Écrit sur la carte les blocs modifiés encore en cache (mode write-back)
+    """
+    def syncSdCard(self):
+        self.cache.sync()
+
+    # Retour: (hits, misses) du cache de blocs
+    def getSdCacheStats(self):
+        return (self.cache.ioctl(blockcache.IOCTL_CACHE_HITS, 0),
+                self.cache.ioctl(blockcache.IOCTL_CACHE_MISSES, 0))
 
     # Retour:
     # True: Carte accessible
@@ -105,33 +281,201 @@ class SDManager:
     def checkSDConnection(self):
         if not self.sdPresentPin.value():  # On vérifie que la carte est inséré
             return -1
-        if not self.isSdInit:  # On vérifie la bonne initialisaiton
+        if self.state != STATE_MOUNTED:  # On vérifie la bonne initialisaiton
             return -2
 
         return True
 
-    def irqSdSlotChange(self):
-        if self.sdPresentPin.value():
+    def irqSdSlotChange(self, pin):
+        self.slotChangeFlag.set()
+
+    """
+    Tâche de gestion de l'insertion / du retrait de la carte.
+    Attend les changements signalés par l'interruption, laisse passer les rebonds du contact puis
+    monte ou démonte la carte. En cas d'erreur, l'init est retentée périodiquement.
+    """
+    async def run(self):
+        while True:
+            if self.state == STATE_ERROR:
+                try:
+                    await asyncio.wait_for_ms(self.slotChangeFlag.wait(), _ERROR_RETRY_MS)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.slotChangeFlag.wait()
+
+            # Debounce: on attend que le contact soit stable
+            present = self.sdPresentPin.value()
+            while True:
+                await asyncio.sleep_ms(_DEBOUNCE_MS)
+                value = self.sdPresentPin.value()
+                if value == present:
+                    break
+                present = value
+
+            if present and self.state != STATE_MOUNTED:
+                self.onCardInserted()
+            elif not present and self.state != STATE_UNMOUNTED:
+                self.onCardRemoved()
+
+    def onCardInserted(self):
+        try:
+            if self.state == STATE_ERROR:
+                self.deInitSdCard()
             self.initSdCard()
-            self.loadSettings()
-        else:
-            self.deInitSdCard()
+        except OSError as err:
+            self.state = STATE_ERROR
+            logger.error(f"OSError while loading SD Card : {err}", "SettingsManager")
+            return
+        logger.info("SD card mounted", "SettingsManager")
+        self.loadSettings()
+        self.drainLogQueue()
+
+    def onCardRemoved(self):
+        self.deInitSdCard()
+        logger.info("SD card removed", "SettingsManager")
+
+    """
+    Ajoute une ligne au log de la carte SD, horodatée avec timestamp (par défaut l'heure courante).
+    Les logs sont découpés par jour et indexés, voir queryLogs().
+    Si la carte est absente ou en erreur, la ligne est gardée en RAM puis en flash
+    (file bornée) et sera écrite au prochain montage de la carte.
+    """
+    def writeLog(self, line, timestamp=None):
+        if timestamp is None:
+            timestamp = utime.time()
+        line = f"{timestamp},{line}"
+        if self.state == STATE_MOUNTED and self.logStore:
+            try:
+                self.logStore.append(line)
+                return
+            except OSError as err:
+                self.state = STATE_ERROR
+                self.slotChangeFlag.set()
+                logger.error(f"Error while writing log : {err}", "SettingsManager")
+        self.queueLog(line)
+
+    """
+    Enregistrements (lignes "<timestamp>,<données>") entre les timestamps start et end.
+    Renvoi: un générateur, ou -1 si la carte n'est pas accessible
+    """
+    def queryLogs(self, start, end):
+        if self.checkSDConnection() is not True or not self.logStore:
+            return -1
+        return self.logStore.query(start, end)
+
+    """
+    Ajoute un enregistrement à la file d'envoi au serveur (carte SD, ou flash si elle est absente)
+    """
+    def queueUpload(self, record):
+        if self.state == STATE_MOUNTED and self.sdUploadQueue:
+            try:
+                self.sdUploadQueue.push(record)
+                return
+            except OSError as err:
+                logger.error(f"Error while writing upload queue : {err}", "SettingsManager")
+        try:
+            self.flashUploadQueue.push(record)
+        except OSError as err:
+            logger.error(f"Error while writing upload queue to flash : {err}", "SettingsManager")
+
+    # Files d'envoi à vider, la flash (enregistrements faits sans carte) en premier
+    def uploadQueues(self):
+        if self.state == STATE_MOUNTED and self.sdUploadQueue:
+            return self.flashUploadQueue, self.sdUploadQueue
+        return (self.flashUploadQueue,)
+
+    # Chemin d'un fichier temporaire, sur la carte si elle est montée pour épargner la flash
+    def tmpPath(self, name):
+        if self.state == STATE_MOUNTED:
+            return "/sd/" + name
+        return "/" + name
+
+    def queueLog(self, line):
+        self.pendingLogs.append(line)
+        if len(self.pendingLogs) >= _RAM_QUEUE_MAX:
+            self.spillLogQueue()
+
+    # Déverse la file RAM dans la file en flash, en respectant sa taille max
+    def spillLogQueue(self):
+        try:
+            with open(_FLASH_QUEUE_PATH, "a") as file:
+                for line in self.pendingLogs:
+                    if self.flashQueueSize + len(line) + 1 > _FLASH_QUEUE_MAX:
+                        self.droppedLogs += 1
+                        continue
+                    file.write(line)
+                    file.write("\n")
+                    self.flashQueueSize += len(line) + 1
+        except OSError as err:
+            self.droppedLogs += len(self.pendingLogs)
+            logger.error(f"Error while writing log queue to flash : {err}", "SettingsManager")
+        self.pendingLogs = []
+
+    # Retire de la file en flash ses count premières lignes (déjà écrites sur la carte)
+    def _dropFlashQueueLines(self, count):
+        size = 0
+        with open(_FLASH_QUEUE_PATH, "r") as queue, open(_FLASH_QUEUE_PATH + ".tmp", "w") as rest:
+            for line in queue:
+                if count:
+                    count -= 1
+                    continue
+                rest.write(line)
+                size += len(line)
+        os.remove(_FLASH_QUEUE_PATH)
+        os.rename(_FLASH_QUEUE_PATH + ".tmp", _FLASH_QUEUE_PATH)
+        self.flashQueueSize = size
+
+    # Écrit sur la carte les logs en attente (flash d'abord, puis RAM) pour garder l'ordre.
+    # Après une erreur, seules les lignes déjà écrites sont retirées des files: pas de doublon
+    # au prochain essai.
+    def drainLogQueue(self):
+        if not self.pendingLogs and not self.flashQueueSize:
+            return
+        if not self.logStore:
+            return
+        flashWritten = 0
+        ramWritten = 0
+        try:
+            if self.flashQueueSize:
+                with open(_FLASH_QUEUE_PATH, "r") as queue:
+                    for line in queue:
+                        self.logStore.append(line.rstrip("\n"))
+                        flashWritten += 1
+                os.remove(_FLASH_QUEUE_PATH)
+                self.flashQueueSize = 0
+            for line in self.pendingLogs:
+                self.logStore.append(line)
+                ramWritten += 1
+        except OSError as err:
+            logger.error(f"Error while draining log queue : {err}", "SettingsManager")
+            self.pendingLogs = self.pendingLogs[ramWritten:]
+            if self.flashQueueSize and flashWritten:
+                try:
+                    self._dropFlashQueueLines(flashWritten)
+                except OSError as err:
+                    logger.error(f"Error while trimming log queue : {err}", "SettingsManager")
+            return
+        self.pendingLogs = []
+        if self.droppedLogs:
+            logger.warn(f"{self.droppedLogs} logs lost while SD card was unavailable", "SettingsManager")
+            self.droppedLogs = 0
 
     """
     Getters
     """
 
     def getImat(self):
-        return self.settings["imat"] if self.isSettingsLoad else -2
+        return self.store.get("imat") if self.isSettingsLoad else -2
 
     def getMaxSpeed(self):
-        return self.settings["maxSpeed"] if self.isSettingsLoad else -2
+        return self.store.get("maxSpeed") if self.isSettingsLoad else -2
 
     """
     Setters
     """
     def setImat(self, value):
-        self.settings["imat"] = value
+        return self.store.set("imat", value)
 
     def setMaxSpeed(self, value):
-        self.settings["maxSpeed"] = value
+        return self.store.set("maxSpeed", value)
@@ -0,0 +1,228 @@
+"""
+Stockage des settings du tracker.
+
+Les valeurs sont gardées en RAM, typées, et les getters ne touchent jamais la carte SD.
+Les modifications marquent le store comme modifié (dirty) ; la tâche run() regroupe les
+modifications rapprochées en une seule écriture.
+
+L'écriture sur la carte SD est atomique: le fichier temporaire est écrit puis renommé. Si une
+coupure survient entre la suppression de l'ancien fichier et le renommage, le fichier temporaire
+(complet) est repris au chargement suivant.
+Sans carte SD, les settings sont lus et écrits dans une base btree en flash interne. Les clés
+modifiées pendant l'absence de la carte y sont notées (clé _PENDING_KEY): au retour de la carte,
+leurs valeurs en flash remplacent celles du fichier de la carte, puis sont écrites sur la carte.
+"""
+import os
+import ujson
+import uasyncio as asyncio
+from micropython import const
+
+import logger
+
+try:
+    import btree
+except ImportError:  # Firmware compilé sans btree: pas de repli en flash
+    btree = None
+
+SD_PATH = "/sd/settings.conf"
+SD_TMP_PATH = "/sd/settings.tmp"
+FLASH_PATH = "/settings.db"
+_PENDING_KEY = b"_pending"  # Clés modifiées depuis la dernière écriture sur la carte SD
+
+_SAVE_DELAY_MS = const(2000)  # Les modifications faites dans cet intervalle sont écrites ensemble
+
+# nom: (type, valeur par défaut)
+SCHEMA = {
+    "imat": (str, None),
+    "maxSpeed": (int, None),
+    "sdBaudrate": (int, None),
+    "sdCrc": (bool, False),
+    "lfsBlocks": (int, 0),  # Taille de la zone LittleFS des logs en fin de carte (0: pas de zone)
+    "logRecordsPerFile": (int, 0),  # 0: un fichier de log par jour
+    "logMinFreeKb": (int, 1024),  # En dessous, les logs les plus anciens sont supprimés
+    "apn": (str, None),
+    "uploadUrl": (str, None),
+    "uploadBatch": (int, 20),  # Nombre maximal d'enregistrements par requête (lots ajustés par uplink.py)
+    "uploadMaxAgeS": (int, 600),  # Âge au-delà duquel une position part sans attendre lot complet ni bon signal
+    "uploadFormat": (str, "json"),  # "json" ou "binary" (format compact de telemetry.py)
+    "uploadCompress": (bool, False),  # Corps JSON compressés (deflate) si le serveur les accepte
+    "modemSleep": (bool, True),  # Veille du modem entre les commandes (AT+CSCLK=1, réveil par DTR)
+    "otaUrl": (str, None),  # Répertoire des mises à jour (version, bundle.bin), voir ota.py
+    "smsWhitelist": (str, None),  # Numéros autorisés à envoyer des commandes SMS, séparés par des virgules
+}
+
+
+class SettingsStore:
+    # sdAvailable: fonction qui renvoie True si la carte SD est montée
+    def __init__(self, sdAvailable, schema=SCHEMA):
+        self.sdAvailable = sdAvailable
+        self.schema = schema
+        self.values = {}
+        for key in schema:
+            self.values[key] = schema[key][1]
+        self.dirty = False
+        self.changedKeys = set()  # Clés modifiées depuis la dernière écriture
+        self.flashPending = False  # Des clés attendent en flash d'être écrites sur la carte SD
+        self.subscribers = []
+        self.changed = asyncio.Event()
+
+    def get(self, key):
+        return self.values[key]
+
+    """
+    Modifie une valeur (convertie au type du schéma) et prévient les abonnés si elle a changé.
+    Renvoi: False si la clé est inconnue ou la valeur non convertible
+    """
+    def set(self, key, value):
+        if key not in self.schema:
+            return False
+        if value is not None:
+            try:
+                value = self.schema[key][0](value)
+            except (TypeError, ValueError):
+                return False
+        if self.values[key] == value:
+            return True
+        self.values[key] = value
+        self.dirty = True
+        self.changedKeys.add(key)
+        self.changed.set()
+        for callback in self.subscribers:
+            callback(key, value)
+        return True
+
+    # callback(key, value) est appelé à chaque modification
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def _merge(self, loaded):
+        for key in loaded:
+            if key in self.schema:
+                value = loaded[key]
+                if value is not None:
+                    try:
+                        value = self.schema[key][0](value)
+                    except (TypeError, ValueError):
+                        continue
+                self.values[key] = value
+
+    """
+    Charge les settings depuis la carte SD si elle est montée, sinon depuis la flash. Les
+    modifications faites sans carte et pas encore écrites sur la carte sont reprises de la flash.
+    Renvoi: True si un fichier de settings a été trouvé
+    """
+    def load(self):
+        if self.sdAvailable():
+            found = False
+            for path in (SD_PATH, SD_TMP_PATH):
+                try:
+                    with open(path, "r") as file:
+                        self._merge(ujson.load(file))
+                except (OSError, ValueError):
+                    continue
+                found = True
+                if path == SD_TMP_PATH:  # Écriture interrompue: on la termine
+                    self.dirty = True
+                break
+            if not found:
+                self.dirty = True  # Pas encore de fichier sur cette carte
+            if self._loadFlash(pendingOnly=True):
+                self.dirty = True
+            return found
+        return self._loadFlash()
+
+    """
+    Écrit les settings s'ils ont été modifiés. Renvoi: False en cas d'erreur d'écriture
+    """
+    def save(self, force=False):
+        if not (self.dirty or force):
+            return True
+        try:
+            if self.sdAvailable():
+                self._saveSd()
+                if self.flashPending:
+                    self._clearFlashPending()
+            else:
+                self._saveFlash()
+        except OSError as err:
+            logger.error(f"Error while saving settings : {err}", "SettingsStore")
+            return False
+        self.dirty = False
+        self.changedKeys = set()
+        logger.info("Settings saved", "SettingsStore")
+        return True
+
+    def _saveSd(self):
+        with open(SD_TMP_PATH, "w") as file:
+            ujson.dump(self.values, file)
+        try:
+            os.remove(SD_PATH)  # FAT ne sait pas renommer par-dessus un fichier existant
+        except OSError:
+            pass
+        os.rename(SD_TMP_PATH, SD_PATH)
+
+    def _openFlash(self):
+        try:
+            file = open(FLASH_PATH, "r+b")
+        except OSError:
+            file = open(FLASH_PATH, "w+b")
+        return file, btree.open(file)
+
+    # pendingOnly: ne charge que les clés en attente d'écriture sur la carte SD
+    def _loadFlash(self, pendingOnly=False):
+        if btree is None:
+            return False
+        try:
+            file, db = self._openFlash()
+        except OSError:
+            return False
+        pending = ujson.loads(db[_PENDING_KEY]) if _PENDING_KEY in db else []
+        keys = [key.encode() for key in pending] if pendingOnly else db
+        loaded = {}
+        for key in keys:
+            if key != _PENDING_KEY and key in db:
+                loaded[key.decode()] = ujson.loads(db[key])
+        db.close()
+        file.close()
+        self._merge(loaded)
+        self.flashPending = bool(pending)
+        return bool(loaded)
+
+    def _saveFlash(self):
+        if btree is None:
+            raise OSError("btree not available")
+        file, db = self._openFlash()
+        for key in self.values:
+            db[key] = ujson.dumps(self.values[key])
+        pending = set(ujson.loads(db[_PENDING_KEY])) if _PENDING_KEY in db else set()
+        pending.update(self.changedKeys)
+        if pending:
+            db[_PENDING_KEY] = ujson.dumps(list(pending))
+            self.flashPending = True
+        db.flush()
+        db.close()
+        file.close()
+
+    def _clearFlashPending(self):
+        if btree is not None:
+            file, db = self._openFlash()
+            if _PENDING_KEY in db:
+                del db[_PENDING_KEY]
+            db.flush()
+            db.close()
+            file.close()
+        self.flashPending = False
+
+    """
+    Tâche d'écriture différée: attend une modification, laisse passer les suivantes pendant
+    _SAVE_DELAY_MS puis écrit le tout en une fois.
+    """
+    async def run(self):
+        while True:
+            await self.changed.wait()
+            await asyncio.sleep_ms(_SAVE_DELAY_MS)
+            self.changed.clear()
+            self.save()
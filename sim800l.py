@@ -1,9 +1,11 @@
 # Imports
+import os
 import time
 import json
 
 import utime
-from machine import Pin
+import uasyncio as asyncio
+from machine import Pin, UART
 
 import logger as log
 from micropython import const
@@ -28,11 +30,128 @@ class Logger(object):
 
 logger = Logger()
 
+_POLL_MS = const(10)  # UART polling period of the blocking AT engine
+_OUTPUT_SIZE = const(512)  # Initial size of the reusable AT response buffer
+_RX_CHUNK = const(256)  # UART read size of the reader task
+_LINE_SIZE = const(256)  # Longest line kept whole by the reader task
+_LINKS = const(6)  # Connections available with AT+CIPMUX=1
+_DATA_CHUNK = const(512)  # Buffer size of streamed HTTP bodies
+_WAKE_MS = const(60)  # UART ready 50 ms after DTR goes low (AT+CSCLK=1)
+_IDLE_MS = const(2000)  # Time without activity before the modem is put to sleep
+_HTTPDATA_MAX_MS = const(120000)  # Longest time accepted by AT+HTTPDATA
+_BAUD_SWITCH_MS = const(100)  # Settling time after a UART rate change
+
+# Rates tried, in this order, to find the modem when its rate is unknown
+_BAUDRATES = (38400, 115200, 460800, 9600, 57600, 19200, 230400)
+
+# Network registration status (AT+CREG): registered on the home network or
+# roaming. 0: not searching, 2: searching, 3: denied, 4: unknown.
+REG_HOME = const(1)
+REG_ROAMING = const(5)
+
+# Unsolicited result codes recognised on the UART. Lines starting with one of
+# these are dispatched to the handlers registered with Modem.register_urc()
+# instead of being mixed in command responses.
+_URC_PREFIXES = (
+    b'RING', b'+CMTI', b'+CMT:', b'+CDS', b'+CREG', b'+CPIN', b'+CFUN', b'+CLIP',
+    b'UNDER-VOLTAGE', b'OVER-VOLTAGE', b'+HTTPACTION', b'NORMAL POWER DOWN',
+    b'RDY', b'Call Ready', b'SMS Ready', b'NO CARRIER', b'+RECEIVE',
+)
+
+# Commands table: name -> (command, timeout in ms, expected end).
+# Commands without parameter are stored as bytes, the others as a template
+# formatted on demand. A None command means the data itself is sent.
+# Timeouts run from the moment the command is written.
+_COMMANDS = {
+    'modeminfo': (b'ATI', 3000, b'OK'),
+    'probe': (b'AT', 300, b'OK'),
+    'firmware': (b'AT+CGMR', 3000, b'OK'),
+    'callready': (b'AT+CCALR?', 3000, b'OK'),
+    'setbaudrate': ('AT+IPR={}', 3000, b'OK'),
+    'setflowcontrol': (b'AT+IFC=2,2', 3000, b'OK'),
+    'listcommands': (b'AT+CLAC', 5000, b'OK'),
+    'fwrevision': (b'AT+CGMR', 3000, b'OK'),
+    'battery': (b'AT+CBC', 3000, b'OK'),
+    'scan': (b'AT+COPS=?', 60000, b'OK'),
+    'network': (b'AT+COPS?', 3000, b'OK'),
+    'signal': (b'AT+CSQ', 3000, b'OK'),
+    'checkreg': (b'AT+CREG?', 3000, b'OK'),
+    'setcreg': ('AT+CREG={}', 3000, b'OK'),
+    'setapn': ('AT+SAPBR=3,1,"APN","{}"', 3000, b'OK'),
+    'setuser': ('AT+SAPBR=3,1,"USER","{}"', 3000, b'OK'),
+    'setpwd': ('AT+SAPBR=3,1,"PWD","{}"', 3000, b'OK'),
+    'initgprs': (b'AT+SAPBR=3,1,"Contype","GPRS"', 3000, b'OK'),
+    'setpin': ('AT+CPIN="{}"', 3000, b'OK'),
+    'checksim': (b'AT+CPIN?', 3000, b'OK'),
+    'seterrorlog': (b'AT+CMEE=1', 3000, b'OK'),
+    'setslowclock': ('AT+CSCLK={}', 3000, b'OK'),
+    'setsmstextmode': (b'AT+CMGF=1', 3000, b'OK'),
+    'setsmsmode': ('AT+CMGF={}', 3000, b'OK'),
+    'smsprompt': ('AT+CMGS={}', 5000, b'>'),
+    'smsbody': (None, 60000, b'OK'),
+    'setsmsnotify': (b'AT+CNMI=2,1,0,0,0', 3000, b'OK'),
+    'readsms': ('AT+CMGR={}', 5000, b'OK'),
+    'deletesms': ('AT+CMGD={}', 5000, b'OK'),
+    'listsms': (b'AT+CMGL="ALL",1', 20000, b'OK'),
+    # Appeared on hologram net here or below
+
+    'opengprs': (b'AT+SAPBR=1,1', 3000, b'OK'),
+    'getbear': (b'AT+SAPBR=2,1', 3000, b'OK'),
+    'inithttp': (b'AT+HTTPINIT', 3000, b'OK'),
+    'sethttp': (b'AT+HTTPPARA="CID",1', 3000, b'OK'),
+    'checkssl': (b'AT+CIPSSL=?', 3000, b'OK'),
+    'enablessl': (b'AT+HTTPSSL=1', 3000, b'OK'),
+    'disablessl': (b'AT+HTTPSSL=0', 3000, b'OK'),
+    'initurl': ('AT+HTTPPARA="URL","{}"', 3000, b'OK'),
+    'doget': (b'AT+HTTPACTION=0', 30000, b'+HTTPACTION'),
+    'setcontent': ('AT+HTTPPARA="CONTENT","{}"', 3000, b'OK'),
+    'postlen': ('AT+HTTPDATA={},5000', 3000, b'DOWNLOAD'),
+    # "data" is data_lenght in this context, while 5000 is the timeout
+    'dumpdata': (None, 1000, b'OK'),
+    'poststream': ('AT+HTTPDATA={},{}', 3000, b'DOWNLOAD'),
+    'setuserdata': ('AT+HTTPPARA="USERDATA","{}"', 3000, b'OK'),
+    'dopost': (b'AT+HTTPACTION=1', 30000, b'+HTTPACTION'),
+    'getdata': (b'AT+HTTPREAD', 3000, b'OK'),
+    'readrange': ('AT+HTTPREAD={},{}', 10000, b'OK'),
+    'closehttp': (b'AT+HTTPTERM', 3000, b'OK'),
+    'closebear': (b'AT+SAPBR=0,1', 3000, b'OK'),
+
+    # TCP/IP stack, used by the socket transport (CIPMUX=1, links 0 to 5)
+    'cipshut': (b'AT+CIPSHUT', 65000, b'SHUT OK'),
+    'setmux': ('AT+CIPMUX={}', 3000, b'OK'),
+    'setcstt': ('AT+CSTT="{}","{}","{}"', 3000, b'OK'),
+    'ciicr': (b'AT+CIICR', 85000, b'OK'),
+    'cifsr': (b'AT+CIFSR', 3000, None),
+    'setkeepalive': ('AT+CIPTKA=1,{},{},{}', 3000, b'OK'),
+    'cipstart': ('AT+CIPSTART={},"{}","{}",{}', 3000, b'OK'),
+    'cipsend': ('AT+CIPSEND={},{}', 3000, b'>'),
+}
+
+# References:
+# https://github.com/olablt/micropython-sim800/blob/4d181f0c5d678143801d191fdd8a60996211ef03/app_sim.py
+# https://arduino.stackexchange.com/questions/23878/what-is-the-proper-way-to-send-data-through-http-using-sim908
+# https://stackoverflow.com/questions/35781962/post-api-rest-with-at-commands-sim800
+# https://arduino.stackexchange.com/questions/34901/http-post-request-in-json-format-using-sim900-module (full post example)
+
+# Precompute the exact terminator line of each command once
+for _name in _COMMANDS:
+    _template, _timeout, _end = _COMMANDS[_name]
+    _COMMANDS[_name] = (_template, _timeout, _end, None if _end is None else _end + b'\r\n')
+
 
 class GenericATError(Exception):
     pass
 
 
+class SocketError(Exception):
+    pass
+
+
+def _http_data_ms(length):
+    # AT+HTTPDATA time for a length byte body, capped to what the modem accepts
+    return min(_HTTPDATA_MAX_MS, 5000 + length * 10)
+
+
 class Response(object):
 
     def __init__(self, status_code, content):
@@ -40,9 +159,407 @@ class Response(object):
         self.content = content
 
 
+class HttpSession(object):
+    # Keeps the bearer and the HTTP context open between requests: URL and
+    # content type are only sent when they change, and each POST costs
+    # HTTPDATA + data + HTTPACTION (+ HTTPREAD when there is a body) instead
+    # of the full init/terminate sequence of Modem.http_request().
+    # The context is re-initialised only after an error.
+
+    def __init__(self, modem, url, content_type='application/json'):
+        self.modem = modem
+        self.url = url
+        self.content_type = content_type
+        self.content_encoding = None  # e.g. 'deflate', sent as a USERDATA header
+        self.range_start = 0  # Sent as a "Range: bytes=<n>-" header when not 0
+        self.opened = False
+        self._sent_url = None
+        self._sent_content_type = None
+        self._sent_userdata = ''
+
+    async def open(self):
+        modem = self.modem
+
+        # Are we  connected?
+        if not await modem.get_ip_addr_async():
+            raise Exception('Error, modem is not connected')
+
+        # Close the http context if left open somehow
+        try:
+            await modem.execute_at_command_async('closehttp')
+        except GenericATError:
+            pass
+        await modem.execute_at_command_async('inithttp')
+        await modem.execute_at_command_async('sethttp')
+
+        if self.url.startswith('https://'):
+            if not modem.ssl_available:
+                raise NotImplementedError("SSL is only supported by firmware revisions >= R14.00")
+            await modem.execute_at_command_async('enablessl')
+        elif modem.ssl_available:
+            await modem.execute_at_command_async('disablessl')
+
+        self._sent_url = None
+        self._sent_content_type = None
+        self._sent_userdata = ''
+        self.opened = True
+
+    async def close(self):
+        self.opened = False
+        try:
+            await self.modem.execute_at_command_async('closehttp')
+        except GenericATError:
+            pass
+
+    async def _send_params(self):
+        modem = self.modem
+        if self._sent_url != self.url:
+            await modem.execute_at_command_async('initurl', data=self.url)
+            self._sent_url = self.url
+        if self._sent_content_type != self.content_type:
+            await modem.execute_at_command_async('setcontent', self.content_type)
+            self._sent_content_type = self.content_type
+
+        # Extra headers, separated by a literal \r\n as the modem expects
+        headers = []
+        if self.content_encoding:
+            headers.append('Content-Encoding: ' + self.content_encoding)
+        if self.range_start:
+            headers.append('Range: bytes={}-'.format(self.range_start))
+        userdata = '\\r\\n'.join(headers)
+        if self._sent_userdata != userdata:
+            await modem.execute_at_command_async('setuserdata', userdata)
+            self._sent_userdata = userdata
+
+    async def _post(self, data, length=None):
+        # data is the body, or a file streamed from its current position
+        # when length is given
+        modem = self.modem
+        await self._send_params()
+
+        if length is None:
+            await modem.execute_at_command_async('postlen', len(data))
+            await modem.execute_at_command_async('dumpdata', data)
+        else:
+            # Time allowed by the modem to receive the body: 10 ms/byte is
+            # ~1000 baud, far below any UART rate in use
+            await modem.execute_at_command_async('poststream', (length, _http_data_ms(length)))
+            await modem.write_data_async(data, length)
+        output = await modem.execute_at_command_async('dopost')
+
+        # +HTTPACTION: <method>,<status>,<length>
+        pieces = output.split(',')
+        response_status_code = pieces[1]
+        response_content = ''
+        if len(pieces) > 2 and int(pieces[2]) > 0:
+            response_content = await modem.execute_at_command_async('getdata', clean_output=False)
+        return Response(status_code=response_status_code, content=response_content)
+
+    async def post(self, data):
+        # One retry on a fresh context if the open one failed
+        for attempt in range(2):
+            if not self.opened:
+                await self.open()
+            try:
+                return await self._post(data)
+            except Exception:
+                self.opened = False
+                if attempt:
+                    raise
+
+    async def post_file(self, path):
+        # Posts the content of a file, streamed to the modem by chunks
+        size = os.stat(path)[6]
+        for attempt in range(2):
+            if not self.opened:
+                await self.open()
+            try:
+                with open(path, 'rb') as file:
+                    return await self._post(file, size)
+            except Exception:
+                self.opened = False
+                if attempt:
+                    raise
+
+    async def _get(self, offset):
+        # GET without reading the body. Returns (status, offset of the first
+        # byte of the body in the resource, body length)
+        self.range_start = offset
+        try:
+            await self._send_params()
+            output = await self.modem.execute_at_command_async('doget')
+        finally:
+            self.range_start = 0
+        # +HTTPACTION: <method>,<status>,<length>
+        pieces = output.split(',')
+        status = int(pieces[1])
+        return status, offset if status == 206 else 0, int(pieces[2])
+
+    async def download(self, sink, offset=0, retries=3, buf=None):
+        # GETs the URL and streams its body from offset to sink(memoryview,
+        # offset) by AT+HTTPREAD ranges of len(buf) bytes; the buffer is
+        # reused for every range. After a failure, reading goes on from the
+        # last offset: from the modem buffer if the response is still there,
+        # else with a new GET asking the server for "Range: bytes=<offset>-".
+        # Returns the total size. A 416 answer to a ranged GET means there
+        # is nothing left to read: offset is returned as the total size.
+        if buf is None:
+            buf = bytearray(_DATA_CHUNK)
+        modem = self.modem
+        base = total = failed_at = None
+        attempt = 0
+        while True:
+            try:
+                if not self.opened:
+                    await self.open()
+                    base = None
+                if base is None:
+                    status, base, length = await self._get(offset)
+                    if status == 416 and offset:
+                        # Range starting at the end: the file was already
+                        # complete (resumed after the last byte)
+                        return offset
+                    if not 200 <= status < 300:
+                        raise Exception('HTTP status {} for "{}"'.format(status, self.url))
+                    total = base + length
+                while offset < total:
+                    n = await modem.http_read_async(offset - base, min(len(buf), total - offset), buf)
+                    if not n:
+                        raise Exception('Empty read at offset {}'.format(offset))
+                    sink(memoryview(buf)[:n], offset)
+                    offset += n
+                return total
+            except Exception as e:
+                attempt += 1
+                if attempt > retries:
+                    raise
+                logger.debug('Download interrupted at offset {} ({}), resuming'.format(offset, e))
+                # The modem buffer is tried once, a second failure at the
+                # same offset (or a failed GET) starts a new request
+                if base is None or failed_at == offset:
+                    self.opened = False
+                failed_at = offset
+
+    async def download_file(self, path, retries=3):
+        # Downloads the URL into path. A partial file left by an earlier
+        # failure is completed from its current size.
+        try:
+            offset = os.stat(path)[6]
+        except OSError:
+            offset = 0
+        with open(path, 'ab') as file:
+            return await self.download(lambda chunk, offset: file.write(chunk), offset, retries)
+
+    async def post_many(self, bodies):
+        # Back-to-back POSTs on the same context. Stops at the first non 2xx
+        # response; returns the responses received so far.
+        responses = []
+        for data in bodies:
+            response = await self.post(data)
+            responses.append(response)
+            if not 200 <= response.status_code < 300:
+                break
+        return responses
+
+
+class _RangeBuffer(object):
+    # Raw sink of a ranged AT+HTTPREAD: gathers the payload chunks into a
+    # caller provided buffer
+
+    def __init__(self, buf):
+        self.mv = memoryview(buf)
+        self.length = 0
+
+    def write(self, chunk):
+        n = min(len(chunk), len(self.mv) - self.length)
+        self.mv[self.length:self.length + n] = chunk[:n]
+        self.length += n
+
+
+class _Zeros(object):
+    # Endless source of zero bytes for write_data_async (throughput tests)
+
+    def readinto(self, buf):
+        for i in range(len(buf)):
+            buf[i] = 0
+        return len(buf)
+
+
+class _SocketLink(object):
+    # State of one AT+CIPMUX=1 connection, updated by the reader task from the
+    # "<n>, <status>" lines and the "+RECEIVE,<n>,<length>:" payloads.
+
+    def __init__(self, number):
+        self.number = number
+        self.status = None
+        self.connected = False
+        self.on_receive = None
+        self.event = asyncio.Event()
+
+    def reset(self, on_receive=None):
+        self.status = None
+        self.on_receive = on_receive
+        self.event.clear()
+
+    def receive(self, chunk):
+        # chunk is a view on the reader buffer, only valid during the call
+        if self.on_receive is not None:
+            self.on_receive(self.number, bytes(chunk))
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for_ms(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise SocketError('Timeout on link {} (timeout={}ms)'.format(self.number, timeout))
+        self.event.clear()
+        return self.status
+
+
+class _ATResponse(object):
+    # Accumulates the lines answered to one AT command until its terminator.
+    # One instance is reused by the modem: lines are matched as bytes and
+    # copied into a preallocated buffer, the output is only decoded once.
+
+    def __init__(self, size=_OUTPUT_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.length = 0
+        self.command = None
+        self.command_bytes = b''
+        self.end = None
+        self.end_exact = None
+        self.pre_end = True
+        self.family = None
+        self.text = False
+        self.error = None
+        self.raw_sink = None
+        self.raw_length = 0
+        self.received = False
+
+    def reset(self, command, command_bytes, end, end_exact, raw_sink=None):
+        if not isinstance(command_bytes, bytes):
+            command_bytes = b''  # Data (bytearray, memoryview): no echo to drop
+        self.command = command
+        self.command_bytes = command_bytes
+        self.end = end
+        self.end_exact = end_exact
+        self.pre_end = True
+        self.length = 0
+        self.text = False
+        self.error = None
+        # With a raw sink, the payload announced by "+HTTPREAD: <n>" is
+        # handed to it by the reader task instead of being split into lines
+        self.raw_sink = raw_sink
+        self.raw_length = 0
+        self.received = False
+
+        # "+XXX" lines answered to AT+XXX... belong to the response, even if
+        # the modem can also send them unsolicited (+CREG, +HTTPACTION...)
+        self.family = None
+        if command_bytes.startswith(b'AT+'):
+            n = 3
+            while n < len(command_bytes) and command_bytes[n] not in b'=?':
+                n += 1
+            self.family = command_bytes[2:n]
+
+    def owns(self, line):
+        return self.text or (self.family is not None and line.startswith(self.family))
+
+    def _append(self, line):
+        n = self.length + len(line)
+        if n > len(self.buf):
+            # Rare big response: grow the buffer, it is kept for next commands
+            buf = bytearray(max(n, 2 * len(self.buf)))
+            buf[:self.length] = self.mv[:self.length]
+            self.buf = buf
+            self.mv = memoryview(buf)
+        self.mv[self.length:n] = line
+        self.length = n
+
+    def feed(self, line):
+        # Returns True once the response is complete
+        if log.DEBUG:
+            logger.debug('Read "{}"'.format(line))
+        self.received = True
+
+        # SMS text after a +CMGR:/+CMGL: header: every line belongs to the
+        # response (never a URC, whatever it starts with), only an OK after
+        # an empty line ends it
+        if self.text:
+            if self.pre_end and line == self.end_exact:
+                return True
+            self.pre_end = line == b'\r\n'
+            self._append(line)
+            return False
+        if line.startswith(b'+CMGR:') or line.startswith(b'+CMGL:'):
+            self.text = True
+            self.pre_end = False
+            self._append(line)
+            return False
+
+        # Do we have an error?
+        if line == b'ERROR\r\n' or line.startswith(b'+CME ERROR') or line.startswith(b'+CMS ERROR'):
+            raise GenericATError('Got generic AT error')
+
+        # Drop the command echo
+        cmd = self.command_bytes
+        if line.startswith(cmd) and len(line) == len(cmd) + 3 and line.endswith(b'\r\r\n'):
+            return False
+
+        # No terminator: the first non empty line is the whole answer (AT+CIFSR)
+        if self.end is None:
+            if line == b'\r\n':
+                return False
+            self._append(line)
+            return True
+
+        # If we had a pre-end, do we have the expected end?
+        if line == self.end_exact:
+            return True
+        if self.pre_end and line.startswith(self.end):
+            # Detected startwith end (and adding this line to the output too)
+            self._append(line)
+            return True
+
+        # Do we have a pre-end?
+        self.pre_end = line == b'\r\n'
+
+        # Save this line unless in particular conditions
+        if line.startswith(b'+HTTPREAD:'):
+            if self.raw_sink is not None:
+                self.raw_length = int(line[10:])
+                return False
+            if self.command == 'getdata':
+                return False
+        self._append(line)
+        return False
+
+    def result(self, clean_output=True):
+        output = str(self.mv[:self.length], 'utf-8')
+
+        # ..and remove the last \r\n added by the AT protocol
+        if output.endswith('\r\n'):
+            output = output[:-2]
+
+        # Also, clean output if needed
+        if clean_output:
+            output = output.replace('\r', '')
+            output = output.replace('\n\n', '')
+            if output.startswith('\n'):
+                output = output[1:]
+            if output.endswith('\n'):
+                output = output[:-1]
+
+        if log.DEBUG:
+            logger.debug('Returning "{}"'.format(output))
+
+        # Return
+        return output
+
+
 class Modem(object):
 
-    def __init__(self, uart,  pin = None, rst_pin=None):
+    def __init__(self, uart,  pin = None, rst_pin=None, dtr_pin=None, ring_pin=None, baudrate=None):
 
         # Pins
         self.sim_pin = pin
@@ -50,9 +567,63 @@ class Modem(object):
         self.resetPin = Pin(rst_pin, Pin.OUT)
         self.resetPin.value(1)
 
-        # Uart
+        # Sleep mode (AT+CSCLK=1): DTR high lets the modem sleep, low wakes
+        # it up. RI goes low on incoming calls, SMS and URCs.
+        self.dtrPin = None
+        if dtr_pin is not None:
+            self.dtrPin = Pin(dtr_pin, Pin.OUT)
+            self.dtrPin.value(0)
+        self.ringPin = None
+        self._ring = asyncio.ThreadSafeFlag()
+        if ring_pin is not None:
+            self.ringPin = Pin(ring_pin, Pin.IN, Pin.PULL_UP)
+            self.ringPin.irq(trigger=Pin.IRQ_FALLING, handler=self._irq_ring)
+        self.on_ring = None  # Called by the sleep task after each RI pulse
+
+        # UART rate: the one uart was opened at if given, else known once
+        # detected (see detect_baudrate)
+        self.baudrate = baudrate
+        self.flow_pins = None
+
+        # Bring-up state (see initialize_async)
+        self.firmware = None
+        self.init_timings = {}
+        self._ready_urcs = []
+        self._ready_event = asyncio.Event()
+        self.sleep_enabled = False
+        self.sleeping = False
+        self._last_activity = utime.ticks_ms()
+        self._slept_at = 0
+        self._sleep_task = None
+        self.wakes = 0
+        self.wake_retries = 0
+        self.asleep_ms = 0
+
+        # Uart, also wrapped as asyncio streams for the async AT engine
         self.uart = uart
+        self.reader = asyncio.StreamReader(uart)
+        self.writer = asyncio.StreamWriter(uart, {})
+        self.lock = asyncio.Lock()
+        self._response = _ATResponse()
+
+        # URC demultiplexer: once the reader task runs, it owns the UART and
+        # hands lines either to the pending command or to the URC handlers
+        self.urc_handlers = {}
+        self._pending = None
+        self._done = asyncio.Event()
+        self._reader_task = None
+        self._line = bytearray(_LINE_SIZE)
+        self._line_len = 0
+        self._raw_left = 0
+        self._raw_sink = None
+        self.links = None
+        self.register_urc(b'UNDER-VOLTAGE', self._on_voltage_warning)
+        self.register_urc(b'OVER-VOLTAGE', self._on_voltage_warning)
+        self.register_urc(b'NORMAL POWER DOWN', self._on_power_down)
+        for urc in (b'RDY', b'Call Ready', b'SMS Ready', b'+CPIN: READY'):
+            self.register_urc(urc, self._on_ready_urc)
         self.ssl_available = None
+        self.sms_mode = None  # AT+CMGF value last set: 0 PDU, 1 text
 
         self.initialized = False
         self.modem_info = None
@@ -61,7 +632,9 @@ class Modem(object):
     #  Modem initializer
     # ----------------------
 
-    def initialize(self):
+    def initialize(self, detect_rate=False):
+        # detect_rate: look for the modem at the other UART rates if it does
+        # not answer at the current one (see detect_baudrate)
 
         logger.debug('Resetting modem...')
         self.resetPin.value(0)
@@ -75,6 +648,8 @@ class Modem(object):
         retries = 0
         while True:
             try:
+                if detect_rate:
+                    self.detect_baudrate()
                 self.modem_info = self.execute_at_command('modeminfo')
             except:
                 retries += 1
@@ -102,141 +677,564 @@ class Modem(object):
         self.ssl_available = False
 
     # ----------------------
-    # Execute AT commands
+    # UART rate and flow control
     # ----------------------
-    def execute_at_command(self, command, data=None, clean_output=True):
-        while self.uart.any():
-            self.uart.read()
-
-        # Commands dictionary. Not the best approach ever, but works nicely.
-        commands = {
-            'modeminfo': {'string': 'ATI', 'timeout': 3, 'end': 'OK'},
-            'fwrevision': {'string': 'AT+CGMR', 'timeout': 3, 'end': 'OK'},
-            'battery': {'string': 'AT+CBC', 'timeout': 3, 'end': 'OK'},
-            'scan': {'string': 'AT+COPS=?', 'timeout': 60, 'end': 'OK'},
-            'network': {'string': 'AT+COPS?', 'timeout': 3, 'end': 'OK'},
-            'signal': {'string': 'AT+CSQ', 'timeout': 3, 'end': 'OK'},
-            'checkreg': {'string': 'AT+CREG?', 'timeout': 3, 'end': None},
-            'setapn': {'string': 'AT+SAPBR=3,1,"APN","{}"'.format(data), 'timeout': 3, 'end': 'OK'},
-            'setuser': {'string': 'AT+SAPBR=3,1,"USER","{}"'.format(data), 'timeout': 3, 'end': 'OK'},
-            'setpwd': {'string': 'AT+SAPBR=3,1,"PWD","{}"'.format(data), 'timeout': 3, 'end': 'OK'},
-            'initgprs': {'string': 'AT+SAPBR=3,1,"Contype","GPRS"', 'timeout': 3, 'end': 'OK'},
-            'setpin' : {'string': 'AT+CPIN=\"{}\"'.format(data), 'timeout': 3, 'end': 'OK'},
-            'checksim': {'string': 'AT+CPIN?', 'timeout': 3, 'end': 'OK'},
-            'seterrorlog': {'string': 'AT+CMEE=1', 'timeout': 3, 'end': 'OK'},
-            'setsmstextmode': {'string': 'AT+CMGF=1', 'timeout': 3, 'end': 'OK'},
-            # Appeared on hologram net here or below
-
-            'opengprs': {'string': 'AT+SAPBR=1,1', 'timeout': 3, 'end': 'OK'},
-            'getbear': {'string': 'AT+SAPBR=2,1', 'timeout': 3, 'end': 'OK'},
-            'inithttp': {'string': 'AT+HTTPINIT', 'timeout': 3, 'end': 'OK'},
-            'sethttp': {'string': 'AT+HTTPPARA="CID",1', 'timeout': 3, 'end': 'OK'},
-            'checkssl': {'string': 'AT+CIPSSL=?', 'timeout': 3, 'end': 'OK'},
-            'enablessl': {'string': 'AT+HTTPSSL=1', 'timeout': 3, 'end': 'OK'},
-            'disablessl': {'string': 'AT+HTTPSSL=0', 'timeout': 3, 'end': 'OK'},
-            'initurl': {'string': 'AT+HTTPPARA="URL","{}"'.format(data), 'timeout': 3, 'end': 'OK'},
-            'doget': {'string': 'AT+HTTPACTION=0', 'timeout': 3, 'end': '+HTTPACTION'},
-            'setcontent': {'string': 'AT+HTTPPARA="CONTENT","{}"'.format(data), 'timeout': 3, 'end': 'OK'},
-            'postlen': {'string': 'AT+HTTPDATA={},5000'.format(data), 'timeout': 3, 'end': 'DOWNLOAD'},
-            # "data" is data_lenght in this context, while 5000 is the timeout
-            'dumpdata': {'string': data, 'timeout': 1, 'end': 'OK'},
-            'dopost': {'string': 'AT+HTTPACTION=1', 'timeout': 3, 'end': '+HTTPACTION'},
-            'getdata': {'string': 'AT+HTTPREAD', 'timeout': 3, 'end': 'OK'},
-            'closehttp': {'string': 'AT+HTTPTERM', 'timeout': 3, 'end': 'OK'},
-            'closebear': {'string': 'AT+SAPBR=0,1', 'timeout': 3, 'end': 'OK'}
-        }
-
-        # References:
-        # https://github.com/olablt/micropython-sim800/blob/4d181f0c5d678143801d191fdd8a60996211ef03/app_sim.py
-        # https://arduino.stackexchange.com/questions/23878/what-is-the-proper-way-to-send-data-through-http-using-sim908
-        # https://stackoverflow.com/questions/35781962/post-api-rest-with-at-commands-sim800
-        # https://arduino.stackexchange.com/questions/34901/http-post-request-in-json-format-using-sim900-module (full post example)
+    # The modem autobauds on "AT" by default (AT+IPR=0) or uses the rate set
+    # by AT+IPR. detect_baudrate() serves the blocking initialize(), the rest
+    # runs on the async engine.
 
-        # Sanity checks
-        if command not in commands:
-            raise Exception('Unknown command "{}"'.format(command))
+    def _probe(self, tries=3):
+        for _ in range(tries):
+            try:
+                self.execute_at_command('probe')
+                return True
+            except Exception:
+                pass
+        return False
 
-        # Support vars
-        command_string = commands[command]['string']
-        excpected_end = commands[command]['end']
-        timeout = commands[command]['timeout']
-        processed_lines = 0
+    async def _probe_async(self, tries=3):
+        for _ in range(tries):
+            try:
+                await self.execute_at_command_async('probe')
+                return True
+            except Exception:
+                pass
+        return False
 
-        # Execute the AT command
-        command_string_for_at = "{}\r\n".format(command_string)
-        logger.debug('Writing AT command "{}"'.format(command_string_for_at.encode('utf-8')))
-        self.uart.write(command_string_for_at)
+    def _init_uart(self, rate):
+        if self.flow_pins is None:
+            self.uart.init(baudrate=rate)
+        else:
+            self.uart.init(baudrate=rate, rts=self.flow_pins[0], cts=self.flow_pins[1],
+                           flow=UART.RTS | UART.CTS)
+        self.baudrate = rate
+
+    def detect_baudrate(self, rates=_BAUDRATES):
+        # Finds the rate the modem answers at, tried first at the current one
+        if self.baudrate is not None and self._probe():
+            return self.baudrate
+        for rate in rates:
+            self._init_uart(rate)
+            utime.sleep_ms(_BAUD_SWITCH_MS)
+            if self._probe():
+                logger.debug('Modem found at {} baud'.format(rate))
+                return rate
+        raise Exception('Modem not answering at any UART rate')
+
+    async def detect_baudrate_async(self, rates=_BAUDRATES):
+        if self.baudrate is not None and await self._probe_async():
+            return self.baudrate
+        for rate in rates:
+            self._init_uart(rate)
+            await asyncio.sleep_ms(_BAUD_SWITCH_MS)
+            if await self._probe_async():
+                logger.debug('Modem found at {} baud'.format(rate))
+                return rate
+        raise Exception('Modem not answering at any UART rate')
+
+    async def _check_link_async(self, checks):
+        # checks identical ATI answers in a row: any garbled byte fails
+        for _ in range(checks):
+            try:
+                if await self.execute_at_command_async('modeminfo') != self.modem_info:
+                    return False
+            except Exception:
+                return False
+        return True
+
+    async def set_baudrate_async(self, rate, checks=10):
+        # Moves the modem and the UART to rate. The new rate is kept only if
+        # the link is reliable; otherwise both go back to the previous rate.
+        # Returns True when rate is in use.
+        if self.baudrate is None:
+            await self.detect_baudrate_async()
+        previous = self.baudrate
+        await self.execute_at_command_async('setbaudrate', rate)
+        self._init_uart(rate)
+        await asyncio.sleep_ms(_BAUD_SWITCH_MS)
+        if await self._check_link_async(checks):
+            logger.debug('UART rate raised to {} baud'.format(rate))
+            return True
 
-        # Support vars
-        pre_end = True
-        output = ''
-        empty_reads = 0
+        logger.warning('UART unreliable at {} baud, back to {}'.format(rate, previous))
+        try:
+            await self.execute_at_command_async('setbaudrate', previous)
+        except Exception:
+            pass
+        self._init_uart(previous)
+        await asyncio.sleep_ms(_BAUD_SWITCH_MS)
+        await self.detect_baudrate_async()
+        return False
 
-        while True:
+    async def enable_flow_control_async(self, rts, cts):
+        # RTS/CTS on both sides (AT+IFC=2,2): the modem stops sending when
+        # our RX buffer is full instead of overflowing it
+        await self.execute_at_command_async('setflowcontrol')
+        self.flow_pins = (rts, cts)
+        self._init_uart(self.baudrate)
+        await asyncio.sleep_ms(_BAUD_SWITCH_MS)
+
+    async def measure_throughput_async(self, size=2048):
+        # Returns (bytes/s sent, bytes/s received) at the current rate: a
+        # size byte body streamed after AT+HTTPDATA (no network needed) and
+        # the AT+CLAC command list read back.
+        try:
+            await self.execute_at_command_async('closehttp')
+        except GenericATError:
+            pass
+        await self.execute_at_command_async('inithttp')
+        try:
+            await self.execute_at_command_async('poststream', (size, _http_data_ms(size)))
+            t0 = utime.ticks_ms()
+            await self.write_data_async(_Zeros(), size)
+            tx_ms = utime.ticks_diff(utime.ticks_ms(), t0)
+        finally:
+            await self.execute_at_command_async('closehttp')
+
+        t0 = utime.ticks_ms()
+        await self.execute_at_command_async('listcommands')
+        rx_ms = utime.ticks_diff(utime.ticks_ms(), t0)
+        received = self._response.length
+        return size * 1000 // max(tx_ms, 1), received * 1000 // max(rx_ms, 1)
 
-            line = self.uart.readline()
-            if not line:
-                time.sleep(1)
-                empty_reads += 1
-                if empty_reads > timeout:
-                    raise Exception('Timeout for command "{}" (timeout={})'.format(command, timeout))
-                    # logger.warning('Timeout for command "{}" (timeout={})'.format(command, timeout))
-                    # break
-            else:
-                logger.debug('Read "{}"'.format(line))
+    # ----------------------
+    # Fast bring-up
+    # ----------------------
 
-                # Convert line to string
-                line_str = line.decode('utf-8')
+    def _on_ready_urc(self, line):
+        # RDY, Call Ready, SMS Ready, +CPIN: READY. RDY means the modem has
+        # (re)started: what was cached about it is stale (RDY is kept in
+        # _ready_urcs until the next bring-up, which then drops the cache).
+        if line.startswith(b'RDY'):
+            self._ready_urcs.clear()
+            self.sms_mode = None
+        self._ready_urcs.append(line.rstrip())
+        self._ready_event.set()
+
+    async def _wait_ready_urc(self, urc, timeout):
+        try:
+            await asyncio.wait_for_ms(self._ready_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready_event.clear()
+        return urc in self._ready_urcs
 
-                # Do we have an error?
-                if line_str == 'ERROR\r\n':
-                    raise GenericATError('Got generic AT error')
+    def _phase(self, name, t0):
+        now = utime.ticks_ms()
+        self.init_timings[name] = utime.ticks_diff(now, t0)
+        return now
 
-                # If we had a pre-end, do we have the expected end?
-                if line_str == '{}\r\n'.format(excpected_end):
-                    logger.debug('Detected exact end')
+    def _hard_reset(self):
+        self.resetPin.value(0)
+        utime.sleep_ms(100)
+        self.resetPin.value(1)
+        self._ready_urcs.clear()
+
+    async def initialize_async(self, cache=None, boot_timeout=10000, ready_timeout=20000):
+        # Brings the modem up without fixed sleeps:
+        #  - probe: a modem already answering (ESP32 reboot) is not reset; the
+        #    cache is dropped if it does not answer or has sent RDY since
+        #  - reset: hard reset, then RDY or the first answer to AT, whichever
+        #    comes first; other UART rates are tried if nothing answers
+        #  - info/config/sim: ATI, AT+CGMR, AT+CMEE=1 and the PIN are skipped
+        #    when cache (dict from a previous bring-up, updated here) shows
+        #    they are still valid
+        #  - ready: "Call Ready" and "SMS Ready", or AT+CCALR? if missed
+        # The time spent in each phase (ms) is left in self.init_timings.
+        if cache is None:
+            cache = {}
+        self.init_timings = {}
+        start = t0 = utime.ticks_ms()
+        if cache.get('baudrate') and cache['baudrate'] != self.baudrate:
+            self._init_uart(cache['baudrate'])
+
+        was_up = await self._probe_async(2)
+        if b'RDY' in self._ready_urcs:  # Restarted on its own: AT+CMEE=1 is lost
+            cache.clear()
+        t0 = self._phase('probe', t0)
+        if not was_up:
+            logger.debug('Modem not answering, resetting...')
+            self._hard_reset()
+            deadline = utime.ticks_add(utime.ticks_ms(), boot_timeout)
+            while utime.ticks_diff(deadline, utime.ticks_ms()) > 0:
+                await self._wait_ready_urc(b'RDY', 500)
+                if await self._probe_async(1):
                     break
-                if pre_end and line_str.startswith('{}'.format(excpected_end)):
-                    logger.debug('Detected startwith end (and adding this line to the output too)')
-                    output += line_str
+            else:
+                await self.detect_baudrate_async()
+            t0 = self._phase('reset', t0)
+            cache.clear()
+        cache['baudrate'] = self.baudrate
+
+        if 'info' in cache and 'firmware' in cache:
+            self.modem_info = cache['info']
+            self.firmware = cache['firmware']
+        else:
+            self.modem_info = cache['info'] = await self.execute_at_command_async('modeminfo')
+            self.firmware = cache['firmware'] = await self.execute_at_command_async('firmware')
+        if not cache.get('configured'):
+            await self.execute_at_command_async('seterrorlog')
+            cache['configured'] = True
+        t0 = self._phase('info', t0)
+
+        if cache.get('sim') != 'READY':
+            sim = await self.execute_at_command_async('checksim')
+            if sim == '+CPIN: SIM PIN' and self.sim_pin is not None:
+                logger.debug("Unlocking pin with pin {}".format(self.sim_pin))
+                await self.execute_at_command_async('setpin', self.sim_pin)
+                sim = await self.execute_at_command_async('checksim')
+            cache['sim'] = sim[7:] if sim.startswith('+CPIN: ') else sim
+            if cache['sim'] != 'READY':
+                raise Exception('SIM not ready ({})'.format(sim))
+        t0 = self._phase('sim', t0)
+
+        if not was_up:
+            deadline = utime.ticks_add(utime.ticks_ms(), ready_timeout)
+            while b'Call Ready' not in self._ready_urcs or b'SMS Ready' not in self._ready_urcs:
+                if utime.ticks_diff(deadline, utime.ticks_ms()) <= 0:
+                    raise Exception('Modem not ready after {} ms'.format(ready_timeout))
+                if not await self._wait_ready_urc(b'SMS Ready', 1000) \
+                        and await self.execute_at_command_async('callready') == '+CCALR: 1':
                     break
+            self._phase('ready', t0)
+        self._ready_urcs.clear()
+        self.init_timings['total'] = utime.ticks_diff(utime.ticks_ms(), start)
 
-                # Do we have a pre-end?
-                if line_str == '\r\n':
-                    pre_end = True
-                    logger.debug('Detected pre-end')
-                else:
-                    pre_end = False
+        self.initialized = True
+        self.ssl_available = False
+        logger.debug('Modem "{}" ready in {} ms {}'.format(self.modem_info, self.init_timings['total'],
+                                                             self.init_timings))
+        return cache
 
-                # Keep track of processed lines and stop if exceeded
-                processed_lines += 1
+    # ----------------------
+    # Unsolicited result codes
+    # ----------------------
 
-                # Save this line unless in particular conditions
-                if command == 'getdata' and line_str.startswith('+HTTPREAD:'):
-                    pass
-                else:
-                    output += line_str
+    def register_urc(self, prefix, handler):
+        # handler(line) is called with the raw line (bytes) of each URC
+        # starting with prefix. Handlers run in the reader task: keep them short.
+        self.urc_handlers[prefix] = handler
+
+    def unregister_urc(self, prefix):
+        self.urc_handlers.pop(prefix, None)
+
+    def _is_urc(self, line):
+        for prefix in _URC_PREFIXES:
+            if line.startswith(prefix):
+                return True
+        # Prefixes registered at run time (socket link status lines)
+        for prefix in self.urc_handlers:
+            if line.startswith(prefix):
+                return True
+        return False
 
-        # Remove the command string from the output
-        output = output.replace(command_string + '\r\r\n', '')
+    def _dispatch_urc(self, line):
+        for prefix in self.urc_handlers:
+            if line.startswith(prefix):
+                try:
+                    self.urc_handlers[prefix](line)
+                except Exception as e:
+                    logger.warning('URC handler for {} failed: {}'.format(prefix, e))
+                return
+        if log.DEBUG:
+            logger.debug('Unhandled URC "{}"'.format(line))
+
+    def _on_voltage_warning(self, line):
+        logger.warning(line.decode().strip())
+
+    def _on_power_down(self, line):
+        logger.warning('Modem powered down')
+        self.initialized = False
 
-        # ..and remove the last \r\n added by the AT protocol
-        if output.endswith('\r\n'):
-            output = output[:-2]
+    def _drain_urcs(self):
+        # Leftover lines before a blocking command: URCs are dispatched, the
+        # rest (late answers to a timed out command) is dropped
+        while self.uart.any():
+            line = self.uart.readline()
+            if line and self._is_urc(line):
+                self._dispatch_urc(line)
 
-        # Also, clean output if needed
-        if clean_output:
-            output = output.replace('\r', '')
-            output = output.replace('\n\n', '')
-            if output.startswith('\n'):
-                output = output[1:]
-            if output.endswith('\n'):
-                output = output[:-1]
+    # ----------------------
+    # Sleep mode
+    # ----------------------
 
-        logger.debug('Returning "{}"'.format(output.encode('utf8')))
+    def _irq_ring(self, pin):
+        self._ring.set()
+
+    def _set_asleep(self):
+        self.dtrPin.value(1)
+        self.sleeping = True
+        self._slept_at = utime.ticks_ms()
+
+    def _set_awake(self):
+        self.dtrPin.value(0)
+        self.sleeping = False
+        self.wakes += 1
+        self.asleep_ms += utime.ticks_diff(utime.ticks_ms(), self._slept_at)
+
+    async def _wake(self):
+        # Every command goes through here: a sleeping modem is woken up first
+        self._last_activity = utime.ticks_ms()
+        if self.sleeping:
+            self._set_awake()
+            await asyncio.sleep_ms(_WAKE_MS)
+
+    async def enable_sleep_async(self):
+        # AT+CSCLK=1: the modem sleeps while DTR is high. It is put to sleep
+        # after _IDLE_MS without command or modem output, and woken up by
+        # the next command or by RI.
+        if self.dtrPin is None:
+            raise Exception('Sleep mode needs the DTR pin')
+        await self.execute_at_command_async('setslowclock', 1)
+        self.sleep_enabled = True
+        if self._sleep_task is None:
+            self._sleep_task = asyncio.create_task(self._run_sleep())
+
+    async def disable_sleep_async(self):
+        self.sleep_enabled = False
+        await self.execute_at_command_async('setslowclock', 0)
+
+    async def _run_sleep(self):
+        while self.sleep_enabled:
+            try:
+                await asyncio.wait_for_ms(self._ring.wait(), _IDLE_MS)
+                # RI pulse: stay awake to receive the URC or data that follows
+                if self.sleeping:
+                    self._set_awake()
+                self._last_activity = utime.ticks_ms()
+                if self.on_ring is not None:
+                    self.on_ring()
+            except asyncio.TimeoutError:
+                pass
+            if not self.sleeping and not self.lock.locked() and self._pending is None \
+                    and utime.ticks_diff(utime.ticks_ms(), self._last_activity) >= _IDLE_MS:
+                self._set_asleep()
+        if self.sleeping:
+            self._set_awake()
+        self._sleep_task = None
+
+    def sleep_stats(self):
+        # (wake ups, wake ups retried after a missed command, ms asleep)
+        asleep_ms = self.asleep_ms
+        if self.sleeping:
+            asleep_ms += utime.ticks_diff(utime.ticks_ms(), self._slept_at)
+        return self.wakes, self.wake_retries, asleep_ms
 
-        # Return
-        return output
+    # ----------------------
+    # Execute AT commands
+    # ----------------------
+
+    def _get_command(self, command, data=None):
+        # Sanity checks
+        try:
+            template, timeout, end, end_exact = _COMMANDS[command]
+        except KeyError:
+            raise Exception('Unknown command "{}"'.format(command))
+
+        # Only commands with a parameter are formatted (and allocate)
+        if template is None:
+            # Data sent as is: a str is encoded, any buffer (bytes,
+            # bytearray, memoryview) is written unchanged
+            command_bytes = data.encode() if isinstance(data, str) else data
+        elif isinstance(template, str):
+            if isinstance(data, tuple):
+                command_bytes = template.format(*data).encode()
+            else:
+                command_bytes = template.format(data).encode()
+        else:
+            command_bytes = template
+        return command_bytes, end, end_exact, timeout
+
+    def execute_at_command(self, command, data=None, clean_output=True):
+        # Blocking version, kept for compatibility: polls the UART every few
+        # milliseconds until the response terminator or the timeout.
+        if self._reader_task is not None:
+            raise Exception('The reader task owns the UART, use execute_at_command_async')
+        if self.sleeping:
+            self._set_awake()
+            utime.sleep_ms(_WAKE_MS)
+        self._drain_urcs()
+
+        command_bytes, end, end_exact, timeout = self._get_command(command, data)
+        response = self._response
+        response.reset(command, command_bytes, end, end_exact)
+
+        # Execute the AT command
+        if log.DEBUG:
+            logger.debug('Writing AT command "{}"'.format(command_bytes))
+        self.uart.write(command_bytes)
+        self.uart.write(b'\r\n')
+
+        deadline = utime.ticks_add(utime.ticks_ms(), timeout)
+        while True:
+            line = self.uart.readline()
+            if not line:
+                if utime.ticks_diff(deadline, utime.ticks_ms()) <= 0:
+                    raise Exception('Timeout for command "{}" (timeout={}ms)'.format(command, timeout))
+                utime.sleep_ms(_POLL_MS)
+            elif self._is_urc(line) and not response.owns(line):
+                self._dispatch_urc(line)
+            elif response.feed(line):
+                break
+
+        return response.result(clean_output)
+
+    def start_reader(self):
+        # Starts the reader task (done automatically by the first async command)
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self.run())
+
+    def expect_raw(self, count, sink):
+        # Called from a URC handler: the next count bytes on the UART are a
+        # binary payload, handed to sink(memoryview) in one or more chunks
+        # instead of being split into lines.
+        self._raw_left = count
+        self._raw_sink = sink
+
+    def _handle_line(self, line):
+        self._last_activity = utime.ticks_ms()
+        response = self._pending
+        if response is None or (self._is_urc(line) and not response.owns(line)):
+            if line != b'\r\n':
+                self._dispatch_urc(line)
+            return
+        try:
+            done = response.feed(line)
+        except GenericATError as e:
+            response.error = e
+            done = True
+        if response.raw_length:
+            self.expect_raw(response.raw_length, response.raw_sink)
+            response.raw_length = 0
+        if done:
+            self._pending = None
+            self._done.set()
+
+    async def run(self):
+        # Reader task: the only consumer of the modem UART once started.
+        # The UART is read by chunks into a fixed buffer and split into lines
+        # here, so that binary payloads (expect_raw) and the CIPSEND prompt,
+        # which has no line ending, can be handled as well.
+        buf = bytearray(_RX_CHUNK)
+        mv = memoryview(buf)
+        line = self._line
+        while True:
+            n = await self.reader.readinto(buf)
+            if not n:
+                continue
+            i = 0
+            while i < n:
+                if self._raw_left:
+                    k = min(self._raw_left, n - i)
+                    self._raw_left -= k
+                    try:
+                        self._raw_sink(mv[i:i + k])
+                    except Exception as e:
+                        logger.warning('Raw payload sink failed: {}'.format(e))
+                    i += k
+                    continue
+                b = buf[i]
+                i += 1
+                line[self._line_len] = b
+                self._line_len += 1
+                if b == 0x0A or self._line_len == _LINE_SIZE:
+                    data = bytes(line[:self._line_len])
+                    self._line_len = 0
+                    self._handle_line(data)
+
+            # Prompt waiting for data ("> "), never followed by CR LF
+            response = self._pending
+            if self._line_len and response is not None and response.end == b'>' and line[0] == 0x3E:
+                data = bytes(line[:self._line_len])
+                self._line_len = 0
+                self._handle_line(data)
+
+    async def _execute(self, command, data=None, clean_output=True, raw_sink=None):
+        # Sends a command and waits for its response. The caller holds the lock.
+        command_bytes, end, end_exact, timeout = self._get_command(command, data)
+        response = self._response
+        for attempt in range(2):
+            await self._wake()
+            response.reset(command, command_bytes, end, end_exact, raw_sink)
+            self._done.clear()
+            self._pending = response
+
+            if log.DEBUG:
+                logger.debug('Writing AT command "{}"'.format(command_bytes))
+            self.writer.write(command_bytes)
+            self.writer.write(b'\r\n')
+            await self.writer.drain()
+            try:
+                return await self._wait_response(command, timeout, clean_output)
+            except GenericATError:
+                raise
+            except Exception:
+                # Not even an echo: the modem did not wake up in time and
+                # missed the command, which is safe to send again
+                if attempt or not self.sleep_enabled or response.received:
+                    raise
+                logger.debug('No answer to "{}", waking the modem up again'.format(command))
+                self.wake_retries += 1
+                self._set_asleep()
+
+    async def _wait_response(self, command, timeout, clean_output=True):
+        response = self._response
+        try:
+            await asyncio.wait_for_ms(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise Exception('Timeout for command "{}" (timeout={}ms)'.format(command, timeout))
+        finally:
+            self._pending = None
+
+        if response.error is not None:
+            raise response.error
+        return response.result(clean_output)
+
+    async def execute_at_command_async(self, command, data=None, clean_output=True):
+        # Non-blocking version: the command is written, then the reader task
+        # wakes us up when the response terminator arrives.
+        self.start_reader()
+        async with self.lock:
+            return await self._execute(command, data, clean_output)
+
+    async def http_read_async(self, start, size, buf):
+        # AT+HTTPREAD=<start>,<size> on the current HTTP response: the payload
+        # is copied into buf (size bytes at least) by the reader task without
+        # going through the line splitter. Returns the number of bytes
+        # received, less than size at the end of the body.
+        self.start_reader()
+        target = _RangeBuffer(buf)
+        async with self.lock:
+            await self._execute('readrange', (start, size), raw_sink=target.write)
+        return target.length
+
+    async def write_data_async(self, source, length, buf=None):
+        # Streams length bytes of source (object with readinto, a file) after
+        # a DOWNLOAD prompt through a fixed buffer, then waits for OK, so the
+        # body never has to be in RAM as a whole.
+        self.start_reader()
+        if buf is None:
+            buf = bytearray(_DATA_CHUNK)
+        mv = memoryview(buf)
+        _, timeout, end, end_exact = _COMMANDS['dumpdata']
+        async with self.lock:
+            await self._wake()
+            response = self._response
+            response.reset('dumpdata', b'', end, end_exact)
+            self._done.clear()
+            self._pending = response
+
+            left = length
+            while left:
+                n = source.readinto(buf)
+                if not n:
+                    self._pending = None
+                    raise Exception('Data source ended {} bytes early'.format(left))
+                n = min(n, left)
+                self.writer.write(mv[:n])
+                await self.writer.drain()
+                left -= n
+            return await self._wait_response('dumpdata', timeout)
 
     # ----------------------
     #  Function commands
@@ -293,8 +1291,47 @@ class Modem(object):
         signal_ratio = float(signal) / float(30)  # 30 is the maximum value (2 is the minimum)
         return signal_ratio
 
+    async def get_signal_quality_async(self):
+        # (rssi, ber) as answered by AT+CSQ: rssi 0-31 (-115 to -52 dBm),
+        # 99 when unknown or not detectable
+        output = await self.execute_at_command_async('signal')
+        return self._parse_csq(output)
+
+    @staticmethod
+    def _parse_csq(output):
+        # "+CSQ: <rssi>,<ber>"
+        pieces = output.split(':')[-1].split(',')
+        return int(pieces[0]), int(pieces[1])
+
+    def get_registration(self):
+        output = self.execute_at_command('checkreg')
+        return self._parse_creg(output)[1]
+
+    async def get_registration_async(self):
+        # (n, stat) answered by AT+CREG?: n is the URC mode set by AT+CREG=<n>
+        output = await self.execute_at_command_async('checkreg')
+        return self._parse_creg(output)
+
+    @staticmethod
+    def _parse_creg(output):
+        # "+CREG: <n>,<stat>[,<lac>,<ci>]"
+        pieces = output.split(':')[-1].split(',')
+        return int(pieces[0]), int(pieces[1])
+
+    @staticmethod
+    def is_registered(stat):
+        return stat == REG_HOME or stat == REG_ROAMING
+
     def get_ip_addr(self):
         output = self.execute_at_command('getbear')
+        return self._parse_ip_addr(output)
+
+    async def get_ip_addr_async(self):
+        output = await self.execute_at_command_async('getbear')
+        return self._parse_ip_addr(output)
+
+    @staticmethod
+    def _parse_ip_addr(output):
         output = output.split('+')[-1]  # Remove potential leftovers in the buffer before the "+SAPBR:" response
         pieces = output.split(',')
         if len(pieces) != 3:
@@ -337,19 +1374,129 @@ class Modem(object):
         self.execute_at_command('opengprs')
 
         # Ok, now wait until we get a valid IP address
-        retries = 0
-        max_retries = 5
-        while True:
-            retries += 1
-            ip_addr = self.get_ip_addr()
-            if not ip_addr:
-                retries += 1
-                if retries > max_retries:
-                    raise Exception('Cannot connect modem as could not get a valid IP address')
-                logger.debug('No valid IP address yet, retrying... (#')
-                time.sleep(1)
-            else:
-                break
+        for retries in range(5):
+            if self.get_ip_addr():
+                return
+            logger.debug('No valid IP address yet, retrying... (#{})'.format(retries + 1))
+            time.sleep(1)
+        raise Exception('Cannot connect modem as could not get a valid IP address')
+
+    async def connect_async(self, apn, user='', pwd=''):
+        if not self.initialized:
+            raise Exception('Modem is not initialized, cannot connect')
+
+        # Are we already connected?
+        if await self.get_ip_addr_async():
+            logger.debug('Modem is already connected, not reconnecting.')
+            return
+
+        # Closing bearer if left opened from a previous connect gone wrong:
+        try:
+            await self.execute_at_command_async('closebear')
+        except GenericATError:
+            pass
+
+        await self.execute_at_command_async('initgprs')
+        await self.execute_at_command_async('setapn', apn)
+        await self.execute_at_command_async('setuser', user)
+        await self.execute_at_command_async('setpwd', pwd)
+        await self.execute_at_command_async('opengprs')
+
+        # Ok, now wait until we get a valid IP address
+        for retries in range(5):
+            if await self.get_ip_addr_async():
+                return
+            logger.debug('No valid IP address yet, retrying... (#{})'.format(retries + 1))
+            await asyncio.sleep(1)
+        raise Exception('Cannot connect modem as could not get a valid IP address')
+
+    # ----------------------
+    #  Sockets (TCP/UDP)
+    # ----------------------
+    # Raw connections through the modem TCP/IP stack (AT+CIPMUX=1): no HTTP
+    # headers on the air, and a TCP link stays open between uploads. Incoming
+    # data is delivered to on_receive(link, data), possibly in several chunks.
+
+    async def socket_init(self, apn, user='', pwd='', keepalive=None):
+        # keepalive: (idle s, interval s, probes) for AT+CIPTKA, or None
+        if not self.initialized:
+            raise Exception('Modem is not initialized, cannot open sockets')
+        await self.execute_at_command_async('cipshut')
+        await self.execute_at_command_async('setmux', 1)
+        await self.execute_at_command_async('setcstt', (apn, user, pwd))
+        await self.execute_at_command_async('ciicr')
+        ip = await self.execute_at_command_async('cifsr')
+        if keepalive is not None:
+            await self.execute_at_command_async('setkeepalive', keepalive)
+
+        if self.links is None:
+            self.links = [_SocketLink(i) for i in range(_LINKS)]
+            for i in range(_LINKS):
+                self.register_urc(b'%d, ' % i, self._on_link_status)
+            self.register_urc(b'+RECEIVE,', self._on_receive)
+        for link in self.links:
+            link.connected = False
+        logger.debug('TCP/IP stack up, IP address "{}"'.format(ip))
+        return ip
+
+    def _on_link_status(self, line):
+        # b'0, CONNECT OK\r\n', b'0, SEND OK\r\n', b'0, CLOSED\r\n'...
+        link = self.links[line[0] - 0x30]
+        link.status = line[3:].rstrip()
+        if link.status in (b'CONNECT OK', b'ALREADY CONNECT'):
+            link.connected = True
+        elif link.status in (b'CLOSED', b'CLOSE OK', b'CONNECT FAIL'):
+            link.connected = False
+        link.event.set()
+
+    def _on_receive(self, line):
+        # b'+RECEIVE,0,12:\r\n' followed by 12 bytes of payload
+        number, length = line[9:].rstrip()[:-1].split(b',')
+        self.expect_raw(int(length), self.links[int(number)].receive)
+
+    def _get_link(self, number):
+        if self.links is None:
+            raise SocketError('Sockets not initialized, call socket_init() first')
+        return self.links[number]
+
+    async def socket_open(self, number, host, port, proto='TCP', on_receive=None, timeout=75000):
+        link = self._get_link(number)
+        link.reset(on_receive)
+        await self.execute_at_command_async('cipstart', (number, proto, host, port))
+        status = await link.wait(timeout)
+        if not link.connected:
+            raise SocketError('Cannot open link {} to {}:{} ({})'.format(number, host, port, status))
+
+    async def socket_send(self, number, data, wait=True, timeout=30000):
+        # The length is given to AT+CIPSEND, so data can be any binary payload.
+        # With wait=False (UDP telemetry), returns once the data is written
+        # without waiting for "SEND OK".
+        link = self._get_link(number)
+        if not link.connected:
+            raise SocketError('Link {} is not connected'.format(number))
+        async with self.lock:
+            link.event.clear()
+            await self._execute('cipsend', (number, len(data)))
+            self.writer.write(data)
+            await self.writer.drain()
+            if not wait:
+                return
+            status = await link.wait(timeout)
+        if status != b'SEND OK':
+            raise SocketError('Send failed on link {} ({})'.format(number, status))
+
+    async def socket_close(self, number, timeout=10000):
+        # AT+CIPCLOSE only answers with "<n>, CLOSE OK": no pending response
+        link = self._get_link(number)
+        if not link.connected:
+            return
+        async with self.lock:
+            await self._wake()
+            link.event.clear()
+            self.writer.write(b'AT+CIPCLOSE=%d\r\n' % number)
+            await self.writer.drain()
+            await link.wait(timeout)
+        link.connected = False
 
     def disconnect(self):
 
@@ -441,6 +1588,134 @@ class Modem(object):
 
         return Response(status_code=response_status_code, content=response_content)
 
+    async def http_request_async(self, url, mode='GET', data=None, content_type='application/json'):
+        # Same steps as http_request(), without blocking the event loop
+
+        # Protocol check.
+        assert url.startswith('http'), 'Unable to handle communication protocol for URL "{}"'.format(url)
+
+        # Are we  connected?
+        if not await self.get_ip_addr_async():
+            raise Exception('Error, modem is not connected')
+
+        # Close the http context if left open somehow
+        try:
+            await self.execute_at_command_async('closehttp')
+        except GenericATError:
+            pass
+
+        await self.execute_at_command_async('inithttp')
+        await self.execute_at_command_async('sethttp')
+
+        # Do we have to enable ssl as well?
+        if self.ssl_available:
+            if url.startswith('https://'):
+                await self.execute_at_command_async('enablessl')
+            elif url.startswith('http://'):
+                await self.execute_at_command_async('disablessl')
+        else:
+            if url.startswith('https://'):
+                raise NotImplementedError("SSL is only supported by firmware revisions >= R14.00")
+
+        await self.execute_at_command_async('initurl', data=url)
+
+        if mode == 'GET':
+            output = await self.execute_at_command_async('doget')
+        elif mode == 'POST':
+            await self.execute_at_command_async('setcontent', content_type)
+            await self.execute_at_command_async('postlen', len(data))
+            await self.execute_at_command_async('dumpdata', data)
+            output = await self.execute_at_command_async('dopost')
+        else:
+            raise Exception('Unknown mode "{}'.format(mode))
+        response_status_code = output.split(',')[1]
+        logger.debug('Response status code: "{}"'.format(response_status_code))
+
+        response_content = await self.execute_at_command_async('getdata', clean_output=False)
+
+        await self.execute_at_command_async('closehttp')
+
+        return Response(status_code=response_status_code, content=response_content)
+
+    # ----------------------
+    #  SMS
+    # ----------------------
+
+    async def send_sms_async(self, number, text, timeout=60000):
+        # Text mode, GSM 7 bit characters only, up to 160 of them. Returns
+        # the message reference answered by +CMGS once the network has
+        # accepted the message; an ERROR or +CMS ERROR raises GenericATError.
+        return await self._send_sms(1, '"{}"'.format(number), text.encode(), timeout)
+
+    async def send_sms_pdu_async(self, pdu, tpdu_length, timeout=60000):
+        # PDU mode: pdu is the hex encoded SMSC address and SMS-SUBMIT TPDU,
+        # tpdu_length the TPDU length in bytes (without the SMSC part)
+        return await self._send_sms(0, tpdu_length, pdu, timeout)
+
+    async def _send_sms(self, mode, target, body, timeout):
+        self.start_reader()
+        async with self.lock:
+            if self.sms_mode != mode:
+                await self._execute('setsmsmode', mode)
+                self.sms_mode = mode
+            await self._execute('smsprompt', target)
+
+            # The body is ended by Ctrl-Z. The modem echoes it, then answers
+            # "+CMGS: <mr>" and OK when the message is sent.
+            _, _, end, end_exact = _COMMANDS['smsbody']
+            response = self._response
+            response.reset('smsbody', b'', end, end_exact)
+            self._done.clear()
+            self._pending = response
+            self.writer.write(body)
+            self.writer.write(b'\x1a')
+            await self.writer.drain()
+            try:
+                output = await self._wait_response('smsbody', timeout)
+            except GenericATError:
+                raise
+            except Exception:
+                # Leave the prompt if the modem is still waiting for data
+                self.writer.write(b'\x1b')
+                await self.writer.drain()
+                raise
+        reference = output.split('+CMGS:')
+        if len(reference) < 2:
+            raise GenericATError('No +CMGS in "{}"'.format(output))
+        return int(reference[1].split()[0])
+
+    async def _execute_sms_text(self, command, data=None):
+        # Reading commands are used in text mode
+        self.start_reader()
+        async with self.lock:
+            if self.sms_mode != 1:
+                await self._execute('setsmsmode', 1)
+                self.sms_mode = 1
+            return await self._execute(command, data)
+
+    async def read_sms_async(self, index):
+        # Message stored at index, as (status, sender, text), or None if the
+        # slot is empty. Reading marks it as read; delete it once processed.
+        output = await self._execute_sms_text('readsms', index)
+        if not output.startswith('+CMGR:'):
+            return None
+        header, _, text = output.partition('\n')
+        # +CMGR: "REC UNREAD","+33612345678","","24/10/19,12:00:00+08"
+        fields = header[6:].split('"')
+        return fields[1], fields[3], text
+
+    async def list_sms_async(self):
+        # Indexes of the stored messages (their status is left unchanged)
+        output = await self._execute_sms_text('listsms')
+        indexes = []
+        for line in output.split('\n'):
+            if line.startswith('+CMGL:'):
+                indexes.append(int(line[6:].split(',')[0]))
+        return indexes
+
+    async def delete_sms_async(self, index):
+        await self.execute_at_command_async('deletesms', index)
+
     def sendSms(self,num,text):
         logger.debug("Set sms in text mode")
         self.execute_at_command('setsmstextmode')
@@ -0,0 +1,222 @@
+"""
+Envoi de SMS en mode PDU par une file d'attente asynchrone.
+
+Les messages sont encodés en SMS-SUBMIT (3GPP TS 23.040) au moment où ils sont mis en file:
+ - texte en alphabet GSM 7 bits (160 caractères par SMS), ou en UCS2 (70 caractères) s'il contient
+   un caractère hors de cet alphabet
+ - données binaires en 8 bits (140 octets par SMS), par exemple un lot de positions au format de
+   telemetry.py
+Un message trop long est découpé en SMS concaténés (en-tête UDH avec une référence sur 8 bits):
+153 caractères, 67 caractères UCS2 ou 134 octets par partie.
+
+La tâche run() envoie les messages dans l'ordre de la file. Chaque partie attend l'invite "> " et
+la réponse +CMGS du modem (voir Modem.send_sms_pdu_async). Une partie refusée est renvoyée après un
+délai croissant. Les messages suivants attendent, pour que les alertes arrivent dans l'ordre. Au
+bout de _MAX_ATTEMPTS échecs, le message est abandonné. Les parties déjà envoyées ne sont pas
+renvoyées.
+"""
+import ubinascii
+import uasyncio as asyncio
+from micropython import const
+
+import logger
+import telemetry
+
+_MAX_QUEUED = const(16)
+_MAX_PARTS = const(8)
+_MAX_ATTEMPTS = const(5)
+_RETRY_DELAY_S = const(30)  # Multiplié par le nombre d'échecs de la partie
+
+_DCS_GSM7 = const(0x00)
+_DCS_8BIT = const(0x04)
+_DCS_UCS2 = const(0x08)
+
+# Alphabet GSM 7 bits par défaut (le caractère d'indice n a le code n), 0x1B étant l'échappement
+# vers la table d'extension
+_GSM7 = ("@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+         "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà")
+_GSM7_EXTENSION = {"\f": 0x0A, "^": 0x14, "{": 0x28, "}": 0x29, "\\": 0x2F, "[": 0x3C, "~": 0x3D,
+                   "]": 0x3E, "|": 0x40, "€": 0x65}
+
+
+"""
+Renvoi: les codes 7 bits du texte, None s'il contient un caractère hors de l'alphabet GSM
+"""
+def gsm7(text):
+    septets = bytearray()
+    for char in text:
+        code = _GSM7.find(char)
+        if code >= 0 and code != 0x1B:
+            septets.append(code)
+        elif char in _GSM7_EXTENSION:
+            septets.append(0x1B)
+            septets.append(_GSM7_EXTENSION[char])
+        else:
+            return None
+    return septets
+
+
+def _pack7(septets, shift):
+    # Septets mis bout à bout, poids faible en premier, après shift bits de bourrage
+    packed = bytearray()
+    acc = 0
+    bits = shift
+    for septet in septets:
+        acc |= septet << bits
+        bits += 7
+        while bits >= 8:
+            packed.append(acc & 0xFF)
+            acc >>= 8
+            bits -= 8
+    if bits:
+        packed.append(acc)
+    return packed
+
+
+def _address(number):
+    # Longueur en chiffres, type (0x91 international), chiffres BCD inversés deux à deux
+    digits = number[1:] if number.startswith("+") else number
+    address = bytearray((len(digits), 0x91 if number.startswith("+") else 0x81))
+    if len(digits) % 2:
+        digits += "F"
+    for i in range(0, len(digits), 2):
+        address.append(int(digits[i + 1] + digits[i], 16))
+    return address
+
+
+def _splitSeptets(septets, size):
+    # Découpe sans séparer un caractère d'extension de son échappement
+    parts = []
+    start = 0
+    while start < len(septets):
+        end = min(start + size, len(septets))
+        if end < len(septets) and septets[end - 1] == 0x1B:
+            end -= 1
+        parts.append(septets[start:end])
+        start = end
+    return parts
+
+
+"""
+Encode un message en une ou plusieurs PDU SMS-SUBMIT. message est un str (texte) ou des bytes
+(données 8 bits). reference: numéro commun aux parties d'un message concaténé (0 à 255).
+Renvoi: liste de (PDU hexadécimale, SMSC compris, longueur de la TPDU en octets)
+"""
+def encode(number, message, reference=0):
+    if isinstance(message, str):
+        septets = gsm7(message)
+        if septets is not None:
+            dcs = _DCS_GSM7
+            parts = [septets] if len(septets) <= 160 else _splitSeptets(septets, 153)
+        else:
+            dcs = _DCS_UCS2
+            data = bytearray()
+            for char in message:
+                code = ord(char)
+                if code > 0xFFFF:  # Hors du plan de base: pas de paires UTF-16
+                    code = 0xFFFD
+                data.append(code >> 8)
+                data.append(code & 0xFF)
+            size = 140 if len(data) <= 140 else 134
+            parts = [data[i:i + size] for i in range(0, len(data), size)]
+    else:
+        dcs = _DCS_8BIT
+        size = 140 if len(message) <= 140 else 134
+        parts = [message[i:i + size] for i in range(0, len(message), size)]
+    if len(parts) > _MAX_PARTS:
+        raise ValueError(f"Message too long ({len(parts)} parts)")
+
+    destination = _address(number)
+    pdus = []
+    for index, part in enumerate(parts):
+        concatenated = len(parts) > 1
+        tpdu = bytearray((0x41 if concatenated else 0x01, 0x00))  # SMS-SUBMIT (+UDHI), référence 0
+        tpdu.extend(destination)
+        tpdu.append(0x00)  # PID
+        tpdu.append(dcs)
+        udh = bytes((0x05, 0x00, 0x03, reference & 0xFF, len(parts), index + 1)) if concatenated else b""
+        if dcs == _DCS_GSM7:
+            # Longueur en septets, l'en-tête de 6 octets occupant 7 septets (1 bit de bourrage)
+            tpdu.append(len(part) + (7 if concatenated else 0))
+            tpdu.extend(udh)
+            tpdu.extend(_pack7(part, 1 if concatenated else 0))
+        else:
+            tpdu.append(len(udh) + len(part))
+            tpdu.extend(udh)
+            tpdu.extend(part)
+        # "00": centre SMS enregistré dans la carte SIM
+        pdus.append((b"00" + ubinascii.hexlify(tpdu).upper(), len(tpdu)))
+    return pdus
+
+
+class SmsOutbox:
+    # monitor: NetworkMonitor, pour attendre l'enregistrement sur le réseau avant d'envoyer
+    def __init__(self, gsm, monitor=None):
+        self.gsm = gsm
+        self.monitor = monitor
+        self.queue = []  # [numéro, PDU restantes, échecs de la partie en cours]
+        self.sent = 0
+        self.failed = 0
+        self._reference = 0
+        self._event = asyncio.Event()
+
+    """
+    Met un message (str ou bytes) en file pour number, sans attendre l'envoi.
+    Renvoi: False si la file est pleine ou le message trop long
+    """
+    def send(self, number, message):
+        if len(self.queue) >= _MAX_QUEUED:
+            logger.warn(f"SMS outbox full, message to {number} dropped", "SmsOutbox")
+            return False
+        self._reference = (self._reference + 1) & 0xFF
+        try:
+            pdus = encode(number, message, self._reference)
+        except ValueError as err:
+            logger.warn(f"SMS to {number} not queued : {err}", "SmsOutbox")
+            return False
+        self.queue.append([number, pdus, 0])
+        self._event.set()
+        return True
+
+    """
+    Met en file des enregistrements "timestamp,lat,lon,vitesse", encodés au format binaire de
+    telemetry.py (une vingtaine de positions par SMS)
+    """
+    def sendPositions(self, number, records):
+        return self.send(number, bytes(telemetry.encodeRecords(records)))
+
+    """
+    Tâche d'envoi, à lancer une fois le modem initialisé
+    """
+    async def run(self):
+        while True:
+            if not self.queue:
+                self._event.clear()
+                await self._event.wait()
+                continue
+            monitor = self.monitor
+            if monitor is not None and monitor.registration is not None and not monitor.isRegistered():
+                await monitor.waitChange(_RETRY_DELAY_S * 1000)
+                continue
+
+            message = self.queue[0]
+            number, pdus, _ = message
+            pdu, length = pdus[0]
+            try:
+                await self.gsm.send_sms_pdu_async(pdu, length)
+            except Exception as err:
+                message[2] += 1
+                if message[2] >= _MAX_ATTEMPTS:
+                    logger.error(f"SMS to {number} dropped after {message[2]} attempts : {err}", "SmsOutbox")
+                    self.queue.pop(0)
+                    self.failed += 1
+                else:
+                    logger.warn(f"SMS to {number} failed : {err}", "SmsOutbox")
+                    await asyncio.sleep(_RETRY_DELAY_S * message[2])
+                continue
+
+            pdus.pop(0)
+            message[2] = 0
+            if not pdus:
+                self.queue.pop(0)
+                self.sent += 1
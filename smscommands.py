@@ -0,0 +1,158 @@
+"""
+Commandes reçues par SMS: interrogation et configuration du tracker à distance.
+
+Le modem annonce chaque SMS reçu par une URC +CMTI (AT+CNMI=2,1). La tâche run() le lit
+(AT+CMGR), exécute la commande si l'expéditeur est dans le setting smsWhitelist, répond par la file
+d'envoi de comManager puis supprime le message (AT+CMGD), même refusé ou invalide, pour que la
+mémoire de la carte SIM ne se remplisse jamais. Les messages reçus avant le démarrage, ou dont l'URC
+a été perdue, sont repris par un relevé des messages stockés (AT+CMGL) au démarrage puis toutes les
+_SCAN_INTERVAL_S secondes, qui réactive aussi les URC après un reset du modem.
+
+Commandes (sans distinction de casse):
+ - POS: dernière position connue, sans attendre de nouveau point
+ - GET <setting>: valeur d'un setting
+ - SET <setting> <valeur>: modifie un setting ("none" pour l'effacer, on/off pour un booléen)
+ - UPLOAD: envoie tout de suite les positions en attente (voir UploadScheduler.force)
+"""
+import utime
+import uasyncio as asyncio
+from micropython import const
+
+import logger
+
+_SCAN_INTERVAL_S = const(600)
+_NUMBER_DIGITS = const(9)  # Chiffres comparés: "+33612345678" et "0612345678" sont le même numéro
+_TRUE = ("1", "on", "true", "yes", "oui")
+_FALSE = ("0", "off", "false", "no", "non")
+
+
+def _digits(number):
+    return "".join(char for char in number if "0" <= char <= "9")
+
+
+class SmsCommands:
+    # getFix(): dernier point (voir GPSManager.getFix), None si aucun
+    def __init__(self, comManager, store, getFix):
+        self.comManager = comManager
+        self.store = store
+        self.getFix = getFix
+        self.pending = []  # Index des messages annoncés, à traiter dans l'ordre
+        self._event = asyncio.Event()
+        comManager.gsm.register_urc(b"+CMTI", self._onCmti)
+
+    def _onCmti(self, line):
+        # +CMTI: "SM",<index>
+        try:
+            index = int(line.split(b",")[-1])
+        except ValueError:
+            return
+        if index not in self.pending:
+            self.pending.append(index)
+        self._event.set()
+
+    """
+    Renvoi: True si number fait partie du setting smsWhitelist
+    """
+    def isAllowed(self, number):
+        whitelist = self.store.get("smsWhitelist")
+        digits = _digits(number)
+        if not whitelist or len(digits) < _NUMBER_DIGITS:
+            return False
+        for allowed in whitelist.split(","):
+            if _digits(allowed)[-_NUMBER_DIGITS:] == digits[-_NUMBER_DIGITS:]:
+                return True
+        return False
+
+    def _position(self):
+        fix = self.getFix()
+        if fix is None:
+            return "POS no fix yet"
+        timestamp, latitude, longitude, speed = fix
+        year, month, day, hours, minutes, seconds = utime.localtime(timestamp)[:6]
+        return (f"POS {latitude:.6f},{longitude:.6f} {speed:.1f} km/h "
+                f"{year}-{month:02d}-{day:02d} {hours:02d}:{minutes:02d}:{seconds:02d} UTC "
+                f"https://maps.google.com/?q={latitude:.6f},{longitude:.6f}")
+
+    def _setting(self, key, text):
+        if text.lower() == "none":
+            return self.store.set(key, None)
+        if self.store.schema[key][0] is bool:
+            if text.lower() in _TRUE:
+                return self.store.set(key, True)
+            if text.lower() in _FALSE:
+                return self.store.set(key, False)
+            return False
+        return self.store.set(key, text)
+
+    """
+    Exécute la commande text.
+    Renvoi: la réponse à envoyer
+    """
+    def execute(self, text):
+        words = text.split(None, 2)
+        command = words[0].upper() if words else ""
+        if command == "POS":
+            return self._position()
+        if command == "UPLOAD":
+            self.comManager.scheduler.force()
+            return "OK upload"
+        if command in ("GET", "SET") and len(words) >= 2:
+            key = words[1]
+            if key not in self.store.schema:
+                return f"ERR unknown setting {key}"
+            if command == "SET":
+                if len(words) < 3 or not self._setting(key, words[2]):
+                    return f"ERR {key}"
+                logger.info(f"Setting {key} changed by SMS", "SmsCommands")
+            return f"{key}={self.store.get(key)}"
+        return "ERR commands: POS, GET <setting>, SET <setting> <value>, UPLOAD"
+
+    async def _process(self, index):
+        gsm = self.comManager.gsm
+        message = await gsm.read_sms_async(index)
+        try:
+            if message is None:
+                return
+            _, sender, text = message
+            if not self.isAllowed(sender):
+                logger.warn(f"SMS from {sender} ignored (not in whitelist)", "SmsCommands")
+                return
+            logger.info(f"SMS command from {sender} : {text}", "SmsCommands")
+            self.comManager.smsOutbox.send(sender, self.execute(text.strip()))
+        finally:
+            await gsm.delete_sms_async(index)
+
+    async def _scan(self):
+        gsm = self.comManager.gsm
+        await gsm.execute_at_command_async("setsmsnotify")
+        for index in await gsm.list_sms_async():
+            if index not in self.pending:
+                self.pending.append(index)
+
+    """
+    Tâche de traitement des SMS reçus
+    """
+    async def run(self):
+        await self.comManager.ready.wait()
+        scanAt = utime.ticks_ms()
+        while True:
+            if utime.ticks_diff(utime.ticks_ms(), scanAt) >= 0:
+                scanAt = utime.ticks_add(utime.ticks_ms(), _SCAN_INTERVAL_S * 1000)
+                try:
+                    await self._scan()
+                except Exception as err:
+                    logger.warn(f"Stored SMS not listed : {err}", "SmsCommands")
+
+            if not self.pending:
+                self._event.clear()
+                try:
+                    await asyncio.wait_for_ms(self._event.wait(), utime.ticks_diff(scanAt, utime.ticks_ms()))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            index = self.pending.pop(0)
+            try:
+                await self._process(index)
+            except Exception as err:
+                logger.warn(f"SMS {index} not processed : {err}", "SmsCommands")
@@ -0,0 +1,128 @@
+"""
+Format binaire compact des lots de positions envoyés au serveur.
+
+Un lot est encodé ainsi:
+ - 1 octet: version du format (VERSION)
+ - varint: nombre de positions
+ - pour chaque position, 4 varints zigzag: timestamp (s), latitude et longitude (degrés x 1e7),
+   vitesse (km/h x 10). La première position est écrite telle quelle (écart à zéro), les suivantes
+   en écart avec la précédente: quelques octets par position pour une trace régulière.
+ - 2 octets: CRC16 XMODEM (big endian) de tout ce qui précède
+
+Les varints sont en base 128, poids faible en premier (bit 7: octet suivant). Le décodeur côté
+serveur est tools/telemetry_decoder.py.
+
+Les enregistrements "timestamp,lat,lon,vitesse" de la file d'envoi sont convertis sans passer par
+les float (simple précision sur l'ESP32, insuffisante pour 1e-7 degré).
+"""
+import ujson
+import utime
+from micropython import const
+
+from sdcard import crc16
+
+VERSION = const(1)
+CONTENT_TYPE = "application/octet-stream"
+
+_LATLON_DIGITS = const(7)
+_SPEED_DIGITS = const(1)
+
+
+def _fixed(text, digits):
+    # "-45.123456" -> -451234560 pour digits=7
+    negative = text.startswith("-")
+    if negative:
+        text = text[1:]
+    parts = text.split(".")
+    fraction = parts[1] if len(parts) > 1 else ""
+    fraction = (fraction + "0" * digits)[:digits]
+    value = int(parts[0] or "0") * 10 ** digits + int(fraction or "0")
+    return -value if negative else value
+
+
+def _putVarint(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _putSigned(buf, value):
+    # zigzag: 0, -1, 1, -2... -> 0, 1, 2, 3...
+    _putVarint(buf, value << 1 if value >= 0 else ((-value) << 1) - 1)
+
+
+"""
+Convertit un enregistrement "timestamp,lat,lon,vitesse" en position entière
+(timestamp, lat x 1e7, lon x 1e7, vitesse x 10)
+"""
+def parseRecord(record):
+    timestamp, latitude, longitude, speed = record.split(",")
+    return (int(timestamp), _fixed(latitude, _LATLON_DIGITS), _fixed(longitude, _LATLON_DIGITS),
+            _fixed(speed, _SPEED_DIGITS))
+
+
+"""
+Encode une liste de positions entières (voir parseRecord) en un lot binaire
+"""
+def encode(fixes):
+    buf = bytearray()
+    buf.append(VERSION)
+    _putVarint(buf, len(fixes))
+    t = lat = lon = speed = 0
+    for fix in fixes:
+        _putSigned(buf, fix[0] - t)
+        _putSigned(buf, fix[1] - lat)
+        _putSigned(buf, fix[2] - lon)
+        _putSigned(buf, fix[3] - speed)
+        t, lat, lon, speed = fix
+    crc = crc16(buf)
+    buf.append(crc >> 8)
+    buf.append(crc & 0xFF)
+    return buf
+
+
+"""
+Encode des enregistrements texte de la file d'envoi en un lot binaire
+"""
+def encodeRecords(records):
+    return encode([parseRecord(record) for record in records])
+
+
+# Corps JSON tel qu'envoyé par comManager.uploadRecords() en format "json"
+def _jsonBody(records):
+    return "[[" + "],[".join(records) + "]]"
+
+
+def _sampleRecords(count):
+    # Trace régulière: une position par seconde à ~50 km/h
+    records = []
+    t = utime.time()
+    lat = 451234560
+    lon = 48765430
+    for i in range(count):
+        records.append("{},{}.{:07d},{}.{:07d},{}.{}".format(
+            t + i, lat // 10000000, lat % 10000000, lon // 10000000, lon % 10000000, 49 + i % 3, i % 10))
+        lat += 97 + i % 5
+        lon -= 131 - i % 7
+    return records
+
+
+"""
+Compare le format binaire et le JSON sur un lot de records enregistrements (ou une trace
+synthétique de count positions), rounds encodages chacun.
+Renvoi: {format: (octets par position, µs d'encodage par position)}
+"""
+def bench(records=None, count=20, rounds=50):
+    if records is None:
+        records = _sampleRecords(count)
+    results = {}
+    for name, encoder in (("json", _jsonBody), ("ujson", lambda r: ujson.dumps([parseRecord(x) for x in r])),
+                          ("binary", encodeRecords)):
+        size = len(encoder(records))
+        t0 = utime.ticks_us()
+        for _ in range(rounds):
+            encoder(records)
+        elapsed = utime.ticks_diff(utime.ticks_us(), t0)
+        results[name] = (size / len(records), elapsed / (rounds * len(records)))
+    return results
@@ -0,0 +1,94 @@
+"""
+Tests de LogStore, à lancer avec le port unix de MicroPython depuis la racine du dépôt:
+
+    micropython -m unittest tests/test_logstore.py
+"""
+import os
+import struct
+import unittest
+
+try:
+    import logstore
+except ImportError:  # Modules MicroPython (utime, micropython) absents: CPython
+    raise unittest.SkipTest("needs MicroPython")
+
+ROOT = "test_logstore.tmp"
+DAY = 86400
+DAY_A = 9000 * DAY  # Minuit, quelle que soit l'epoch (2000 ou 1970)
+DAY_B = DAY_A + DAY
+
+
+def _records(start, count, step=60):
+    return [f"{start + i * step},45.0,4.0,{i}" for i in range(count)]
+
+
+class TestLogStore(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        self.store = logstore.LogStore(ROOT, indexEvery=4, minFree=0)
+
+    def tearDown(self):
+        try:
+            names = os.listdir(ROOT)
+        except OSError:
+            return
+        for name in names:
+            os.remove(ROOT + "/" + name)
+        os.rmdir(ROOT)
+
+    def _append(self, records):
+        for record in records:
+            self.store.append(record)
+
+    def _checkIndex(self):
+        # Chaque entrée d'index pointe sur le début d'une ligne de même timestamp, dans l'ordre
+        for name in self.store.partitions():
+            with open(f"{ROOT}/{name}.idx", "rb") as file:
+                index = file.read()
+            with open(f"{ROOT}/{name}.log", "r") as file:
+                log = file.read()
+            previous = None
+            for i in range(0, len(index), 8):
+                timestamp, offset = struct.unpack("<II", index[i:i + 8])
+                self.assertTrue(offset == 0 or log[offset - 1] == "\n")
+                self.assertEqual(logstore.timestampOf(log[offset:]), timestamp)
+                if previous is not None:
+                    self.assertTrue(timestamp >= previous)
+                previous = timestamp
+
+    def test_day_written_again_after_next_day(self):
+        first = _records(DAY_A + 3600, 10)
+        second = _records(DAY_A + 7200, 10)
+        self._append(first)
+        self._append(_records(DAY_B + 3600, 10))
+        self._append(second)  # Logs rejoués au retour de la carte
+        self._checkIndex()
+
+        self.assertEqual(list(self.store.query(DAY_A, DAY_B - 1)), first + second)
+        self.assertEqual(list(self.store.query(DAY_A + 7200, DAY_A + 7200 + 120)), second[:3])
+        self.assertEqual(list(self.store.query(DAY_A + 3600 + 300, DAY_A + 3600 + 420)), first[5:8])
+
+    def test_timestamp_going_back(self):
+        first = _records(DAY_A + 7200, 10)
+        earlier = _records(DAY_A + 3600, 10)
+        self._append(first)
+        self._append(earlier)
+        self._checkIndex()
+
+        result = list(self.store.query(DAY_A + 3600, DAY_A + 3600 + 120))
+        self.assertEqual(result, earlier[:3])
+        self.assertEqual(sorted(self.store.query(DAY_A, DAY_B - 1)), sorted(first + earlier))
+
+    def test_reopened_store_keeps_order(self):
+        first = _records(DAY_A + 7200, 10)
+        self._append(first)
+        self.store = logstore.LogStore(ROOT, indexEvery=4, minFree=0)
+        earlier = _records(DAY_A + 3600, 5)
+        self._append(earlier)
+
+        self.assertEqual(list(self.store.query(DAY_A + 3600, DAY_A + 3600 + 240)), earlier)
+        self.assertEqual(list(self.store.query(DAY_A + 7200, DAY_A + 7200 + 120)), first[:3])
+
+
+if __name__ == "__main__":
+    unittest.main()
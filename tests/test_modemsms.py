@@ -0,0 +1,56 @@
+"""
+Tests de la lecture des SMS par le driver sim800l, sur le modem simulé (modemsim.py), à lancer
+avec le port unix de MicroPython depuis la racine du dépôt:
+
+    micropython -m unittest tests/test_modemsms.py
+"""
+import unittest
+
+try:
+    import uasyncio as asyncio
+    import modemsim
+    import sim800l
+except ImportError:  # Modules MicroPython (machine, uasyncio...) absents: CPython
+    raise unittest.SkipTest("needs MicroPython")
+
+SENDER = b"+33612345678"
+
+
+class TestModemSms(unittest.TestCase):
+    def setUp(self):
+        self.uart = modemsim.SimUart()
+        self.gsm = sim800l.Modem(self.uart, rst_pin=1)
+        self.gsm.initialized = True
+        self.urcs = []
+        for prefix in (b"RING", b"+CREG", b"+CMTI", b"RDY"):
+            self.gsm.register_urc(prefix, self.urcs.append)
+
+    def _read(self, texts):
+        async def read():
+            messages = []
+            for text in texts:
+                index = self.uart.receive_sms(SENDER, text, notify=False)
+                messages.append(await self.gsm.read_sms_async(index))
+            return messages
+        return asyncio.run(read())
+
+    def test_text_looking_like_urc(self):
+        texts = (b"NORMAL POWER DOWN", b"RDY", b"RING", b"+CREG: 0", b'+CMTI: "SM",9')
+        for text, message in zip(texts, self._read(texts)):
+            self.assertEqual(message, ("REC UNREAD", SENDER.decode(), text.decode()))
+        self.assertTrue(self.gsm.initialized)
+        self.assertEqual(self.urcs, [])
+
+    def test_multiline_text(self):
+        message = self._read([b"SET apn\r\nOK\r\nERROR"])[0]
+        self.assertEqual(message[2], "SET apn\nOK\nERROR")
+
+    def test_list_with_urc_like_text(self):
+        self.uart.receive_sms(SENDER, b"NORMAL POWER DOWN", notify=False)
+        self.uart.receive_sms(SENDER, b"POS", notify=False)
+        self.assertEqual(asyncio.run(self.gsm.list_sms_async()), [1, 2])
+        self.assertTrue(self.gsm.initialized)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Tests de SettingsStore, à lancer avec le port unix de MicroPython (compilé avec btree) depuis la
+racine du dépôt:
+
+    micropython -m unittest tests/test_settingsstore.py
+"""
+import os
+import unittest
+
+try:
+    import settingsstore
+except ImportError:  # Modules MicroPython (uasyncio, micropython) absents: CPython
+    raise unittest.SkipTest("needs MicroPython")
+
+if settingsstore.btree is None:
+    raise unittest.SkipTest("needs btree")
+
+ROOT = "test_settingsstore.tmp"
+
+
+class TestSettingsStore(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(ROOT)
+        settingsstore.SD_PATH = ROOT + "/settings.conf"
+        settingsstore.SD_TMP_PATH = ROOT + "/settings.tmp"
+        settingsstore.FLASH_PATH = ROOT + "/settings.db"
+        self.sdPresent = True
+
+    def tearDown(self):
+        try:
+            names = os.listdir(ROOT)
+        except OSError:
+            return
+        for name in names:
+            os.remove(ROOT + "/" + name)
+        os.rmdir(ROOT)
+
+    def _store(self):
+        store = settingsstore.SettingsStore(lambda: self.sdPresent)
+        store.load()
+        return store
+
+    def test_change_without_card_kept_on_reinsert(self):
+        store = self._store()
+        store.set("apn", "old.apn")
+        store.set("uploadBatch", 30)
+        self.assertTrue(store.save())
+
+        self.sdPresent = False  # Carte retirée
+        store.set("apn", "new.apn")
+        self.assertTrue(store.save())
+
+        self.sdPresent = True  # Carte remise
+        store.load()
+        self.assertEqual(store.get("apn"), "new.apn")
+        self.assertEqual(store.get("uploadBatch"), 30)
+        self.assertTrue(store.save())
+
+        # Écrit sur la carte, et plus repris de la flash ensuite
+        store = self._store()
+        self.assertEqual(store.get("apn"), "new.apn")
+        self.assertFalse(store.flashPending)
+        store.set("apn", "sd.apn")
+        store.save()
+        self.assertEqual(self._store().get("apn"), "sd.apn")
+
+    def test_change_without_card_kept_after_reboot(self):
+        store = self._store()
+        store.set("apn", "old.apn")
+        store.save()
+
+        self.sdPresent = False
+        store = self._store()  # Redémarrage sans carte: lecture de la flash
+        store.set("apn", "new.apn")
+        store.save()
+
+        self.sdPresent = True
+        self.assertEqual(self._store().get("apn"), "new.apn")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+Tests de UploadQueue, à lancer avec le port unix de MicroPython depuis la racine du dépôt:
+
+    micropython -m unittest tests/test_uploadqueue.py
+"""
+import os
+import unittest
+
+try:
+    import uploadqueue
+except ImportError:  # Modules MicroPython (micropython) absents: CPython
+    raise unittest.SkipTest("needs MicroPython")
+
+ROOT = "test_uploadqueue.tmp"
+
+
+class TestUploadQueue(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+
+    def tearDown(self):
+        try:
+            names = os.listdir(ROOT)
+        except OSError:
+            return
+        for name in names:
+            os.remove(ROOT + "/" + name)
+        os.rmdir(ROOT)
+
+    def test_partial_line_dropped_on_reopen(self):
+        queue = uploadqueue.UploadQueue(ROOT)
+        queue.push("1,45.0,4.0,0")
+        queue.push("2,45.0,4.0,0")
+        with open(ROOT + "/00000000.q", "a") as file:  # Coupure au milieu d'une écriture
+            file.write("3,45.0")
+
+        queue = uploadqueue.UploadQueue(ROOT)
+        queue.push("4,45.0,4.0,0")
+        records, _ = queue.peek(10)
+        self.assertEqual(records, ["1,45.0,4.0,0", "2,45.0,4.0,0", "4,45.0,4.0,0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
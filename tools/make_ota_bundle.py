@@ -0,0 +1,57 @@
+"""
+Builds a signed OTA bundle for ota.py (see its docstring for the format) and
+the matching "version" file, to be published under the device otaUrl:
+
+    python3 tools/make_ota_bundle.py --key ota.key --version 1.4.0 \
+        --out publish/ sim800l.py micropyGPS.mpy main.py
+
+The key file holds the shared secret, copied to /ota.key on each tracker.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+
+PROTECTED = ("boot.py",)
+
+
+def build(paths, version, key):
+    files = []
+    contents = []
+    for path in paths:
+        name = os.path.basename(path)
+        if name in PROTECTED:
+            raise SystemExit(f"{name} cannot be updated over the air")
+        with open(path, "rb") as file:
+            data = file.read()
+        files.append([name, len(data), hashlib.sha256(data).hexdigest()])
+        contents.append(data)
+
+    manifest = json.dumps({"version": version, "files": files}, separators=(",", ":")).encode()
+    signature = hmac.new(key, manifest, hashlib.sha256).hexdigest().encode()
+    return signature + b"\n" + manifest + b"\n" + b"".join(contents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a signed OTA bundle")
+    parser.add_argument("--key", required=True, help="file holding the shared HMAC key")
+    parser.add_argument("--version", required=True)
+    parser.add_argument("--out", default=".", help="directory receiving bundle.bin and version")
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    with open(args.key, "rb") as file:
+        key = file.read()
+    bundle = build(args.files, args.version, key)
+
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, "bundle.bin"), "wb") as file:
+        file.write(bundle)
+    with open(os.path.join(args.out, "version"), "w") as file:
+        file.write(args.version)
+    print(f"bundle.bin: {len(bundle)} bytes, {len(args.files)} files, version {args.version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Stand-in for the telemetry server, run on the host (CPython) while testing the
+socket transport through modemsim.SocketBridge.
+
+Listens on the same port in TCP and UDP, prints what it receives and, with
+--echo, sends it back so that the "+RECEIVE" path of the driver is exercised:
+
+    python3 tools/standin_server.py --port 7000 --echo
+"""
+import argparse
+import socket
+import threading
+
+
+def serve_tcp(port, echo):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("", port))
+    server.listen(4)
+    while True:
+        conn, addr = server.accept()
+        threading.Thread(target=handle_tcp, args=(conn, addr, echo), daemon=True).start()
+
+
+def handle_tcp(conn, addr, echo):
+    print(f"TCP {addr[0]}:{addr[1]} connected")
+    with conn:
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            print(f"TCP {addr[0]}:{addr[1]} {len(data)} bytes: {data!r}")
+            if echo:
+                conn.sendall(data)
+    print(f"TCP {addr[0]}:{addr[1]} closed")
+
+
+def serve_udp(port, echo):
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("", port))
+    while True:
+        data, addr = server.recvfrom(4096)
+        print(f"UDP {addr[0]}:{addr[1]} {len(data)} bytes: {data!r}")
+        if echo:
+            server.sendto(data, addr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP/UDP stand-in telemetry server")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--echo", action="store_true", help="send received data back")
+    args = parser.parse_args()
+
+    threading.Thread(target=serve_udp, args=(args.port, args.echo), daemon=True).start()
+    print(f"Listening on TCP and UDP port {args.port}")
+    try:
+        serve_tcp(args.port, args.echo)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Host-side decoder of the binary telemetry batches built by telemetry.py on the
+tracker (see its docstring for the format).
+
+    python3 tools/telemetry_decoder.py batch.bin
+
+decode() can also be imported by the server to parse request bodies sent with
+the "application/octet-stream" content type.
+"""
+import argparse
+import binascii
+import datetime
+
+VERSION = 1
+
+# Timestamps are in the board epoch (MicroPython on ESP32: 2000-01-01)
+EPOCH_2000 = 946684800
+
+
+class TelemetryError(ValueError):
+    pass
+
+
+def _varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise TelemetryError("truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _signed(data, pos):
+    value, pos = _varint(data, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def decode(data):
+    """Returns the fixes of a batch as (timestamp, lat, lon, speed km/h) tuples."""
+    if len(data) < 4:
+        raise TelemetryError("batch too short")
+    crc = binascii.crc_hqx(data[:-2], 0)
+    if crc != int.from_bytes(data[-2:], "big"):
+        raise TelemetryError("CRC mismatch")
+    if data[0] != VERSION:
+        raise TelemetryError(f"unsupported version {data[0]}")
+
+    body = data[:-2]
+    count, pos = _varint(body, 1)
+    fixes = []
+    fix = [0, 0, 0, 0]
+    for _ in range(count):
+        for i in range(4):
+            delta, pos = _signed(body, pos)
+            fix[i] += delta
+        fixes.append((fix[0], fix[1] / 1e7, fix[2] / 1e7, fix[3] / 10))
+    if pos != len(body):
+        raise TelemetryError("trailing bytes after the last fix")
+    return fixes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a binary telemetry batch")
+    parser.add_argument("path")
+    parser.add_argument("--epoch", type=int, default=EPOCH_2000,
+                        help="Unix time of the board epoch (0 if timestamps are Unix)")
+    args = parser.parse_args()
+
+    with open(args.path, "rb") as file:
+        data = file.read()
+    for timestamp, latitude, longitude, speed in decode(data):
+        when = datetime.datetime.fromtimestamp(timestamp + args.epoch, datetime.timezone.utc)
+        print(f"{when.isoformat()} {latitude:.7f} {longitude:.7f} {speed:.1f} km/h")
+
+
+if __name__ == "__main__":
+    main()
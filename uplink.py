@@ -0,0 +1,152 @@
+"""
+Ordonnancement des envois au serveur selon la qualité mesurée du lien.
+
+Chaque envoi (requête HTTP ou envoi sur socket) est enregistré avec sa durée (temps radio, de
+la requête à la réponse), son résultat et la bande de signal (CSQ relevé par NetworkMonitor) au
+moment de l'envoi. Un échec d'ouverture de la porteuse n'est pas un envoi: la taille du lot n'y est
+pour rien et il n'est pas enregistré.
+
+Taille des lots: pour chaque bande, le rendement (positions livrées par seconde de radio, 0 pour
+un envoi raté) est suivi en moyenne glissante pour chaque taille de _LEVELS. Après un envoi réussi
+d'un lot complet, la taille monte d'un cran tant que le cran suivant n'est pas connu comme moins
+bon, et redescend si le cran inférieur fait mieux. Après un échec, elle redescend d'un cran: sur
+un lien limite, les petits lots passent quand les gros échouent.
+
+Moment des envois: un lot est retenu tant qu'il n'est pas complet, ou que le signal est faible
+(rendement de la bande actuelle inférieur à _HOLD_RATIO fois celui de la meilleure bande), sauf
+si sa plus ancienne position a plus de maxAgeS secondes ou si un envoi a été forcé (force()).
+"""
+import utime
+import uasyncio as asyncio
+from micropython import const
+
+_LEVELS = (5, 10, 20, 50, 100)  # Tailles de lot essayées
+_START_LEVEL = const(2)
+_BANDS = (10, 15, 20)  # Seuils de CSQ des bandes de signal, la bande 0 étant le signal inconnu
+_RSSI_UNKNOWN = const(99)
+_HOLD_RATIO = 0.5
+
+
+class UploadScheduler:
+    def __init__(self, monitor):
+        self.monitor = monitor
+        bands = len(_BANDS) + 2
+        self.requests = [0] * bands
+        self.successes = [0] * bands
+        self.rttMs = [None] * bands  # Durée moyenne d'un envoi réussi
+        self.efficiency = [[None] * len(_LEVELS) for _ in range(bands)]  # Positions livrées par seconde
+        self.levels = [_START_LEVEL] * bands
+        self.forced = False
+        self._event = asyncio.Event()
+        self._band = 0
+        self._level = _START_LEVEL
+        self._lastTimestamp = None
+        self._lastTicks = 0
+
+    def band(self):
+        rssi = self.monitor.rssi
+        if rssi is None or rssi == _RSSI_UNKNOWN:
+            return 0
+        band = 1
+        for threshold in _BANDS:
+            if rssi >= threshold:
+                band += 1
+        return band
+
+    # Appelé à chaque nouvelle position: horloge des enregistrements (voir age())
+    def noteTimestamp(self, timestamp):
+        self._lastTimestamp = timestamp
+        self._lastTicks = utime.ticks_ms()
+
+    """
+    Renvoi: âge en secondes de l'enregistrement "timestamp,...", None si l'heure GPS n'est pas
+    encore connue depuis le démarrage
+    """
+    def age(self, record):
+        if self._lastTimestamp is None:
+            return None
+        now = self._lastTimestamp + utime.ticks_diff(utime.ticks_ms(), self._lastTicks) // 1000
+        return now - int(record.split(",", 1)[0])
+
+    """
+    Envoie les files sans attendre de lot complet ni de meilleur signal, jusqu'à ce qu'elles soient vides
+    """
+    def force(self):
+        self.forced = True
+        self._event.set()
+
+    """
+    Attend au plus seconds secondes, ou un envoi forcé
+    """
+    async def wait(self, seconds):
+        self._event.clear()
+        try:
+            await asyncio.wait_for_ms(self._event.wait(), seconds * 1000)
+        except asyncio.TimeoutError:
+            pass
+
+    """
+    Taille du prochain lot pour le signal actuel, au plus maxBatch
+    """
+    def batchSize(self, maxBatch):
+        self._band = self.band()
+        self._level = self.levels[self._band]
+        return max(1, min(_LEVELS[self._level], maxBatch))
+
+    def _isWeak(self, band):
+        best = 0
+        for levels in self.efficiency:
+            for value in levels:
+                if value is not None and value > best:
+                    best = value
+        current = [value for value in self.efficiency[band] if value is not None]
+        if not current:  # Bande jamais essayée: on apprend en envoyant
+            return band == 0 and self.monitor.rssi == _RSSI_UNKNOWN
+        return max(current) < _HOLD_RATIO * best
+
+    """
+    Renvoi: True si le lot records (lu avec la taille batch) doit partir maintenant
+    """
+    def shouldSend(self, records, batch, maxAgeS):
+        if self.forced:
+            return True
+        age = self.age(records[0])
+        if age is None or age >= maxAgeS:
+            return True
+        return len(records) >= batch and not self._isWeak(self._band)
+
+    """
+    Enregistre le résultat d'un envoi de count positions (lot de taille batch) qui a duré ms
+    """
+    def record(self, count, batch, ms, ok, maxBatch):
+        band = self._band
+        level = self._level
+        self.requests[band] += 1
+        if ok:
+            self.successes[band] += 1
+            rtt = self.rttMs[band]
+            self.rttMs[band] = ms if rtt is None else (3 * rtt + ms) // 4
+        if count < batch:
+            # Lot partiel (forcé ou trop vieux): rendement non comparable, seul un échec fait descendre
+            if not ok:
+                self.levels[band] = max(0, level - 1)
+            return
+
+        efficiency = self.efficiency[band]
+        value = count * 1000 / max(ms, 1) if ok else 0
+        efficiency[level] = value if efficiency[level] is None else (3 * efficiency[level] + value) / 4
+        if not ok:
+            level = max(0, level - 1)
+        elif level + 1 < len(_LEVELS) and _LEVELS[level] < maxBatch and \
+                (efficiency[level + 1] is None or efficiency[level + 1] >= efficiency[level]):
+            level += 1
+        elif level and efficiency[level - 1] is not None and efficiency[level - 1] > efficiency[level]:
+            level -= 1
+        self.levels[band] = level
+
+    """
+    Renvoi: pour chaque bande de signal, (envois, réussis, durée moyenne en ms, taille de lot)
+    """
+    def stats(self):
+        return [(self.requests[band], self.successes[band], self.rttMs[band], _LEVELS[self.levels[band]])
+                for band in range(len(self.levels))]
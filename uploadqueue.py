@@ -0,0 +1,160 @@
+"""
+File d'attente persistante des enregistrements à envoyer au serveur (store-and-forward).
+
+Les enregistrements sont des lignes de texte ajoutées dans des fichiers segments
+<root>/NNNNNNNN.q de taille bornée. Un curseur (segment, offset) persistant dans <root>/cursor
+indique le premier enregistrement non acquitté: il n'avance que quand le serveur a confirmé la
+réception d'un lot (ack), et survit au redémarrage. Les segments entièrement acquittés sont
+supprimés.
+
+Une coupure pendant une écriture peut laisser une ligne tronquée à la fin du dernier segment: elle
+est retirée à l'ouverture de la file, pour que l'enregistrement suivant ne s'y colle pas.
+
+La RAM utilisée ne dépend que de la taille des lots lus par peek(), pas de la durée sans réseau.
+maxSegments (0: illimité) borne la place prise sur le support: au-delà, le plus ancien segment
+est abandonné.
+"""
+import os
+from micropython import const
+
+import logger
+
+_SEGMENT_SIZE = const(8192)
+
+
+class UploadQueue:
+    def __init__(self, root, segmentSize=_SEGMENT_SIZE, maxSegments=0):
+        self.root = root
+        self.segmentSize = segmentSize
+        self.maxSegments = maxSegments
+
+        try:
+            os.mkdir(root)
+        except OSError:  # Existe déjà
+            pass
+
+        segments = self.segments()
+        self.writeSegment = segments[-1] if segments else 0
+        try:
+            self.writeSize = os.stat(self._path(self.writeSegment))[6]
+        except OSError:
+            self.writeSize = 0
+        if self.writeSize:
+            self._dropPartialLine()
+        self.cursor = self._loadCursor(segments[0] if segments else 0)
+
+    def _path(self, segment):
+        return "{}/{:08d}.q".format(self.root, segment)
+
+    """
+    Numéros des segments présents, du plus ancien au plus récent
+    """
+    def segments(self):
+        segments = [int(name[:-2]) for name in os.listdir(self.root) if name.endswith(".q")]
+        segments.sort()
+        return segments
+
+    def _dropPartialLine(self):
+        path = self._path(self.writeSegment)
+        with open(path, "rb") as file:
+            file.seek(self.writeSize - 1)
+            if file.read(1) == b"\n":
+                return
+            file.seek(0)
+            data = file.read()
+        end = data.rfind(b"\n") + 1
+        with open(path + ".tmp", "wb") as file:
+            file.write(data[:end])
+        os.remove(path)
+        os.rename(path + ".tmp", path)
+        logger.warn(f"Truncated record dropped from segment {self.writeSegment}", "UploadQueue")
+        self.writeSize = end
+
+    def _loadCursor(self, default):
+        # Comme pour les settings, le fichier temporaire complet est repris si le renommage a été coupé
+        for name in ("/cursor", "/cursor.tmp"):
+            try:
+                with open(self.root + name, "r") as file:
+                    segment, offset = file.read().split(",")
+                return int(segment), int(offset)
+            except (OSError, ValueError):
+                continue
+        return default, 0
+
+    def _saveCursor(self):
+        with open(self.root + "/cursor.tmp", "w") as file:
+            file.write("{},{}".format(self.cursor[0], self.cursor[1]))
+        try:
+            os.remove(self.root + "/cursor")
+        except OSError:
+            pass
+        os.rename(self.root + "/cursor.tmp", self.root + "/cursor")
+
+    def isEmpty(self):
+        return self.cursor[0] > self.writeSegment or \
+            (self.cursor[0] == self.writeSegment and self.cursor[1] >= self.writeSize)
+
+    """
+    Ajoute un enregistrement (ligne sans retour à la ligne) à la fin de la file
+    """
+    def push(self, record):
+        if self.writeSize >= self.segmentSize:
+            self.writeSegment += 1
+            self.writeSize = 0
+            if self.maxSegments:
+                self._dropOverflow()
+        with open(self._path(self.writeSegment), "a") as file:
+            file.write(record)
+            file.write("\n")
+        self.writeSize += len(record) + 1
+
+    def _dropOverflow(self):
+        segments = self.segments()
+        while len(segments) >= self.maxSegments:
+            oldest = segments.pop(0)
+            os.remove(self._path(oldest))
+            logger.warn(f"Upload queue full, segment {oldest} dropped", "UploadQueue")
+            if self.cursor[0] <= oldest:
+                self.cursor = (oldest + 1, 0)
+                self._saveCursor()
+
+    """
+    Lit au plus maxRecords enregistrements à partir du curseur, sans le déplacer.
+    Renvoi: (liste des enregistrements, curseur à passer à ack() une fois le lot envoyé)
+    """
+    def peek(self, maxRecords):
+        records = []
+        segment, offset = self.cursor
+        while len(records) < maxRecords and segment <= self.writeSegment:
+            try:
+                file = open(self._path(segment), "r")
+            except OSError:  # Segment supprimé
+                segment += 1
+                offset = 0
+                continue
+            with file:
+                file.seek(offset)
+                while len(records) < maxRecords:
+                    line = file.readline()
+                    if not line.endswith("\n"):  # Fin du segment, ou ligne tronquée par une coupure
+                        break
+                    offset += len(line)
+                    records.append(line[:-1])
+            if len(records) < maxRecords and segment < self.writeSegment:
+                segment += 1
+                offset = 0
+            else:
+                break
+        return records, (segment, offset)
+
+    """
+    Acquitte tous les enregistrements jusqu'à cursor (renvoyé par peek()) et supprime les
+    segments qui ne contiennent plus rien à envoyer
+    """
+    def ack(self, cursor):
+        self.cursor = cursor
+        self._saveCursor()
+        for segment in self.segments():
+            if segment >= cursor[0] or segment == self.writeSegment:
+                break
+            os.remove(self._path(segment))